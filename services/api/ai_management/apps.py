@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+def bump_sam_config_version(sender, **kwargs):
+    """La instantánea en proceso de configuración/modelos deja de valer"""
+    from .config_cache import bump_config_version
+    bump_config_version()
+
+
+class AiManagementConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'ai_management'
+
+    def ready(self):
+        for model_name in ('SamConfiguration', 'AIModel'):
+            model = self.get_model(model_name)
+            post_save.connect(bump_sam_config_version, sender=model)
+            post_delete.connect(bump_sam_config_version, sender=model)
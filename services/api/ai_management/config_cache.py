@@ -0,0 +1,105 @@
+"""Caché en proceso de `SamConfiguration` y de los `AIModel` activos.
+
+Cada `SamService()` hacía un `get_or_create` de la configuración y el
+enrutamiento listaba los modelos activos: dos o tres consultas por llamada a
+Sam en búsqueda, plusvalía y categorización. Ahora cada proceso guarda una
+instantánea (configuración con `current_model` ya cargado + modelos activos)
+y solo la recarga cuando cambia la versión compartida en la caché de Django.
+
+La versión se incrementa con las señales `post_save`/`post_delete` de ambos
+modelos (edición desde `SamConfigurationViewSet`/`AIModelViewSet`, admin o
+`populate_defaults`), así todos los procesos ven el cambio en la siguiente
+llamada. Tras vaciar la caché la versión arranca en otro valor y también se
+recarga.
+
+Las instancias son compartidas entre hilos: tratarlas como de solo lectura.
+Las reparaciones de configuración incompleta (sin `current_model`, modelo sin
+`api_name`) se hacen en `_load`, sobre las instancias recién leídas y antes de
+publicarlas.
+"""
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'ai_management:config_version'
+DEFAULT_API_NAME = 'gemini-2.5-flash-lite'
+
+_snapshot = None  # (versión, configuración, modelos activos)
+_lock = threading.Lock()
+
+
+def get_config_version() -> int:
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        initial = int(time.time() * 1000)
+        cache.add(VERSION_KEY, initial, timeout=None)
+        version = cache.get(VERSION_KEY) or initial
+    return int(version)
+
+
+def bump_config_version():
+    """Invalida la instantánea de todos los procesos."""
+    try:
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        cache.incr(VERSION_KEY)
+    except Exception:
+        logger.warning("[SamConfigCache] No se pudo incrementar la versión de la configuración")
+
+
+def _load():
+    from .models import AIModel, SamConfiguration
+
+    config = SamConfiguration.objects.select_related('current_model').filter(pk=1).first()
+    if config is None:
+        config = SamConfiguration.get_config()
+    models = list(AIModel.objects.filter(is_active=True).order_by('id'))
+    _repair(config, models)
+    return config, models
+
+
+def _repair(config, models):
+    """Completa la configuración recién cargada y lo persiste con UPDATE (sin señales ni recarga)."""
+    from .models import AIModel, SamConfiguration
+
+    if config.current_model is None and models:
+        config.current_model = models[0]
+        SamConfiguration.objects.filter(pk=config.pk, current_model__isnull=True).update(current_model=models[0])
+        logger.info(f"[SamConfigCache] Sin modelo configurado; se usa {models[0].api_name or models[0].name}")
+    model = config.current_model
+    if model is not None and not model.api_name:
+        for candidate in [model, *models]:
+            if candidate.pk == model.pk:
+                candidate.api_name = DEFAULT_API_NAME
+        try:
+            with transaction.atomic():
+                AIModel.objects.filter(pk=model.pk, api_name='').update(api_name=DEFAULT_API_NAME)
+        except DatabaseError as e:  # api_name es único: otro modelo puede tenerlo ya
+            logger.warning(f"[SamConfigCache] No se pudo guardar api_name por defecto del modelo {model.pk}: {e}")
+
+
+def _get_snapshot():
+    global _snapshot
+    version = get_config_version()
+    snapshot = _snapshot
+    if snapshot is None or snapshot[0] != version:
+        with _lock:
+            if _snapshot is None or _snapshot[0] != version:
+                config, models = _load()
+                _snapshot = (version, config, models)
+            snapshot = _snapshot
+    return snapshot
+
+
+def get_sam_config():
+    """`SamConfiguration` vigente (con `current_model` cargado), sin consultas en caliente."""
+    return _get_snapshot()[1]
+
+
+def get_active_models() -> list:
+    """Modelos activos ordenados por ID, sin consultas en caliente."""
+    return _get_snapshot()[2]
@@ -1,12 +1,25 @@
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 import json
 import logging
 import time
 import random
 from django.db.models import Q
-from .models import SamConfiguration, AIModel, AIUsageLog
-from properties.models import Property
+from .config_cache import get_active_models, get_sam_config
+from .llm_transport import (
+    TRANSPORT_ERRORS,
+    LLMUnavailableError,
+    asleep_within_deadline,
+    base_url,
+    get_async_transport,
+    get_transport,
+    sleep_within_deadline,
+)
+from .routing import decide_route
+from .token_budget import estimate_tokens, fit_messages, prompt_budget
+from .usage_buffer import record_usage
+from properties.prompt_context import get_property_context, get_relevant_property_context
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +30,9 @@ class GeminiServiceError(Exception):
         self.status_code = status_code
         self.details = details
 
+class SamUnavailableError(GeminiServiceError):
+    """Gemini no se llamó (circuito abierto, sin cupo o plazo agotado): usar respaldo."""
+
 class SamService:
     """Enhanced Gemini service that uses Sam configuration"""
     
@@ -27,14 +43,14 @@ class SamService:
             raise GeminiServiceError("API key for Gemini service is not configured.", 
                                    details="Verifique la configuración de GOOGLE_GEMINI_API_KEY en el archivo .env")
         
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+        self.base_url = base_url() + "/models/{model}:generateContent"
+        self.stream_url = base_url() + "/models/{model}:streamGenerateContent"
+        self.transport = get_transport()
         self.max_retries = 3
         self.retry_delay = 2  # segundos
         
-        # Get Sam configuration
-        self.sam_config = SamConfiguration.get_config()
-        # Cache basic model lookup to minimize DB hits
-        self._cached_models = None
+        # Sam configuration and active models come from the per-process snapshot (no queries when warm)
+        self.sam_config = get_sam_config()
         
     def _extract_user_text(self, candidate, prefer_json=False):
         """Extract the user-facing text from a Gemini candidate.
@@ -92,38 +108,19 @@ class SamService:
                 return ''
 
     def _get_current_model(self):
-        """Get the currently configured model for Sam"""
+        """Get the currently configured model for Sam (repaired on load by config_cache)"""
         if not self.sam_config.current_model:
-            # Fallback to first active model
-            try:
-                fallback_model = AIModel.objects.filter(is_active=True).first()
-                if fallback_model:
-                    self.sam_config.current_model = fallback_model
-                    self.sam_config.save()
-                else:
-                    raise GeminiServiceError("No hay modelos activos configurados")
-            except Exception as e:
-                logger.error(f"Error getting fallback model: {e}")
-                raise GeminiServiceError("No se pudo obtener un modelo activo")
-        # Ensure api_name defaults to Gemini 2.5 Flash-Lite if missing
-        if not getattr(self.sam_config.current_model, 'api_name', None):
-            self.sam_config.current_model.api_name = 'gemini-2.5-flash-lite'
-            try:
-                self.sam_config.current_model.save(update_fields=['api_name'])
-            except Exception:
-                pass
+            raise GeminiServiceError("No hay modelos activos configurados")
         return self.sam_config.current_model
 
     # -----------------------------
     # Model router helpers
     # -----------------------------
     def _list_active_models(self):
-        if self._cached_models is None:
-            try:
-                self._cached_models = list(AIModel.objects.filter(is_active=True))
-            except Exception:
-                self._cached_models = []
-        return self._cached_models
+        try:
+            return get_active_models()
+        except Exception:
+            return []
 
     def _find_model_by_keyword(self, keyword_candidates):
         """Find first active 2.5 model whose api_name contains any keyword (case-insensitive)."""
@@ -168,7 +165,10 @@ class SamService:
         params = {"key": self.api_key}
 
         start_time = time.time()
-        response = requests.post(url, json=request_data, headers=headers, params=params, timeout=18)
+        try:
+            response = self.transport.post(url, json=request_data, headers=headers, params=params, timeout=18)
+        except LLMUnavailableError as e:
+            raise SamUnavailableError(str(e))
         response_time_ms = int((time.time() - start_time) * 1000)
 
         if response.status_code != 200:
@@ -200,8 +200,8 @@ class SamService:
             'response_time_ms': response_time_ms,
         }
 
-    def _route_model(self, user_message, request_type="chat"):
-        """Classify task complexity using a fast router model and return target model instance."""
+    def _ask_router_model(self, user_message, request_type="chat"):
+        """Consulta al modelo enrutador y devuelve la etiqueta lite|flash|pro."""
         router_model = self._get_router_model()
         system = (
             "Eres un enrutador de modelos. Clasifica la petición en JSON: {\n"
@@ -214,22 +214,28 @@ class SamService:
             {"role": "user", "parts": [{"text": system}]},
             {"role": "user", "parts": [{"text": f"Tarea ({request_type}): {user_message}"}]},
         ]
-        try:
-            text, _ = self._simple_request(router_model, messages, request_type="router")
-            # Expect strict JSON; if parse fails, default to flash (no heuristics)
-            obj = json.loads(text.strip().strip('`'))
-            route = (obj.get('route') or 'flash').lower()
-            return self._pick_target_model(route)
-        except Exception:
-            # conservative fallback
+        text, _ = self._simple_request(router_model, messages, request_type="router")
+        # Expect strict JSON; if parse fails the caller falls back to the configured model
+        obj = json.loads(text.strip().strip('`'))
+        return (obj.get('route') or 'flash').lower()
+
+    def _route_model(self, user_message, request_type="chat"):
+        """Choose the target model: rules, heuristics and cached verdicts before the router LLM."""
+        route, path = decide_route(user_message, request_type, self._ask_router_model)
+        logger.debug(f"[SamService] Ruta {route or 'default'} para {request_type} (vía {path})")
+        if route is None:
             return self._get_current_model()
-    
-    def _get_system_prompt(self):
+        return self._pick_target_model(route)
+
+    def _get_system_prompt(self, user_message=None, request_type="chat"):
         """Get the system prompt for Sam"""
         base_prompt = self.sam_config.custom_instructions or "Eres Sam, el asistente de IA de SkyTerra. Ayudas a los usuarios a encontrar propiedades y responder preguntas sobre bienes raíces."
         
-        # Add property context
-        property_context = self._get_property_context()
+        # Add property context (the AI search prompt already carries its own shortlist)
+        if request_type == "ai_property_search":
+            property_context = "Incluido en el mensaje del usuario."
+        else:
+            property_context = self._get_property_context(user_message)
         
         return f"""{base_prompt}
 
@@ -245,40 +251,18 @@ Instrucciones específicas:
 - No muestres tu razonamiento ni pensamientos internos; entrega solo la respuesta final dirigida al usuario
 """
     
-    def _get_property_context(self):
-        """Get property information for context"""
-        try:
-            properties = Property.objects.all()[:20]  # Limit to 20 properties
-            
-            if not properties.exists():
-                return "No hay propiedades disponibles en la base de datos actualmente."
-            
-            property_list = []
-            for prop in properties:
-                property_info = {
-                    'id': prop.id,
-                    'name': prop.name,
-                    'type': getattr(prop, 'type', None),
-                    'price': float(prop.price),
-                    'size': prop.size,
-                    'has_water': prop.has_water,
-                    'has_views': prop.has_views,
-                    'description': prop.description[:100] + "..." if len(prop.description) > 100 else prop.description,
-                    'location': f"Lat: {prop.latitude}, Lng: {prop.longitude}" if prop.latitude and prop.longitude else "Ubicación no especificada"
-                }
-                property_list.append(property_info)
-            
-            return json.dumps(property_list, indent=2)
-        except Exception as e:
-            logger.error(f"Error obteniendo contexto de propiedades: {e}")
-            return "Error al obtener información de propiedades."
+    def _get_property_context(self, user_message=None):
+        """Compact property context: listings retrieved for the message, or the cached general table"""
+        if user_message:
+            return get_relevant_property_context(user_message)
+        return get_property_context()
     
     def _log_usage(self, model, tokens_input, tokens_output, cost, response_time_ms, success=True, error_message="", request_type="chat", user=None):
-        """Log AI usage for monitoring"""
+        """Queue AI usage for the batched writer (see usage_buffer); never blocks on the DB"""
         try:
-            AIUsageLog.objects.create(
-                user=user,
-                model_used=model,
+            record_usage(
+                user_id=getattr(user, 'pk', None),
+                model_used_id=model.pk,
                 request_type=request_type,
                 tokens_input=tokens_input,
                 tokens_output=tokens_output,
@@ -291,8 +275,8 @@ Instrucciones específicas:
             logger.error(f"Error logging usage: {e}")
     
     def _estimate_tokens(self, text):
-        """Estimate token count (rough approximation)"""
-        return len(text.split()) * 1.3  # Rough estimation
+        """Estimate token count (see token_budget.estimate_tokens)"""
+        return estimate_tokens(text)
     
     def _calculate_cost(self, model, tokens_input, tokens_output):
         """Calculate the cost of the request"""
@@ -300,21 +284,12 @@ Instrucciones específicas:
         cost_output = (tokens_output / 1000) * float(model.price_per_1k_tokens_output)
         return cost_input + cost_output
     
-    def generate_response(self, user_message, user=None, conversation_history=None, request_type="chat"):
-        """Generate response using Sam configuration with dynamic model routing"""
-        if not self.sam_config.is_enabled:
-            raise GeminiServiceError("Sam está deshabilitado actualmente")
-        
-        # Select target model via router (fast classification)
-        user_message_clean = (user_message or "").strip()
+    def _build_messages(self, system_prompt, user_message_clean, conversation_history=None, model=None):
+        """Build the Gemini `contents` list: system prompt, history fitted to the token budget and user message.
 
-        model = self._route_model(user_message_clean, request_type=request_type)
-        system_prompt = self._get_system_prompt()
-        
-        # Build conversation
-        messages = [{"role": "user", "parts": [{"text": system_prompt}]}]
-
-        # Add conversation history if provided
+        Returns `(messages, budget_report)`; see token_budget.fit_messages.
+        """
+        history = []
         if conversation_history:
             configured_history = getattr(self.sam_config, 'max_history_messages', None)
             try:
@@ -327,8 +302,7 @@ Instrucciones específicas:
                 # mantenemos al menos un pequeño historial para preservar el contexto.
                 configured_history = 10
 
-            trimmed_history = conversation_history[-configured_history:]
-            for msg in trimmed_history:
+            for msg in conversation_history[-configured_history:]:
                 content = (msg.get("content") or "").strip()
                 if not content:
                     continue
@@ -338,15 +312,24 @@ Instrucciones específicas:
                 elif role != "user":
                     role = "user"
                 # Gemini expects model replies to arrive as role="model", so normalise stored history.
-                messages.append({"role": role, "parts": [{"text": content}]})
+                history.append((role, content))
+
+        # The count limit alone lets long turns blow up the prompt: fit what is left to the model's budget
+        history, report = fit_messages(system_prompt, user_message_clean, history, prompt_budget(model))
+        if report['tokens_saved']:
+            logger.info(
+                f"[SamService] Historial ajustado al presupuesto ({report['budget']} tokens): "
+                f"{report['tokens_before']} -> {report['tokens_after']}, {report['dropped']} mensajes fuera"
+            )
 
+        messages = [{"role": "user", "parts": [{"text": system_prompt}]}]
+        messages.extend({"role": role, "parts": [{"text": text}]} for role, text in history)
         # Add current user message
         messages.append({"role": "user", "parts": [{"text": user_message_clean}]})
-        
-        # Prepare the request
-        url = self.base_url.format(model=model.api_name)
-        
-        request_data = {
+        return messages, report
+
+    def _build_request_data(self, model, messages):
+        return {
             "contents": messages,
             "generationConfig": {
                 "temperature": self.sam_config.response_temperature,
@@ -355,8 +338,88 @@ Instrucciones específicas:
                 "topP": 0.95,
             }
         }
+
+    def _prepare_request(self, user_message, conversation_history=None, request_type="chat"):
+        """Route the message and build the Gemini payload (sync: touches the ORM and maybe the router)"""
+        if not self.sam_config.is_enabled:
+            raise GeminiServiceError("Sam está deshabilitado actualmente")
+        if not self.transport.available():
+            # Ni siquiera enrutar: el llamador responde con su respaldo
+            raise SamUnavailableError("Circuito abierto: la API de Gemini viene fallando")
         
+        # Select target model via router (fast classification)
+        user_message_clean = (user_message or "").strip()
+
+        model = self._route_model(user_message_clean, request_type=request_type)
+        system_prompt = self._get_system_prompt(user_message_clean, request_type)
+        
+        messages, budget = self._build_messages(system_prompt, user_message_clean, conversation_history, model)
         # Legacy "thinking" flag removed because Gemini 2.5 rejects it; rely on defaults.
+        return {
+            'model': model,
+            'user_message_clean': user_message_clean,
+            'system_prompt': system_prompt,
+            'messages': messages,
+            'prompt_tokens': budget['tokens_after'],
+            'prompt_tokens_saved': budget['tokens_saved'],
+            'request_data': self._build_request_data(model, messages),
+        }
+
+    def _build_result(self, prepared, response_data, response_time_ms, request_type="chat", user=None):
+        """Turn a 200 generateContent payload into the result dict (logging usage), or raise"""
+        model = prepared['model']
+        # Extract the text response
+        if 'candidates' in response_data and response_data['candidates']:
+            candidate = response_data['candidates'][0]
+            if 'content' in candidate and 'parts' in candidate['content']:
+                # Prefer JSON for search/classification; otherwise user-facing chat text
+                prefer_json = str(request_type).lower() in {
+                    'search', 'ai_property_search', 'ai_property_classification'
+                }
+                generated_text = self._extract_user_text(candidate, prefer_json=prefer_json)
+                
+                # Estimate tokens and calculate cost
+                tokens_input = prepared['prompt_tokens']
+                tokens_output = self._estimate_tokens(generated_text)
+                cost = self._calculate_cost(model, tokens_input, tokens_output)
+                
+                # Log usage
+                self._log_usage(
+                    model=model,
+                    tokens_input=int(tokens_input),
+                    tokens_output=int(tokens_output),
+                    cost=cost,
+                    response_time_ms=response_time_ms,
+                    success=True,
+                    request_type=request_type,
+                    user=user
+                )
+                
+                logger.info(f"[SamService] Respuesta generada exitosamente. Tokens: {int(tokens_input)}/{int(tokens_output)}, Costo: ${cost:.6f}")
+                
+                return {
+                    'response': generated_text,
+                    'model_used': model.name,
+                    'tokens_input': int(tokens_input),
+                    'tokens_output': int(tokens_output),
+                    'cost': cost,
+                    'response_time_ms': response_time_ms,
+                    'prompt_tokens_saved': prepared['prompt_tokens_saved'],
+                }
+        
+        # If we get here, the response format was unexpected
+        error_msg = f"Formato de respuesta inesperado: {response_data}"
+        self._log_usage(model, 0, 0, 0, response_time_ms, False, error_msg, request_type, user)
+        raise GeminiServiceError(error_msg, 200, response_data)
+
+    def generate_response(self, user_message, user=None, conversation_history=None, request_type="chat"):
+        """Generate response using Sam configuration with dynamic model routing"""
+        prepared = self._prepare_request(user_message, conversation_history, request_type)
+        model = prepared['model']
+        
+        # Prepare the request
+        url = self.base_url.format(model=model.api_name)
+        request_data = prepared['request_data']
         
         headers = {
             "Content-Type": "application/json",
@@ -373,78 +436,38 @@ Instrucciones específicas:
             try:
                 logger.info(f"[SamService] Enviando solicitud a {model.name}, intento {attempt + 1}/{self.max_retries}")
                 
-                response = requests.post(url, json=request_data, headers=headers, params=params, timeout=30)
+                response = self.transport.post(url, json=request_data, headers=headers, params=params, timeout=30)
                 response_time_ms = int((time.time() - start_time) * 1000)
                 
                 if response.status_code == 200:
-                    response_data = response.json()
-                    
-                    # Extract the text response
-                    if 'candidates' in response_data and response_data['candidates']:
-                        candidate = response_data['candidates'][0]
-                        if 'content' in candidate and 'parts' in candidate['content']:
-                            # Prefer JSON for search/classification; otherwise user-facing chat text
-                            prefer_json = str(request_type).lower() in {
-                                'search', 'ai_property_search', 'ai_property_classification'
-                            }
-                            generated_text = self._extract_user_text(candidate, prefer_json=prefer_json)
-                            
-                            # Estimate tokens and calculate cost
-                            tokens_input = self._estimate_tokens(system_prompt + user_message_clean)
-                            tokens_output = self._estimate_tokens(generated_text)
-                            cost = self._calculate_cost(model, tokens_input, tokens_output)
-                            
-                            # Log usage
-                            self._log_usage(
-                                model=model,
-                                tokens_input=int(tokens_input),
-                                tokens_output=int(tokens_output),
-                                cost=cost,
-                                response_time_ms=response_time_ms,
-                                success=True,
-                                request_type=request_type,
-                                user=user
-                            )
-                            
-                            logger.info(f"[SamService] Respuesta generada exitosamente. Tokens: {int(tokens_input)}/{int(tokens_output)}, Costo: ${cost:.6f}")
-                            
-                            return {
-                                'response': generated_text,
-                                'model_used': model.name,
-                                'tokens_input': int(tokens_input),
-                                'tokens_output': int(tokens_output),
-                                'cost': cost,
-                                'response_time_ms': response_time_ms
-                            }
-                    
-                    # If we get here, the response format was unexpected
-                    error_msg = f"Formato de respuesta inesperado: {response_data}"
-                    self._log_usage(model, 0, 0, 0, response_time_ms, False, error_msg, request_type, user)
-                    raise GeminiServiceError(error_msg, response.status_code, response_data)
+                    return self._build_result(prepared, response.json(), response_time_ms, request_type, user)
                 
                 else:
                     error_msg = f"Error HTTP {response.status_code}: {response.text}"
                     self._log_usage(model, 0, 0, 0, response_time_ms, False, error_msg, request_type, user)
                     
                     if response.status_code == 429:  # Rate limit
-                        if attempt < self.max_retries - 1:
+                        if attempt < self.max_retries - 1 and self.transport.available():
                             wait_time = self.retry_delay * (2 ** attempt) + random.uniform(0, 1)
                             logger.warning(f"[SamService] Rate limit alcanzado, esperando {wait_time:.2f} segundos...")
-                            time.sleep(wait_time)
-                            continue
+                            if sleep_within_deadline(wait_time):
+                                continue
                     
                     raise GeminiServiceError(error_msg, response.status_code, response.text)
                     
+            except LLMUnavailableError as e:
+                logger.warning(f"[SamService] {e}")
+                raise SamUnavailableError(str(e))
             except requests.exceptions.RequestException as e:
                 response_time_ms = int((time.time() - start_time) * 1000)
                 error_msg = f"Error de conexión: {str(e)}"
                 self._log_usage(model, 0, 0, 0, response_time_ms, False, error_msg, request_type, user)
                 
-                if attempt < self.max_retries - 1:
+                if attempt < self.max_retries - 1 and self.transport.available():
                     wait_time = self.retry_delay * (2 ** attempt)
                     logger.warning(f"[SamService] Error de conexión, reintentando en {wait_time} segundos...")
-                    time.sleep(wait_time)
-                    continue
+                    if sleep_within_deadline(wait_time):
+                        continue
                 
                 raise GeminiServiceError(error_msg, details=str(e))
         
@@ -453,6 +476,116 @@ Instrucciones específicas:
         logger.error(f"[SamService] {final_error}")
         raise GeminiServiceError(final_error)
     
+    async def agenerate_response(self, user_message, user=None, conversation_history=None, request_type="chat"):
+        """Async `generate_response` for ASGI views.
+
+        Routing, prompt building and usage logging touch the ORM and run via
+        `sync_to_async`; the Gemini wait itself is a coroutine on the async
+        transport, so a slow model call does not pin a worker thread.
+        """
+        prepared = await sync_to_async(self._prepare_request)(user_message, conversation_history, request_type)
+        model = prepared['model']
+        url = self.base_url.format(model=model.api_name)
+        headers = {"Content-Type": "application/json"}
+        params = {"key": self.api_key}
+        transport = get_async_transport()
+        log_usage = sync_to_async(self._log_usage)
+
+        start_time = time.time()
+        for attempt in range(self.max_retries):
+            try:
+                logger.info(f"[SamService] Enviando solicitud async a {model.name}, intento {attempt + 1}/{self.max_retries}")
+                response = await transport.post(url, json=prepared['request_data'], headers=headers, params=params, timeout=30)
+                response_time_ms = int((time.time() - start_time) * 1000)
+
+                if response.status_code == 200:
+                    return await sync_to_async(self._build_result)(prepared, response.json(), response_time_ms, request_type, user)
+
+                error_msg = f"Error HTTP {response.status_code}: {response.text}"
+                await log_usage(model, 0, 0, 0, response_time_ms, False, error_msg, request_type, user)
+                if response.status_code == 429 and attempt < self.max_retries - 1 and transport.available():
+                    wait_time = self.retry_delay * (2 ** attempt) + random.uniform(0, 1)
+                    logger.warning(f"[SamService] Rate limit alcanzado, esperando {wait_time:.2f} segundos...")
+                    if await asleep_within_deadline(wait_time):
+                        continue
+                raise GeminiServiceError(error_msg, response.status_code, response.text)
+
+            except LLMUnavailableError as e:
+                logger.warning(f"[SamService] {e}")
+                raise SamUnavailableError(str(e))
+            except TRANSPORT_ERRORS as e:
+                response_time_ms = int((time.time() - start_time) * 1000)
+                error_msg = f"Error de conexión: {str(e)}"
+                await log_usage(model, 0, 0, 0, response_time_ms, False, error_msg, request_type, user)
+                if attempt < self.max_retries - 1 and transport.available():
+                    wait_time = self.retry_delay * (2 ** attempt)
+                    logger.warning(f"[SamService] Error de conexión, reintentando en {wait_time} segundos...")
+                    if await asleep_within_deadline(wait_time):
+                        continue
+                raise GeminiServiceError(error_msg, details=str(e))
+
+        final_error = f"Falló después de {self.max_retries} intentos"
+        logger.error(f"[SamService] {final_error}")
+        raise GeminiServiceError(final_error)
+
+    def stream_response(self, user_message, user=None, conversation_history=None, request_type="chat"):
+        """Stream the reply with `streamGenerateContent` (SSE), yielding text fragments.
+
+        Same routing, prompt and history as `generate_response`, but without
+        retries: once text has reached the client a retry would duplicate it.
+        Usage is logged to AIUsageLog when the stream ends.
+        """
+        prepared = self._prepare_request(user_message, conversation_history, request_type)
+        model = prepared['model']
+        url = self.stream_url.format(model=model.api_name)
+        params = {"key": self.api_key, "alt": "sse"}
+        headers = {"Content-Type": "application/json"}
+
+        start_time = time.time()
+        first_chunk_ms = None
+        fragments = []
+        try:
+            with self.transport.stream(url, json=prepared['request_data'],
+                                       headers=headers, params=params, timeout=30) as response:
+                if response.status_code != 200:
+                    error_msg = f"Error HTTP {response.status_code}: {response.text}"
+                    raise GeminiServiceError(error_msg, response.status_code, response.text)
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    try:
+                        chunk = json.loads(line[5:].strip())
+                    except ValueError:
+                        continue
+                    for candidate in chunk.get('candidates') or []:
+                        for part in (candidate.get('content') or {}).get('parts') or []:
+                            text = part.get('text') if isinstance(part, dict) and not part.get('thought') else None
+                            if not text:
+                                continue
+                            if first_chunk_ms is None:
+                                first_chunk_ms = int((time.time() - start_time) * 1000)
+                            fragments.append(text)
+                            yield text
+        except LLMUnavailableError as e:
+            raise SamUnavailableError(str(e))
+        except (GeminiServiceError, requests.exceptions.RequestException) as e:
+            response_time_ms = int((time.time() - start_time) * 1000)
+            self._log_usage(model, 0, 0, 0, response_time_ms, False, str(e), request_type, user)
+            if isinstance(e, GeminiServiceError):
+                raise
+            raise GeminiServiceError(f"Error de conexión: {str(e)}", details=str(e))
+
+        response_time_ms = int((time.time() - start_time) * 1000)
+        generated_text = ''.join(fragments)
+        tokens_input = prepared['prompt_tokens']
+        tokens_output = int(self._estimate_tokens(generated_text))
+        cost = self._calculate_cost(model, tokens_input, tokens_output)
+        self._log_usage(model, tokens_input, tokens_output, cost, response_time_ms, True, request_type=request_type, user=user)
+        logger.info(
+            f"[SamService] Stream completo en {response_time_ms} ms (primer fragmento en {first_chunk_ms} ms). "
+            f"Tokens: {tokens_input}/{tokens_output}"
+        )
+
     def search_properties(self, user_message, filters=None, user=None):
         """Search for properties using Sam"""
         search_prompt = f"""
@@ -0,0 +1,138 @@
+"""Servidor HTTP local que imita `models/{model}:generateContent` y
+`:streamGenerateContent?alt=sse` de Gemini.
+
+Permite ejercitar todo el camino (SamService -> transporte -> HTTP) sin red:
+
+    with GeminiStubServer() as stub, override_settings(GEMINI_API_BASE_URL=stub.base_url):
+        SamService(api_key='test').generate_response('hola')
+
+También se puede levantar a mano y apuntar `GEMINI_API_BASE_URL` a él:
+
+    python -m ai_management.llm_stub 8766
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'GeminiStub/1.0'
+    protocol_version = 'HTTP/1.1'  # keep-alive, como la API real
+
+    def log_message(self, format, *args):  # silencioso en tests
+        pass
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self):
+        """Respuesta SSE: el texto en fragmentos de `chunk_size` caracteres."""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        text, size = self.server.reply_text, max(1, self.server.chunk_size)
+        for start in range(0, len(text), size):
+            chunk = {'candidates': [{'content': {'role': 'model', 'parts': [{'text': text[start:start + size]}]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode('utf-8'))
+            self.wfile.flush()
+            if self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = {}
+        model = path.rsplit('/', 1)[-1].split(':', 1)[0]
+        with self.server.lock:
+            self.server.calls.append({'model': model, 'contents': len(payload.get('contents') or [])})
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if self.server.fail_status:
+            return self._send(self.server.fail_status, {'error': {'message': 'stub failure'}})
+        if path.endswith(':streamGenerateContent'):
+            return self._stream()
+        if not path.endswith(':generateContent'):
+            return self._send(404, {'error': {'message': 'endpoint desconocido'}})
+        return self._send(200, {
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': self.server.reply_text}]}}],
+        })
+
+
+class GeminiStubServer:
+    """Levanta el stub en un hilo; `calls` registra cada request recibido."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, reply_text: str = 'Hola, soy Sam.'):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.calls = []
+        self.httpd.lock = threading.Lock()
+        self.httpd.reply_text = reply_text
+        self.httpd.fail_status = 0
+        self.httpd.delay = 0.0
+        self.httpd.chunk_size = 16
+        self.httpd.chunk_delay = 0.0
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def calls(self) -> list:
+        return self.httpd.calls
+
+    def reply_with(self, text: str):
+        """Texto que devuelve el "modelo" en cada respuesta exitosa."""
+        self.httpd.reply_text = text
+
+    def fail_with(self, status: int):
+        """Hace que todas las respuestas devuelvan `status` (0 para desactivar)."""
+        self.httpd.fail_status = status
+
+    def delay_by(self, seconds: float):
+        """Demora artificial antes de responder (para probar plazos)."""
+        self.httpd.delay = seconds
+
+    def stream_chunks(self, size: int, delay: float = 0.0):
+        """Tamaño de cada fragmento SSE y pausa entre fragmentos."""
+        self.httpd.chunk_size = size
+        self.httpd.chunk_delay = delay
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8766
+    server = GeminiStubServer(port=port)
+    print(f"Stub de Gemini escuchando en {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
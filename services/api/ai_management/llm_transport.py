@@ -0,0 +1,268 @@
+"""Transporte HTTP compartido para las llamadas a Gemini.
+
+- Una `requests.Session` por proceso con pool keep-alive: sin un handshake TLS
+  nuevo por cada llamada.
+- Concurrencia acotada (SAM_LLM_MAX_CONCURRENCY) con un semáforo; si no hay
+  cupo antes del plazo la llamada se rechaza en vez de encolarse sin límite.
+- Plazo (deadline) propagado desde la solicitud entrante con `llm_deadline`:
+  el timeout de cada llamada y las esperas entre reintentos se recortan al
+  tiempo que le queda a la solicitud.
+- Circuit breaker: tras SAM_LLM_BREAKER_THRESHOLD fallos consecutivos
+  (conexión, timeout, 5xx o 429) deja de llamar a la API durante
+  SAM_LLM_BREAKER_RESET_SECONDS y falla de inmediato con `LLMUnavailableError`,
+  para que el llamador use su respuesta de respaldo.
+
+`AsyncLLMTransport` es la variante para vistas async (ASGI): con httpx
+instalado usa un `httpx.AsyncClient` por event loop y un semáforo asyncio
+(SAM_LLM_ASYNC_MAX_CONCURRENCY), de modo que miles de esperas cuestan
+corrutinas y no hilos; sin httpx delega en el transporte síncrono dentro de
+`asyncio.to_thread`. Ambos comparten circuit breaker y plazo.
+
+Para probar todo el camino sin red ver `ai_management.llm_stub`.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:  # Dependencia opcional: cliente HTTP asíncrono
+    import httpx
+except ImportError:  # pragma: no cover - depende del entorno
+    httpx = None
+
+from skyterra_backend.resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://generativelanguage.googleapis.com/v1beta'
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar('llm_deadline', default=None)
+
+
+class LLMUnavailableError(Exception):
+    """La llamada no se hizo: circuito abierto, sin cupo o plazo agotado."""
+
+
+@contextmanager
+def llm_deadline(seconds: Optional[float]):
+    """Limita todas las llamadas al LLM dentro del bloque a `seconds` en total.
+
+    Los plazos anidados nunca extienden el plazo exterior.
+    """
+    if not seconds or seconds <= 0:
+        yield
+        return
+    new_deadline = time.monotonic() + float(seconds)
+    current = _deadline.get()
+    token = _deadline.set(min(current, new_deadline) if current else new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Segundos que le quedan al plazo actual (None si no hay plazo)."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def sleep_within_deadline(seconds: float) -> bool:
+    """Espera `seconds` solo si el plazo lo permite; devuelve False si no esperó."""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= seconds:
+        return False
+    time.sleep(seconds)
+    return True
+
+
+async def asleep_within_deadline(seconds: float) -> bool:
+    """Como `sleep_within_deadline`, sin bloquear el event loop."""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= seconds:
+        return False
+    await asyncio.sleep(seconds)
+    return True
+
+
+# Errores de red que cuentan como fallo de la llamada (requests y, si existe, httpx)
+TRANSPORT_ERRORS = (requests.exceptions.RequestException,) + ((httpx.HTTPError,) if httpx is not None else ())
+
+
+def base_url() -> str:
+    return (getattr(settings, 'GEMINI_API_BASE_URL', '') or DEFAULT_BASE_URL).rstrip('/')
+
+
+class LLMTransport:
+    """Sesión HTTP con pool, semáforo de concurrencia y circuit breaker."""
+
+    def __init__(self, max_concurrency: int = 8, breaker: Optional[CircuitBreaker] = None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_concurrency, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def available(self) -> bool:
+        return self.breaker.would_allow()
+
+    def _effective_timeout(self, timeout: float) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise LLMUnavailableError("Plazo de la solicitud agotado antes de llamar al modelo")
+        return min(timeout, remaining)
+
+    def post(self, url: str, *, json=None, params=None, headers=None, timeout: float = 30) -> requests.Response:
+        """POST al LLM. Lanza `LLMUnavailableError` sin llamar si no corresponde."""
+        if not self.breaker.allow():
+            raise LLMUnavailableError("Circuito abierto: la API de Gemini viene fallando")
+        timeout = self._effective_timeout(timeout)
+        if not self._slots.acquire(timeout=timeout):
+            raise LLMUnavailableError(f"Sin cupo: {self.max_concurrency} llamadas al modelo en curso")
+        try:
+            response = self.session.post(url, json=json, params=params, headers=headers, timeout=timeout)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self._slots.release()
+        if response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure()
+            if self.breaker.state == 'open':
+                logger.warning(f"[LLMTransport] Circuito abierto tras HTTP {response.status_code}")
+        else:
+            self.breaker.record_success()
+        return response
+
+    @contextmanager
+    def stream(self, url: str, *, json=None, params=None, headers=None, timeout: float = 30):
+        """POST con `stream=True`; el cupo de concurrencia se libera al cerrar el bloque."""
+        if not self.breaker.allow():
+            raise LLMUnavailableError("Circuito abierto: la API de Gemini viene fallando")
+        timeout = self._effective_timeout(timeout)
+        if not self._slots.acquire(timeout=timeout):
+            raise LLMUnavailableError(f"Sin cupo: {self.max_concurrency} llamadas al modelo en curso")
+        response = None
+        try:
+            response = self.session.post(url, json=json, params=params, headers=headers, timeout=timeout, stream=True)
+            if response.status_code >= 500 or response.status_code == 429:
+                self.breaker.record_failure()
+            yield response
+            if response.status_code < 400:
+                self.breaker.record_success()
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        finally:
+            if response is not None:
+                response.close()
+            self._slots.release()
+
+
+_transport: Optional[LLMTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> LLMTransport:
+    """Transporte compartido por proceso."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = LLMTransport(
+                    max_concurrency=int(getattr(settings, 'SAM_LLM_MAX_CONCURRENCY', 8)),
+                    breaker=CircuitBreaker(
+                        failure_threshold=int(getattr(settings, 'SAM_LLM_BREAKER_THRESHOLD', 5)),
+                        reset_timeout=float(getattr(settings, 'SAM_LLM_BREAKER_RESET_SECONDS', 30)),
+                    ),
+                )
+    return _transport
+
+
+class AsyncLLMTransport:
+    """POST asíncrono al LLM con el mismo breaker y plazo que `LLMTransport`."""
+
+    def __init__(self, sync_transport: LLMTransport, max_concurrency: int = 200):
+        self.sync_transport = sync_transport
+        self.breaker = sync_transport.breaker
+        self.max_concurrency = max(1, int(max_concurrency))
+        # Cliente y semáforo por event loop: los objetos asyncio no se comparten entre loops
+        self._per_loop = weakref.WeakKeyDictionary()
+
+    @property
+    def backend(self) -> str:
+        return 'httpx' if httpx is not None else 'thread'
+
+    def available(self) -> bool:
+        return self.breaker.would_allow()
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._per_loop.get(loop)
+        if state is None:
+            client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=min(self.max_concurrency, 32),
+            ))
+            state = (client, asyncio.Semaphore(self.max_concurrency))
+            self._per_loop[loop] = state
+        return state
+
+    async def post(self, url: str, *, json=None, params=None, headers=None, timeout: float = 30):
+        """Devuelve un objeto respuesta con `status_code`, `text` y `json()`."""
+        if httpx is None:
+            # asyncio.to_thread copia el contexto: el plazo se respeta también en el hilo
+            return await asyncio.to_thread(
+                self.sync_transport.post, url, json=json, params=params, headers=headers, timeout=timeout
+            )
+        if not self.breaker.allow():
+            raise LLMUnavailableError("Circuito abierto: la API de Gemini viene fallando")
+        timeout = self.sync_transport._effective_timeout(timeout)
+        client, slots = self._loop_state()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise LLMUnavailableError(f"Sin cupo: {self.max_concurrency} llamadas al modelo en curso")
+        try:
+            response = await client.post(url, json=json, params=params, headers=headers, timeout=timeout)
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            raise
+        finally:
+            slots.release()
+        if response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+_async_transport: Optional[AsyncLLMTransport] = None
+
+
+def get_async_transport() -> AsyncLLMTransport:
+    """Transporte asíncrono compartido por proceso."""
+    global _async_transport
+    if _async_transport is None:
+        sync_transport = get_transport()
+        with _transport_lock:
+            if _async_transport is None:
+                _async_transport = AsyncLLMTransport(
+                    sync_transport,
+                    max_concurrency=int(getattr(settings, 'SAM_LLM_ASYNC_MAX_CONCURRENCY', 200)),
+                )
+    return _async_transport
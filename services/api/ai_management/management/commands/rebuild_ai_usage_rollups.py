@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ai_management.usage_buffer import flush_usage_logs
+from ai_management.usage_rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los agregados por hora/día de AIUsageLog desde los logs crudos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=0,
+                            help='Reconstruir solo los últimos N días (0 = todo el historial)')
+
+    def handle(self, *args, **options):
+        flush_usage_logs()
+        since = timezone.now() - timedelta(days=options['days']) if options['days'] else None
+        buckets = rebuild_rollups(since)
+        scope = f"los últimos {options['days']} días" if since else 'todo el historial'
+        self.stdout.write(self.style.SUCCESS(f"{buckets} agregados reconstruidos para {scope}."))
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    from ai_management.usage_rollups import aggregate_events
+
+    AIUsageLog = apps.get_model('ai_management', 'AIUsageLog')
+    AIUsageRollup = apps.get_model('ai_management', 'AIUsageRollup')
+    events = AIUsageLog.objects.values_list(
+        'timestamp', 'model_used_id', 'request_type', 'success',
+        'tokens_input', 'tokens_output', 'cost', 'response_time_ms',
+    ).iterator(chunk_size=5000)
+    AIUsageRollup.objects.bulk_create([
+        AIUsageRollup(granularity=granularity, bucket_start=start, model_used_id=model_id,
+                      request_type=request_type, **counters)
+        for (granularity, start, model_id, request_type), counters in aggregate_events(events).items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_management', '0005_seed_default_models'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aiusagelog',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='AIUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hora'), ('day', 'Día')], max_length=4)),
+                ('bucket_start', models.DateTimeField(help_text='Inicio de la hora o del día (hora local) que agrega la fila.')),
+                ('request_type', models.CharField(default='chat', max_length=50)),
+                ('request_count', models.PositiveIntegerField(default=0)),
+                ('success_count', models.PositiveIntegerField(default=0)),
+                ('tokens_input', models.PositiveBigIntegerField(default=0)),
+                ('tokens_output', models.PositiveBigIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=14)),
+                ('response_time_ms_total', models.PositiveBigIntegerField(default=0)),
+                ('model_used', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='ai_management.aimodel')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='aiusagerollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'bucket_start', 'model_used', 'request_type'), name='unique_ai_usage_rollup_bucket'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -63,7 +63,41 @@ class AIUsageLog(models.Model):
     response_time_ms = models.PositiveIntegerField(help_text='Tiempo de respuesta en milisegundos.')
     success = models.BooleanField(default=True)
     error_message = models.TextField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
-        return f"Log de {self.model_used.name} a las {self.timestamp}"
\ No newline at end of file
+        return f"Log de {self.model_used.name} a las {self.timestamp}"
+
+class AIUsageRollup(models.Model):
+    """Agregados de `AIUsageLog` por hora y por día, modelo y tipo de solicitud.
+
+    Se mantienen de forma incremental al escribir cada lote de logs (ver
+    `ai_management.usage_rollups`); el panel de uso los lee en vez de recorrer
+    la tabla de logs completa.
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hora'),
+        ('day', 'Día'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField(help_text='Inicio de la hora o del día (hora local) que agrega la fila.')
+    model_used = models.ForeignKey(AIModel, on_delete=models.PROTECT)
+    request_type = models.CharField(max_length=50, default='chat')
+    request_count = models.PositiveIntegerField(default=0)
+    success_count = models.PositiveIntegerField(default=0)
+    tokens_input = models.PositiveBigIntegerField(default=0)
+    tokens_output = models.PositiveBigIntegerField(default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=6, default=0)
+    response_time_ms_total = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket_start', 'model_used', 'request_type'],
+                name='unique_ai_usage_rollup_bucket',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_granularity_display()} {self.bucket_start:%Y-%m-%d %H:%M} {self.model_used.name} ({self.request_type})"
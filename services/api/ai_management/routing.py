@@ -0,0 +1,140 @@
+"""Enrutamiento de solicitudes de Sam a modelos lite/flash/pro.
+
+Antes cada `generate_response` hacía una llamada extra al modelo enrutador.
+Ahora la decisión se toma, en orden:
+
+1. Regla fija por `request_type` (clasificación, plusvalía, búsqueda...).
+2. Heurística barata para chat claramente simple o claramente complejo.
+3. Veredicto previo del enrutador para un mensaje con la misma "forma"
+   (texto normalizado: minúsculas, sin acentos, números enmascarados).
+4. Solo si nada de lo anterior aplica se consulta al modelo enrutador, y su
+   veredicto queda en caché.
+
+Cada camino incrementa un contador (`get_routing_stats`).
+"""
+import hashlib
+import logging
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+
+from skyterra_backend.counters import incr_counter, read_counters, reset_counters
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ('lite', 'flash', 'pro')
+PATHS = ('rule', 'heuristic', 'cache', 'router', 'fallback')
+STATS_PREFIX = 'sam:routing:stats'
+VERDICT_PREFIX = 'sam:routing:verdict'
+
+# Tipos de solicitud con ruta fija (sobrescribible con SAM_ROUTING_RULES)
+DEFAULT_RULES = {
+    'ai_property_classification': 'lite',
+    'plusvalia_eval': 'lite',
+    'router': 'lite',
+    'ai_property_search': 'flash',
+    'search': 'flash',
+}
+
+COMPLEX_MARKERS = (
+    'compara', 'comparar', 'analiza', 'analisis', 'por que', 'estrategia', 'proyeccion',
+    'calcula', 'rentabilidad', 'paso a paso', 'ventajas y desventajas', 'evalua',
+)
+GREETING_MARKERS = ('hola', 'buenas', 'gracias', 'buenos dias', 'buenas tardes', 'chao', 'adios', 'ok')
+
+
+def get_rules() -> dict:
+    rules = dict(DEFAULT_RULES)
+    rules.update(getattr(settings, 'SAM_ROUTING_RULES', {}) or {})
+    return {k: v for k, v in rules.items() if v in ROUTES}
+
+
+def normalize_message(text: str) -> str:
+    """Forma normalizada del mensaje: sin acentos, minúsculas, números como '#'."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = re.sub(r'\d+([.,]\d+)*', '#', text)
+    text = re.sub(r'[^\w#?¿ ]+', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _verdict_key(normalized: str, request_type: str) -> str:
+    digest = hashlib.sha1(f"{request_type}|{normalized}".encode('utf-8')).hexdigest()
+    return f"{VERDICT_PREFIX}:{digest}"
+
+
+def heuristic_route(normalized: str):
+    """Ruta evidente para chat, o None si el mensaje es ambiguo."""
+    words = normalized.split()
+    if not words:
+        return 'lite'
+    long_words = int(getattr(settings, 'SAM_ROUTING_PRO_MIN_WORDS', 250))
+    short_words = int(getattr(settings, 'SAM_ROUTING_LITE_MAX_WORDS', 8))
+    if len(words) >= long_words:
+        return 'pro'
+    if len(words) <= short_words:
+        has_marker = any(marker in normalized for marker in COMPLEX_MARKERS)
+        if not has_marker and ('#' not in normalized or any(normalized.startswith(g) for g in GREETING_MARKERS)):
+            return 'lite'
+    if normalized.count('?') >= 3 or sum(marker in normalized for marker in COMPLEX_MARKERS) >= 2:
+        return 'pro'
+    return None
+
+
+def _incr_stat(path: str):
+    incr_counter(f"{STATS_PREFIX}:{path}")
+
+
+def get_routing_stats() -> dict:
+    counts = read_counters(STATS_PREFIX, PATHS)
+    total = sum(counts.values())
+    return {
+        'counts': counts,
+        'total': total,
+        'router_call_rate': round(counts['router'] / total, 4) if total else 0.0,
+    }
+
+
+def reset_routing_stats():
+    reset_counters(STATS_PREFIX, PATHS)
+
+
+def decide_route(user_message: str, request_type: str, ask_router):
+    """Devuelve `(route, path)`.
+
+    `ask_router(user_message, request_type)` se invoca solo para mensajes
+    ambiguos sin veredicto en caché; debe devolver 'lite', 'flash' o 'pro'
+    (o lanzar excepción). Si el enrutador falla la ruta es None (el llamador
+    usa el modelo configurado) y no se cachea nada.
+    """
+    request_type = str(request_type or 'chat').lower()
+    rule = get_rules().get(request_type)
+    if rule:
+        _incr_stat('rule')
+        return rule, 'rule'
+
+    normalized = normalize_message(user_message)
+    route = heuristic_route(normalized)
+    if route:
+        _incr_stat('heuristic')
+        return route, 'heuristic'
+
+    key = _verdict_key(normalized, request_type)
+    cached = cache.get(key)
+    if cached in ROUTES:
+        _incr_stat('cache')
+        return cached, 'cache'
+
+    try:
+        route = (ask_router(user_message, request_type) or '').lower()
+    except Exception as e:
+        logger.warning(f"[SamRouting] Enrutador falló, usando el modelo configurado: {e}")
+        route = ''
+    if route not in ROUTES:
+        _incr_stat('fallback')
+        return None, 'fallback'
+    cache.set(key, route, timeout=int(getattr(settings, 'SAM_ROUTER_CACHE_TTL', 60 * 60 * 24)))
+    _incr_stat('router')
+    return route, 'router'
@@ -0,0 +1,231 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .config_cache import bump_config_version, get_active_models, get_config_version, get_sam_config
+from .gemini_service import GeminiServiceError, SamService, SamUnavailableError
+from .llm_stub import GeminiStubServer
+from .llm_transport import get_transport, llm_deadline
+from .models import AIModel, AIUsageLog, AIUsageRollup, SamConfiguration
+from .routing import decide_route, get_routing_stats
+from .token_budget import estimate_tokens, fit_messages, get_budget_stats
+from .usage_buffer import UsageLogBuffer, write_usage_logs
+from .usage_rollups import rebuild_rollups, usage_summary
+
+
+class SamRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_rules_and_heuristics_skip_router_model(self):
+        with mock.patch.object(SamService, '_simple_request') as simple_request:
+            service = SamService(api_key='test')
+            model = service._route_model('Evalúa esta propiedad', request_type='plusvalia_eval')
+            service._route_model('hola', request_type='chat')
+        simple_request.assert_not_called()
+        self.assertIn('lite', model.api_name)
+        self.assertEqual(get_routing_stats()['counts']['rule'], 1)
+        self.assertEqual(get_routing_stats()['counts']['heuristic'], 1)
+
+    def test_router_verdict_is_cached_by_message_shape(self):
+        ask_router = mock.Mock(return_value='pro')
+        message = 'Busco un campo de {} hectáreas cerca de un lago con acceso pavimentado y agua'
+
+        first = decide_route(message.format(120), 'chat', ask_router)
+        second = decide_route(message.format(95), 'chat', ask_router)
+
+        self.assertEqual(first, ('pro', 'router'))
+        self.assertEqual(second, ('pro', 'cache'))
+        self.assertEqual(ask_router.call_count, 1)
+        stats = get_routing_stats()
+        self.assertEqual(stats['total'], 2)
+        self.assertEqual(stats['router_call_rate'], 0.5)
+
+
+class LLMTransportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = GeminiStubServer().start()
+        self.addCleanup(self.stub.stop)
+        self.breaker = get_transport().breaker
+        self.breaker.reset()
+        self.addCleanup(self.breaker.reset)
+        patcher = mock.patch.object(self.breaker, 'failure_threshold', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings_override = override_settings(
+            GEMINI_API_BASE_URL=self.stub.base_url, GOOGLE_GEMINI_API_KEY='test', AI_USAGE_LOG_BUFFERED=False,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_breaker_opens_after_consecutive_failures_and_short_circuits(self):
+        result = SamService().generate_response('hola')
+        self.assertEqual(result['response'], 'Hola, soy Sam.')
+
+        self.stub.fail_with(503)
+        for _ in range(2):
+            with self.assertRaises(GeminiServiceError):
+                SamService().generate_response('hola')
+        calls = len(self.stub.calls)
+        with self.assertRaises(SamUnavailableError):
+            SamService().generate_response('hola')
+        self.assertEqual(len(self.stub.calls), calls)
+
+        # La búsqueda IA responde de inmediato con el respaldo simple
+        response = self.client.post(reverse('project-ai-search'), {'query': 'terrenos con agua'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['fallback'])
+        self.assertEqual(len(self.stub.calls), calls)
+
+    def test_request_deadline_bounds_call_and_retries(self):
+        self.stub.delay_by(1.0)
+        started = time.monotonic()
+        with llm_deadline(0.3), self.assertRaises(GeminiServiceError):
+            SamService().generate_response('hola')
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(len(self.stub.calls), 1)
+
+
+class UsageLogBufferTests(TestCase):
+    def test_buffered_usage_is_written_in_batches_off_the_request(self):
+        buffer = UsageLogBuffer(max_size=3, batch_size=2, flush_interval=60)
+        model = AIModel.objects.first()
+        with mock.patch('ai_management.usage_buffer.get_usage_buffer', return_value=buffer), \
+                mock.patch.object(buffer, 'start'), override_settings(AI_USAGE_LOG_BUFFERED=True):
+            service = SamService(api_key='test')
+            with self.assertNumQueries(0):
+                for i in range(4):
+                    service._log_usage(model, 10, 5, 0.001, 120 + i, success=i != 3, error_message='x' * (i == 3))
+
+        self.assertEqual(buffer.stats()['pending'], 3)
+        self.assertEqual(buffer.dropped, 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 3)
+        log_inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "ai_management_aiusagelog"')]
+        self.assertEqual(len(log_inserts), 2)
+        self.assertEqual(AIUsageLog.objects.filter(model_used=model).count(), 3)
+        self.assertEqual(buffer.flush(), 0)
+
+
+class UsageRollupTests(TestCase):
+    def _rollup_snapshot(self):
+        return sorted(AIUsageRollup.objects.values_list(
+            'granularity', 'bucket_start', 'request_type', 'request_count', 'success_count',
+            'tokens_input', 'tokens_output', 'cost', 'response_time_ms_total',
+        ))
+
+    def test_rollups_are_incremental_and_summary_matches_raw_logs(self):
+        model = AIModel.objects.first()
+        write_usage_logs([
+            {'model_used_id': model.pk, 'request_type': 'chat' if i % 2 else 'search', 'tokens_input': 10 + i,
+             'tokens_output': 5, 'cost': '0.001000', 'response_time_ms': 100 * (i + 1), 'success': i != 4}
+            for i in range(6)
+        ])
+        incremental = self._rollup_snapshot()
+        self.assertEqual(sum(row[3] for row in incremental if row[0] == 'hour'), 6)
+        rebuild_rollups()
+        self.assertEqual(self._rollup_snapshot(), incremental)
+
+        # Repartir los logs en el tiempo: horas parciales en los bordes, días completos al medio
+        now = timezone.now()
+        offsets = [timedelta(minutes=10), timedelta(hours=3), timedelta(hours=30),
+                   timedelta(days=3, minutes=30), timedelta(days=3, hours=23, minutes=50), timedelta(days=10)]
+        for log, offset in zip(AIUsageLog.objects.order_by('id'), offsets):
+            AIUsageLog.objects.filter(pk=log.pk).update(timestamp=now - offset)
+        rebuild_rollups()
+
+        start = now - timedelta(days=4)
+        with self.assertNumQueries(2):
+            summary = usage_summary(start, now)
+        raw = AIUsageLog.objects.filter(timestamp__gte=start, timestamp__lt=now)
+        self.assertEqual(summary['total_requests'], raw.count())
+        self.assertEqual(summary['total_requests'], 5)
+        self.assertEqual(summary['total_tokens_input'], sum(raw.values_list('tokens_input', flat=True)))
+        self.assertEqual(summary['success_rate'], 80.0)
+        self.assertEqual(summary['usage_by_model'][0]['avg_response_time'],
+                         sum(raw.values_list('response_time_ms', flat=True)) / 5)
+        self.assertEqual(sum(day['request_count'] for day in summary['daily']), 5)
+
+
+class SamConfigCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(bump_config_version)  # que el siguiente test no herede la instantánea editada
+
+    def test_hot_paths_do_no_config_queries_until_an_admin_edit(self):
+        SamService(api_key='test')  # carga la instantánea
+        with self.assertNumQueries(0):
+            service = SamService(api_key='test')
+            service._get_router_model()
+            service._pick_target_model('pro')
+            service._get_current_model()
+
+        config = SamConfiguration.get_config()
+        config.response_temperature = 0.2
+        config.save()
+        AIModel.objects.filter(api_name='gemini-2.5-pro').first().delete()
+        self.assertEqual(get_sam_config().response_temperature, 0.2)
+        self.assertNotIn('gemini-2.5-pro', [m.api_name for m in get_active_models()])
+
+    def test_missing_current_model_is_repaired_on_load_not_on_the_snapshot(self):
+        SamConfiguration.objects.filter(pk=SamConfiguration.get_config().pk).update(current_model=None)
+        bump_config_version()
+        version = get_config_version()
+
+        with mock.patch.object(SamConfiguration, 'save') as save:
+            model = SamService(api_key='test')._get_current_model()
+
+        save.assert_not_called()
+        self.assertEqual(model, get_active_models()[0])
+        self.assertEqual(SamConfiguration.get_config().current_model_id, model.pk)
+        self.assertEqual(get_config_version(), version)  # la reparación no invalida la instantánea
+
+
+class TokenBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_transport().breaker.reset()
+        self.stub = GeminiStubServer().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(
+            GEMINI_API_BASE_URL=self.stub.base_url, GOOGLE_GEMINI_API_KEY='test', AI_USAGE_LOG_BUFFERED=False,
+            AI_PROMPT_TOKEN_BUDGET=1200, AI_HISTORY_MESSAGE_MAX_TOKENS=300,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        filler = 'Busco un campo con agua y vista al volcán en la zona sur, cerca de Puerto Varas. ' * 30
+        self.history = []
+        for turn in range(5):
+            self.history.append({'role': 'user', 'content': f'Pregunta {turn}: ¿hay parcelas en la comuna {turn}? {filler}'})
+            self.history.append({'role': 'assistant', 'content': f'Respuesta {turn}. {filler}'})
+
+    def test_old_turns_are_summarized_to_fit_the_budget(self):
+        history = [(m['role'], m['content']) for m in self.history]
+        kept, report = fit_messages('Eres Sam.', 'Y la última, ¿cuánto cuesta?', history, budget=1200)
+
+        self.assertLessEqual(report['tokens_after'], 1200)
+        self.assertGreater(report['tokens_saved'], 0)
+        self.assertTrue(report['summarized'])
+        self.assertTrue(kept[0][1].startswith('Resumen de la conversación anterior'))
+        self.assertIn('Pregunta 0', kept[0][1])
+        self.assertTrue(kept[-1][1].startswith('Respuesta 4.'))
+        self.assertEqual(fit_messages('Eres Sam.', 'hola', [('user', 'hola')], budget=1200)[1]['tokens_saved'], 0)
+        self.assertGreater(estimate_tokens('Región de Los Lagos, 1.200 ha'), len('Región de Los Lagos, 1.200 ha'.split()))
+
+    def test_generate_response_sends_fitted_history_and_reports_savings(self):
+        result = SamService().generate_response('¿Y la última cuánto cuesta?', conversation_history=self.history)
+
+        # sistema + resumen + turnos recientes + mensaje actual, en vez de 12 mensajes
+        self.assertLess(self.stub.calls[-1]['contents'], 12)
+        self.assertGreater(result['prompt_tokens_saved'], 0)
+        self.assertLessEqual(result['tokens_input'], 1200)
+        self.assertEqual(get_budget_stats()['tokens_saved'], result['prompt_tokens_saved'])
@@ -0,0 +1,164 @@
+"""Presupuesto de tokens para el prompt de Sam.
+
+Antes el historial se recortaba solo por cantidad de mensajes
+(`max_history_messages`): diez mensajes largos, más los resúmenes de
+propiedades que la búsqueda IA agrega a cada entrada, inflaban el prompt sin
+límite (latencia y costo). Ahora `fit_messages`:
+
+1. mide cada parte con `estimate_tokens` (trozos de ~4 caracteres por palabra
+   más la puntuación, en vez de palabras × 1,3),
+2. conserva siempre el prompt de sistema y el mensaje actual,
+3. recorta cada mensaje del historial a AI_HISTORY_MESSAGE_MAX_TOKENS
+   (inicio y final del texto),
+4. agrega mensajes del más reciente al más antiguo mientras quepan en el
+   presupuesto del modelo,
+5. resume los turnos que no cupieron en un solo mensaje breve con lo que
+   pidió el usuario (sin llamar al LLM); si ni eso cabe, se descartan.
+
+El presupuesto es `AIModel.max_tokens` menos la reserva para la respuesta,
+acotado por AI_PROMPT_TOKEN_BUDGET. Los tokens ahorrados se acumulan en
+`get_budget_stats`.
+"""
+import logging
+import math
+import re
+
+from django.conf import settings
+
+from skyterra_backend.counters import incr_counter, read_counters
+
+logger = logging.getLogger(__name__)
+
+STATS_PREFIX = 'sam:token_budget:stats'
+STATS = ('prompts', 'trimmed', 'tokens_before', 'tokens_saved')
+SUMMARY_PREFIX = 'Resumen de la conversación anterior (el usuario pidió): '
+ELLIPSIS = ' […] '
+_PIECE_RE = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text) -> int:
+    """Aproximación de tokens tipo SentencePiece: ~4 caracteres por token, 1 por signo."""
+    if not text:
+        return 0
+    return sum(math.ceil(len(piece) / 4) if piece[0].isalnum() or piece[0] == '_' else 1
+               for piece in _PIECE_RE.findall(str(text)))
+
+
+def prompt_budget(model) -> int:
+    """Tokens de entrada permitidos para `model`."""
+    cap = int(getattr(settings, 'AI_PROMPT_TOKEN_BUDGET', 8000))
+    reserve = int(getattr(settings, 'AI_PROMPT_OUTPUT_RESERVE', 2048))
+    model_max = getattr(model, 'max_tokens', None) or cap + reserve
+    return max(1, min(cap, model_max - reserve))
+
+
+def clip_text(text: str, max_tokens: int) -> str:
+    """Recorta `text` a unos `max_tokens` dejando el inicio y el final."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    head, tail, used = [], [], estimate_tokens(ELLIPSIS)
+    head_budget = (max_tokens * 2) // 3
+    for word in words:
+        cost = estimate_tokens(word)
+        if used + cost > head_budget:
+            break
+        head.append(word)
+        used += cost
+    for word in reversed(words[len(head):]):
+        cost = estimate_tokens(word)
+        if used + cost > max_tokens:
+            break
+        tail.append(word)
+        used += cost
+    return ' '.join(head) + ELLIPSIS + ' '.join(reversed(tail))
+
+
+def summarize_turns(turns, max_tokens: int) -> str:
+    """Resumen extractivo de turnos descartados: la primera frase de cada pedido del usuario."""
+    asks = []
+    for role, text in turns:
+        if role != 'user':
+            continue
+        first = re.split(r'(?<=[.!?])\s|\n', text.strip(), maxsplit=1)[0]
+        if first:
+            asks.append(clip_text(first, 40).replace(ELLIPSIS, ' … '))
+    if not asks:
+        return ''
+    summary = SUMMARY_PREFIX
+    for ask in asks:
+        candidate = summary + ('; ' if summary != SUMMARY_PREFIX else '') + ask
+        if estimate_tokens(candidate) > max_tokens:
+            break
+        summary = candidate
+    return summary if summary != SUMMARY_PREFIX else ''
+
+
+def fit_messages(system_prompt: str, user_message: str, history, budget: int):
+    """Elige el historial que cabe en `budget` junto al prompt de sistema y el mensaje actual.
+
+    `history` es una lista de `(role, text)` del más antiguo al más reciente.
+    Devuelve `(history, report)`, con el historial a enviar en el mismo
+    formato y un dict `budget`, `tokens_before`, `tokens_after`,
+    `tokens_saved`, `dropped`, `clipped`, `summarized`.
+    """
+    per_message = int(getattr(settings, 'AI_HISTORY_MESSAGE_MAX_TOKENS', 600))
+    summary_max = int(getattr(settings, 'AI_HISTORY_SUMMARY_MAX_TOKENS', 150))
+    fixed = estimate_tokens(system_prompt) + estimate_tokens(user_message)
+    tokens_before = fixed + sum(estimate_tokens(text) for _, text in history)
+    available = budget - fixed
+
+    kept, clipped = [], 0
+    cut = 0  # historial[:cut] no entra
+    for index in range(len(history) - 1, -1, -1):
+        role, text = history[index]
+        short = clip_text(text, per_message)
+        cost = estimate_tokens(short)
+        if cost > available:
+            cut = index + 1
+            break
+        clipped += short is not text
+        kept.append((role, short))
+        available -= cost
+    kept.reverse()
+
+    summary = ''
+    dropped = history[:cut]
+    if dropped:
+        summary = summarize_turns(dropped, summary_max)
+        # Hacer lugar para el resumen sacrificando los mensajes más antiguos que quedaron
+        while summary and estimate_tokens(summary) > available and kept:
+            role, text = kept.pop(0)
+            available += estimate_tokens(text)
+        if summary and estimate_tokens(summary) <= available:
+            kept.insert(0, ('user', summary))
+        else:
+            summary = ''
+
+    tokens_after = fixed + sum(estimate_tokens(text) for _, text in kept)
+    report = {
+        'budget': budget,
+        'tokens_before': tokens_before,
+        'tokens_after': tokens_after,
+        'tokens_saved': max(0, tokens_before - tokens_after),
+        'dropped': len(history) - len(kept) + (1 if summary else 0),
+        'clipped': clipped,
+        'summarized': bool(summary),
+    }
+    if fixed > budget:
+        logger.warning(f"[TokenBudget] Prompt de sistema + mensaje ({fixed} tokens) superan el presupuesto de {budget}")
+    _record(report)
+    return kept, report
+
+
+def _record(report):
+    deltas = {'prompts': 1, 'trimmed': 1 if report['tokens_saved'] else 0,
+              'tokens_before': report['tokens_before'], 'tokens_saved': report['tokens_saved']}
+    for name, delta in deltas.items():
+        incr_counter(f"{STATS_PREFIX}:{name}", delta)
+
+
+def get_budget_stats() -> dict:
+    stats = read_counters(STATS_PREFIX, STATS)
+    stats['saved_ratio'] = round(stats['tokens_saved'] / stats['tokens_before'], 4) if stats['tokens_before'] else 0.0
+    return stats
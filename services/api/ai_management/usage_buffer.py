@@ -0,0 +1,166 @@
+"""Escritura diferida y por lotes de `AIUsageLog`.
+
+Cada llamada al LLM (incluida la del enrutador) registraba su uso con un
+`AIUsageLog.objects.create` dentro de la solicitud. Ahora `record_usage`
+solo encola el evento en memoria y un hilo en segundo plano lo escribe con
+`bulk_create` cada AI_USAGE_LOG_FLUSH_SECONDS o al juntar
+AI_USAGE_LOG_BATCH_SIZE eventos. El buffer es acotado
+(AI_USAGE_LOG_MAX_BUFFER): si se llena se descartan eventos y se cuentan en
+`dropped`, nunca se bloquea la respuesta. Al terminar el proceso (`atexit`)
+se vacía lo pendiente.
+
+Nota: `timestamp` es `auto_now_add`, así que refleja el momento del flush
+(segundos después del evento como máximo).
+
+Cada lote se escribe junto con sus agregados por hora/día en la misma
+transacción (ver `usage_rollups`).
+
+Con AI_USAGE_LOG_BUFFERED=False se vuelve a la escritura inmediata.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .usage_rollups import apply_to_rollups
+
+logger = logging.getLogger(__name__)
+
+
+def write_usage_logs(events) -> int:
+    """Inserta los eventos y suma sus valores a los agregados, todo o nada."""
+    from .models import AIUsageLog
+
+    logs = [AIUsageLog(**fields) for fields in events]
+    with transaction.atomic():
+        AIUsageLog.objects.bulk_create(logs)
+        apply_to_rollups(logs)
+    return len(logs)
+
+
+class UsageLogBuffer:
+    """Cola acotada de eventos de uso con flush por lotes."""
+
+    def __init__(self, max_size: int = 10000, batch_size: int = 200, flush_interval: float = 2.0):
+        self.max_size = max(1, int(max_size))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.dropped = 0
+        self.flushed = 0
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def record(self, **fields) -> bool:
+        """Encola un evento (kwargs de AIUsageLog). Devuelve False si se descartó."""
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning(f"[AIUsageLog] Buffer lleno, {self.dropped} eventos descartados")
+                return False
+            self._events.append(fields)
+            full_batch = len(self._events) >= self.batch_size
+        if full_batch:
+            self._wakeup.set()
+        return True
+
+    def _take(self, limit: int):
+        with self._lock:
+            count = min(limit, len(self._events))
+            return [self._events.popleft() for _ in range(count)]
+
+    def flush(self) -> int:
+        """Escribe todo lo pendiente en lotes de `batch_size`. Devuelve filas escritas."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    break
+                try:
+                    written += write_usage_logs(batch)
+                except Exception as e:
+                    # Un lote inválido no debe frenar el resto ni reintentarse en bucle
+                    logger.error(f"[AIUsageLog] Error escribiendo lote de {len(batch)} eventos: {e}")
+            self.flushed += written
+        return written
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:  # pragma: no cover - defensivo
+                logger.error(f"[AIUsageLog] Error en el hilo de flush: {e}")
+            finally:
+                close_old_connections()
+
+    def start(self):
+        """Arranca el hilo de flush (idempotente)."""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stopping.clear()
+                    self._thread = threading.Thread(target=self._run, name='ai-usage-log-flusher', daemon=True)
+                    self._thread.start()
+
+    def stop(self, flush: bool = True):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if flush:
+            self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._events),
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'max_size': self.max_size,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_usage_buffer() -> UsageLogBuffer:
+    """Buffer del proceso; el hilo de flush arranca con el primer evento."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = UsageLogBuffer(
+                    max_size=int(getattr(settings, 'AI_USAGE_LOG_MAX_BUFFER', 10000)),
+                    batch_size=int(getattr(settings, 'AI_USAGE_LOG_BATCH_SIZE', 200)),
+                    flush_interval=float(getattr(settings, 'AI_USAGE_LOG_FLUSH_SECONDS', 2.0)),
+                )
+                atexit.register(_buffer.stop)
+    return _buffer
+
+
+def record_usage(**fields):
+    """Registra un uso del LLM sin tocar la base de datos en la solicitud (si está en modo buffer)."""
+    if not getattr(settings, 'AI_USAGE_LOG_BUFFERED', True):
+        write_usage_logs([fields])
+        return
+    buffer = get_usage_buffer()
+    buffer.start()
+    buffer.record(**fields)
+
+
+def flush_usage_logs() -> int:
+    """Escribe de inmediato lo pendiente (tests, comandos, apagado)."""
+    return get_usage_buffer().flush() if _buffer is not None else 0
@@ -0,0 +1,225 @@
+"""Agregados por hora y por día de `AIUsageLog` para el panel de uso.
+
+`usage_stats` hacía cinco pasadas sobre la tabla de logs completa de la
+ventana. Ahora cada lote que escribe el buffer de uso suma sus eventos a
+`AIUsageRollup` (una fila por hora/día, modelo y tipo de solicitud) con
+`UPDATE ... SET x = x + delta`, y `usage_summary` arma el panel con:
+
+- una sola consulta sobre los agregados: días completos desde las filas
+  diarias y las horas completas de los bordes desde las horarias,
+- una consulta pequeña sobre los logs crudos solo para los pedazos de hora
+  que quedan en los extremos de la ventana (la "cola" cruda).
+
+Horas y días se cortan en la zona horaria local (TIME_ZONE), igual que la
+serie diaria que devolvía `TruncDate`.
+
+Los logs anteriores a los agregados (o tras un descuadre) se reconstruyen con
+`python manage.py rebuild_ai_usage_rollups`.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+COUNTERS = ('request_count', 'success_count', 'tokens_input', 'tokens_output', 'cost', 'response_time_ms_total')
+
+
+def hour_start(dt):
+    return timezone.localtime(dt).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(dt):
+    return timezone.localtime(dt).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(dt):
+    start = hour_start(dt)
+    if start == dt:
+        return start
+    # Sumar en UTC: la aritmética sobre la hora local no respeta los cambios de horario
+    return hour_start(start.astimezone(dt_timezone.utc) + timedelta(hours=1))
+
+
+def _ceil_day(dt):
+    start = day_start(dt)
+    if start == dt:
+        return start
+    return day_start(start.astimezone(dt_timezone.utc) + timedelta(hours=36))
+
+
+def _empty_counters():
+    return {'request_count': 0, 'success_count': 0, 'tokens_input': 0, 'tokens_output': 0,
+            'cost': Decimal('0'), 'response_time_ms_total': 0}
+
+
+def aggregate_events(events):
+    """Suma eventos `(timestamp, model_id, request_type, success, tokens_in, tokens_out, cost, ms)`.
+
+    Devuelve `{(granularity, bucket_start, model_id, request_type): contadores}`.
+    """
+    buckets = defaultdict(_empty_counters)
+    for timestamp, model_id, request_type, success, tokens_in, tokens_out, cost, response_ms in events:
+        for granularity, start in (('hour', hour_start(timestamp)), ('day', day_start(timestamp))):
+            counters = buckets[(granularity, start, model_id, request_type)]
+            counters['request_count'] += 1
+            counters['success_count'] += 1 if success else 0
+            counters['tokens_input'] += tokens_in or 0
+            counters['tokens_output'] += tokens_out or 0
+            counters['cost'] += Decimal(str(cost or 0))
+            counters['response_time_ms_total'] += response_ms or 0
+    return buckets
+
+
+def _log_events(logs):
+    for log in logs:
+        yield (log.timestamp, log.model_used_id, log.request_type, log.success,
+               log.tokens_input, log.tokens_output, log.cost, log.response_time_ms)
+
+
+def apply_to_rollups(logs):
+    """Suma logs recién escritos (con `timestamp` ya asignado) a sus agregados.
+
+    Se llama dentro de la transacción que insertó los logs.
+    """
+    from .models import AIUsageRollup
+
+    buckets = aggregate_events(_log_events(logs))
+    for (granularity, start, model_id, request_type), counters in buckets.items():
+        lookup = {'granularity': granularity, 'bucket_start': start,
+                  'model_used_id': model_id, 'request_type': request_type}
+        increments = {name: F(name) + value for name, value in counters.items()}
+        if AIUsageRollup.objects.filter(**lookup).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                AIUsageRollup.objects.create(**lookup, **counters)
+        except IntegrityError:
+            # Otro proceso creó la fila entre el UPDATE y el INSERT
+            AIUsageRollup.objects.filter(**lookup).update(**increments)
+    return len(buckets)
+
+
+def rebuild_rollups(since=None) -> int:
+    """Recalcula los agregados desde los logs crudos (desde el día de `since`, o todos)."""
+    from .models import AIUsageLog, AIUsageRollup
+
+    logs = AIUsageLog.objects.all()
+    rollups = AIUsageRollup.objects.all()
+    if since is not None:
+        since = day_start(since)
+        logs = logs.filter(timestamp__gte=since)
+        rollups = rollups.filter(bucket_start__gte=since)
+    events = logs.values_list(
+        'timestamp', 'model_used_id', 'request_type', 'success',
+        'tokens_input', 'tokens_output', 'cost', 'response_time_ms',
+    ).iterator(chunk_size=5000)
+    buckets = aggregate_events(events)
+    with transaction.atomic():
+        rollups.delete()
+        AIUsageRollup.objects.bulk_create([
+            AIUsageRollup(granularity=granularity, bucket_start=start, model_used_id=model_id,
+                          request_type=request_type, **counters)
+            for (granularity, start, model_id, request_type), counters in buckets.items()
+        ], batch_size=1000)
+    return len(buckets)
+
+
+def split_window(start, end):
+    """Parte `[start, end)` en tramos crudos, horarios y diarios.
+
+    Devuelve `(raw, hourly, daily)`, cada uno una lista de pares `(desde, hasta)`.
+    """
+    first_hour, last_hour = _ceil_hour(start), hour_start(end)
+    if first_hour >= last_hour:
+        return [(start, end)], [], []
+    raw = [(start, first_hour), (last_hour, end)]
+    first_day, last_day = _ceil_day(first_hour), day_start(last_hour)
+    if first_day >= last_day:
+        return raw, [(first_hour, last_hour)], []
+    return raw, [(first_hour, first_day), (last_day, last_hour)], [(first_day, last_day)]
+
+
+def _range_q(field, ranges, **extra):
+    query = Q(pk__in=[])
+    for low, high in ranges:
+        if low < high:
+            query |= Q(**{f'{field}__gte': low, f'{field}__lt': high}, **extra)
+    return query
+
+
+def usage_summary(start, end=None) -> dict:
+    """Totales, desglose por modelo y serie diaria de `[start, end)` (end = ahora)."""
+    from .models import AIUsageLog, AIUsageRollup
+
+    end = end or timezone.now()
+    raw_ranges, hourly_ranges, daily_ranges = split_window(start, end)
+
+    rows = []
+    rollup_q = (_range_q('bucket_start', hourly_ranges, granularity='hour')
+                | _range_q('bucket_start', daily_ranges, granularity='day'))
+    if hourly_ranges or daily_ranges:
+        for row in AIUsageRollup.objects.filter(rollup_q).values('bucket_start', 'model_used__name', *COUNTERS):
+            row['day'] = timezone.localtime(row.pop('bucket_start')).date()
+            rows.append(row)
+
+    raw_q = _range_q('timestamp', raw_ranges)
+    rows.extend(
+        AIUsageLog.objects.filter(raw_q)
+        .annotate(day=TruncDate('timestamp'))
+        .values('day', 'model_used__name')
+        .annotate(
+            request_count=Count('id'),
+            success_count=Count('id', filter=Q(success=True)),
+            tokens_input=Sum('tokens_input'),
+            tokens_output=Sum('tokens_output'),
+            cost=Sum('cost'),
+            response_time_ms_total=Sum('response_time_ms'),
+        )
+    )
+
+    totals = _empty_counters()
+    by_model = defaultdict(_empty_counters)
+    by_day = defaultdict(_empty_counters)
+    for row in rows:
+        for counters in (totals, by_model[row['model_used__name']], by_day[row['day']]):
+            for name in COUNTERS:
+                counters[name] += row[name] or 0
+
+    usage_by_model = sorted((
+        {
+            'model_used__name': name,
+            'request_count': counters['request_count'],
+            'total_tokens_input': counters['tokens_input'],
+            'total_tokens_output': counters['tokens_output'],
+            'total_cost': float(counters['cost']),
+            'avg_response_time': counters['response_time_ms_total'] / counters['request_count'],
+        }
+        for name, counters in by_model.items() if counters['request_count']
+    ), key=lambda item: -item['request_count'])
+
+    daily = [
+        {
+            'date': day.isoformat(),
+            'request_count': counters['request_count'],
+            'total_tokens_input': counters['tokens_input'],
+            'total_tokens_output': counters['tokens_output'],
+            'total_cost': float(counters['cost']),
+        }
+        for day, counters in sorted(by_day.items()) if counters['request_count']
+    ]
+
+    total = totals['request_count']
+    return {
+        'total_requests': total,
+        'total_tokens_input': totals['tokens_input'],
+        'total_tokens_output': totals['tokens_output'],
+        'total_cost': float(totals['cost']),
+        'usage_by_model': usage_by_model,
+        'daily': daily,
+        'success_rate': round(totals['success_count'] / total * 100, 2) if total else 0,
+    }
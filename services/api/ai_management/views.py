@@ -1,13 +1,15 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Count, Sum, Avg, Q
-from django.db.models.functions import TruncDate
 from django.db import models
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import timedelta
 from .models import AIModel, AIUsageLog, SamConfiguration
+from .routing import get_routing_stats, get_rules
+from .token_budget import get_budget_stats
 from .serializers import AIModelSerializer, AIUsageLogSerializer, SamConfigurationSerializer
+from .usage_rollups import usage_summary
 
 class AIModelViewSet(viewsets.ModelViewSet):
     queryset = AIModel.objects.all()
@@ -45,74 +47,26 @@ class AIUsageLogViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def usage_stats(self, request):
-        """Get usage statistics for the admin dashboard"""
+        """Get usage statistics for the admin dashboard.
+
+        Se calcula desde los agregados por hora/día (`usage_rollups`). Ventana:
+        los últimos `days` días, o `start`/`end` (ISO 8601) para una arbitraria.
+        """
         days = int(request.query_params.get('days', 30))
-        start_date = timezone.now() - timedelta(days=days)
-        
-        # Total usage stats
-        total_requests = AIUsageLog.objects.filter(timestamp__gte=start_date).count()
-        total_tokens_input = AIUsageLog.objects.filter(timestamp__gte=start_date).aggregate(Sum('tokens_input'))['tokens_input__sum'] or 0
-        total_tokens_output = AIUsageLog.objects.filter(timestamp__gte=start_date).aggregate(Sum('tokens_output'))['tokens_output__sum'] or 0
-        total_cost = AIUsageLog.objects.filter(timestamp__gte=start_date).aggregate(Sum('cost'))['cost__sum'] or 0
-        
-        # Usage by model
-        usage_by_model = AIUsageLog.objects.filter(timestamp__gte=start_date).values(
-            'model_used__name'
-        ).annotate(
-            request_count=Count('id'),
-            total_tokens_input=Sum('tokens_input'),
-            total_tokens_output=Sum('tokens_output'),
-            total_cost=Sum('cost'),
-            avg_response_time=Avg('response_time_ms')
-        ).order_by('-request_count')
+        end_date = parse_datetime(request.query_params.get('end') or '') or timezone.now()
+        start_date = parse_datetime(request.query_params.get('start') or '') or end_date - timedelta(days=days)
+        if timezone.is_naive(start_date):
+            start_date = timezone.make_aware(start_date)
+        if timezone.is_naive(end_date):
+            end_date = timezone.make_aware(end_date)
+        if start_date >= end_date:
+            return Response({'error': 'start debe ser anterior a end'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Daily time-series (requests and token/cost aggregates per day)
-        daily_queryset = (
-            AIUsageLog.objects
-            .filter(timestamp__gte=start_date)
-            .annotate(day=TruncDate('timestamp'))
-            .values('day')
-            .annotate(
-                request_count=Count('id'),
-                total_tokens_input=Sum('tokens_input'),
-                total_tokens_output=Sum('tokens_output'),
-                total_cost=Sum('cost')
-            )
-            .order_by('day')
-        )
-        daily_stats = [
-            {
-                'date': item['day'].isoformat(),
-                'request_count': item['request_count'],
-                'total_tokens_input': item['total_tokens_input'] or 0,
-                'total_tokens_output': item['total_tokens_output'] or 0,
-                'total_cost': float(item['total_cost'] or 0),
-            }
-            for item in daily_queryset
-        ]
-        
-        # Success rate
-        success_rate = AIUsageLog.objects.filter(
-            timestamp__gte=start_date
-        ).aggregate(
-            success_count=Count('id', filter=Q(success=True)),
-            total_count=Count('id')
+        stats = usage_summary(start_date, end_date)
+        stats['period_days'] = days if 'start' not in request.query_params else round(
+            (end_date - start_date).total_seconds() / 86400, 2
         )
-        
-        success_percentage = 0
-        if success_rate['total_count'] > 0:
-            success_percentage = (success_rate['success_count'] / success_rate['total_count']) * 100
-        
-        return Response({
-            'total_requests': total_requests,
-            'total_tokens_input': total_tokens_input,
-            'total_tokens_output': total_tokens_output,
-            'total_cost': float(total_cost),
-            'usage_by_model': list(usage_by_model),
-            'daily': daily_stats,
-            'success_rate': round(success_percentage, 2),
-            'period_days': days
-        })
+        return Response(stats)
 
 class SamConfigurationViewSet(viewsets.ModelViewSet):
     queryset = SamConfiguration.objects.all()
@@ -141,4 +95,16 @@ class SamConfigurationViewSet(viewsets.ModelViewSet):
             'has_custom_instructions': bool(config.custom_instructions),
             'last_updated': config.updated_at,
             'updated_by': config.updated_by.username if config.updated_by else None
-        })
\ No newline at end of file
+        })
+
+    @action(detail=False, methods=['get'])
+    def routing_stats(self, request):
+        """How often each routing path (rule, heuristic, cache, router, fallback) was taken"""
+        stats = get_routing_stats()
+        stats['rules'] = get_rules()
+        return Response(stats)
+
+    @action(detail=False, methods=['get'])
+    def token_budget_stats(self, request):
+        """Prompts fitted to the token budget and tokens saved by trimming history"""
+        return Response(get_budget_stats())
@@ -13,6 +13,8 @@ from .models import (
     Job,
     JobOffer,
     JobTimelineEvent,
+    PlusvaliaRecomputeTask,
+    PlusvaliaAIEvaluation,
 )
 
 @admin.register(Property)
@@ -154,3 +156,31 @@ class JobTimelineEventAdmin(admin.ModelAdmin):
     list_display = ('id', 'job', 'kind', 'actor', 'created_at')
     list_filter = ('kind',)
     search_fields = ('job__property__name', 'message')
+
+
+@admin.register(PlusvaliaRecomputeTask)
+class PlusvaliaRecomputeTaskAdmin(admin.ModelAdmin):
+    list_display = ('property', 'status', 'priority', 'reason', 'attempts', 'max_attempts', 'coalesced_count', 'next_attempt_at', 'updated_at')
+    list_filter = ('status', 'priority', 'reason')
+    search_fields = ('property__name', 'last_error')
+    readonly_fields = ('enqueued_at', 'finished_at', 'locked_by', 'locked_at', 'updated_at', 'last_error')
+    actions = ['retry_now']
+
+    @admin.action(description='Reintentar ahora')
+    def retry_now(self, request, queryset):
+        from django.utils import timezone
+        updated = queryset.exclude(status='running').update(
+            status='pending',
+            attempts=0,
+            next_attempt_at=timezone.now(),
+            finished_at=None,
+        )
+        self.message_user(request, f'{updated} tareas reencoladas.')
+
+
+@admin.register(PlusvaliaAIEvaluation)
+class PlusvaliaAIEvaluationAdmin(admin.ModelAdmin):
+    list_display = ('input_hash', 'score', 'model_key', 'prompt_version', 'hit_count', 'last_used_at', 'created_at')
+    list_filter = ('model_key', 'prompt_version')
+    search_fields = ('input_hash',)
+    readonly_fields = ('input_hash', 'model_key', 'prompt_version', 'score', 'hit_count', 'last_used_at', 'created_at')
@@ -0,0 +1,183 @@
+"""Categorización IA por lotes (`ai_category` / `ai_summary`).
+
+`categorize_property_with_ai` hace una llamada a Sam por propiedad. Para
+procesar el catálogo (`classify_existing_properties`, la acción
+`ai-categorize-batch`) aquí:
+
+- se omiten las propiedades cuyo contenido no cambió desde la última
+  categorización (huella `ai_content_hash` de los campos que ve el prompt),
+- se empaquetan AI_CATEGORIZATION_BATCH_SIZE propiedades por prompt y se pide
+  un arreglo JSON con una entrada por ID,
+- los lotes se envían con un pool acotado de hilos
+  (AI_CATEGORIZATION_MAX_WORKERS) bajo un token bucket global
+  (AI_CATEGORIZATION_RATE_PER_MINUTE) compartido por todos los hilos,
+- los resultados se guardan con un solo `bulk_update` y se invalida la
+  versión del catálogo (el índice de preselección usa `ai_summary`).
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from .ai_search_cache import bump_catalog_version
+from .models import Property
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_FIELDS = ('ai_category', 'ai_summary', 'ai_content_hash')
+DESCRIPTION_CHARS = 600
+
+
+class TokenBucket:
+    """Hasta `rate_per_minute` adquisiciones por minuto con ráfagas de `burst` (entre hilos)."""
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = float(rate_per_minute or 0) / 60.0
+        self.capacity = max(1, int(burst))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    __call__ = acquire
+
+
+def content_hash(prop) -> str:
+    """Huella de los campos que determinan la categoría y el resumen."""
+    payload = '|'.join(str(value) for value in (
+        prop.name, prop.type, prop.price, prop.size, prop.has_water, prop.has_views,
+        prop.latitude, prop.longitude, (prop.description or '')[:DESCRIPTION_CHARS],
+    ))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def needs_categorization(prop, force: bool = False) -> bool:
+    if force or not prop.ai_category or not prop.ai_summary:
+        return True
+    return prop.ai_content_hash != content_hash(prop)
+
+
+def build_batch_prompt(properties) -> str:
+    blocks = []
+    for prop in properties:
+        blocks.append(
+            f"ID {prop.id}: {prop.name} | tipo: {prop.type or 'sin tipo'} | precio: {float(prop.price)} | "
+            f"ha: {prop.size} | agua: {'sí' if prop.has_water else 'no'} | vistas: {'sí' if prop.has_views else 'no'} | "
+            f"coordenadas: {prop.latitude}, {prop.longitude}\n"
+            f"Descripción: {(prop.description or '')[:DESCRIPTION_CHARS]}"
+        )
+    return (
+        "Clasifica cada propiedad rural en UNA categoría corta y genera un resumen de 1-2 líneas. "
+        "Responde SOLO con un arreglo JSON con un objeto por propiedad y claves id, ai_category y ai_summary.\n\n"
+        + "\n\n".join(blocks)
+        + "\n\nEjemplo exacto de salida: [{\"id\": 1, \"ai_category\": \"forest\", "
+        "\"ai_summary\": \"Campo con bosque nativo cercano a ríos...\"}]"
+    )
+
+
+def parse_batch_response(text: str, ids) -> dict:
+    """`{id: {'ai_category', 'ai_summary'}}` para los IDs pedidos que vinieron en la respuesta."""
+    cleaned = (text or '').strip()
+    if cleaned.startswith('```'):
+        cleaned = re.sub(r'^```[a-zA-Z]*\s*', '', cleaned)
+        if cleaned.endswith('```'):
+            cleaned = cleaned[:-3]
+        cleaned = cleaned.strip()
+    data = json.loads(cleaned)
+    if isinstance(data, dict):
+        data = data.get('properties') or data.get('results') or [data]
+    wanted = set(ids)
+    results = {}
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            pid = int(item.get('id'))
+        except (TypeError, ValueError):
+            continue
+        if pid in wanted and (item.get('ai_category') or item.get('ai_summary')):
+            results[pid] = {'ai_category': item.get('ai_category'), 'ai_summary': item.get('ai_summary')}
+    return results
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def categorize_properties(properties, force=False, batch_size=None, max_workers=None,
+                          rate_per_minute=None, limiter=None, sam=None) -> dict:
+    """Categoriza y guarda las propiedades que lo necesiten. Devuelve contadores.
+
+    `limiter` (callable) reemplaza al token bucket propio, p. ej. para compartir
+    el límite con otros procesos; `sam` permite inyectar el servicio.
+    """
+    from ai_management.gemini_service import SamService
+
+    batch_size = max(1, int(batch_size or getattr(settings, 'AI_CATEGORIZATION_BATCH_SIZE', 8)))
+    max_workers = max(1, int(max_workers or getattr(settings, 'AI_CATEGORIZATION_MAX_WORKERS', 4)))
+    if rate_per_minute is None:
+        rate_per_minute = float(getattr(settings, 'AI_CATEGORIZATION_RATE_PER_MINUTE', 60))
+    limiter = limiter or TokenBucket(rate_per_minute, burst=max_workers)
+
+    properties = list(properties)
+    pending = [prop for prop in properties if needs_categorization(prop, force)]
+    stats = {'processed': len(properties), 'skipped': len(properties) - len(pending),
+             'updated': 0, 'failed': 0, 'ai_calls': 0}
+    if not pending:
+        return stats
+
+    sam = sam or SamService()  # una sola configuración y un solo modelo para todos los lotes
+
+    def run_batch(batch):
+        try:
+            limiter()
+            result = sam.generate_response(build_batch_prompt(batch), request_type="ai_property_classification")
+            text = (result or {}).get('response', '') if isinstance(result, dict) else str(result)
+            return batch, parse_batch_response(text, [prop.id for prop in batch])
+        except Exception as e:
+            logger.error(f"[AI Categorization] Error en lote {[prop.id for prop in batch]}: {e}")
+            return batch, {}
+        finally:
+            connections.close_all()  # conexiones del hilo del pool (se descarta al terminar)
+
+    batches = list(_chunks(pending, batch_size))
+    stats['ai_calls'] = len(batches)
+    changed = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches)), thread_name_prefix='ai-categorize') as pool:
+        for batch, results in pool.map(run_batch, batches):
+            for prop in batch:
+                data = results.get(prop.id)
+                if not data:
+                    stats['failed'] += 1
+                    continue
+                prop.ai_category = data['ai_category'] or prop.ai_category
+                prop.ai_summary = data['ai_summary'] or prop.ai_summary
+                prop.ai_content_hash = content_hash(prop)
+                changed.append(prop)
+
+    if changed:
+        # bulk_update no pasa por Property.save() ni por las señales de la caché
+        Property.objects.bulk_update(changed, CATEGORY_FIELDS, batch_size=200)
+        bump_catalog_version()
+    stats['updated'] = len(changed)
+    return stats
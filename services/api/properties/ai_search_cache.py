@@ -0,0 +1,322 @@
+"""Caché de respuestas de la búsqueda IA (`AISearchView`) con coalescencia.
+
+La clave combina:
+- la consulta normalizada (minúsculas, sin acentos, sin puntuación y con
+  espacios colapsados: "Muéstrame Villarrica" == "muestrame villarrica "),
+- la versión del catálogo (se incrementa al crear/editar/borrar propiedades,
+  así una recomendación nunca apunta a un catálogo viejo),
+- una huella del contexto de conversación (mensajes previos y propiedades
+  sugeridas), para no mezclar respuestas de conversaciones distintas.
+
+Las respuestas `location` dependen solo del lugar: se guardan en una clave
+aparte sin la versión del catálogo (guardar una propiedad no las invalida) y
+viven mucho (AI_SEARCH_CACHE_TTL_LOCATION); las de recomendación/chat viven
+poco (AI_SEARCH_CACHE_TTL_RECOMMENDATION). Las respuestas de fallback no se
+guardan. Una búsqueda consulta ambas claves con un solo `get_many`.
+
+Solicitudes idénticas concurrentes se resuelven con una sola llamada a Sam:
+dentro del proceso los seguidores esperan al líder; entre procesos el líder
+toma un candado con `cache.add` (valor: un token propio) y los demás sondean
+la caché hasta AI_SEARCH_COALESCE_WAIT_SECONDS antes de calcular por su
+cuenta. Solo quien tiene el token borra el candado.
+
+`acached_search` es la variante para vistas async: los seguidores esperan un
+`asyncio.Future` del líder en vez de bloquear un hilo.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from skyterra_backend.counters import incr_counter, read_counters, reset_counters
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'ai_search:response'
+LOCK_PREFIX = 'ai_search:lock'
+CATALOG_VERSION_KEY = 'ai_search:catalog_version'
+STATS_PREFIX = 'ai_search:stats'
+STATS_KEYS = ('hits', 'misses', 'coalesced')
+POLL_INTERVAL = 0.05
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_ainflight = {}  # clave -> asyncio.Future del líder (del event loop que la creó)
+
+
+def normalize_query(text: str) -> str:
+    """Consulta sin acentos, en minúsculas, sin puntuación y con espacios colapsados."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = re.sub(r'[^\w.,$ ]+', ' ', text)
+    text = re.sub(r'(?<!\d)[.,]|[.,](?!\d)', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _initial_version() -> int:
+    # Tras vaciar la caché la versión arranca en otro valor: el estado que cada
+    # proceso guarda por versión (p. ej. el índice de `retrieval`) no se reutiliza
+    return int(time.time() * 1000)
+
+
+def get_catalog_version() -> int:
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        initial = _initial_version()
+        cache.add(CATALOG_VERSION_KEY, initial, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY) or initial
+    return int(version)
+
+
+def bump_catalog_version():
+    """Invalida (lógicamente) todas las respuestas cacheadas."""
+    try:
+        cache.add(CATALOG_VERSION_KEY, _initial_version(), timeout=None)
+        cache.incr(CATALOG_VERSION_KEY)
+    except Exception:
+        logger.warning("[AISearchCache] No se pudo incrementar la versión del catálogo")
+
+
+def conversation_fingerprint(conversation_history) -> str:
+    """Huella estable del historial: rol, texto normalizado e IDs sugeridos."""
+    if not isinstance(conversation_history, list):
+        return ''
+    parts = []
+    for entry in conversation_history:
+        if not isinstance(entry, dict):
+            continue
+        role = (entry.get('role') or 'user').lower()
+        content = normalize_query(str(entry.get('content') or ''))
+        ids = [p.get('id') for p in entry.get('properties') or [] if isinstance(p, dict)]
+        if content or ids:
+            parts.append([role, content, ids])
+    if not parts:
+        return ''
+    payload = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def build_cache_key(query: str, conversation_history=None) -> str:
+    payload = '|'.join((
+        normalize_query(query),
+        str(get_catalog_version()),
+        conversation_fingerprint(conversation_history),
+    ))
+    return f"{CACHE_PREFIX}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+
+def build_location_key(query: str, conversation_history=None) -> str:
+    """Clave de las respuestas `location`: sin la versión del catálogo."""
+    payload = '|'.join((normalize_query(query), conversation_fingerprint(conversation_history)))
+    return f"{CACHE_PREFIX}:location:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+
+def build_cache_keys(query: str, conversation_history=None) -> tuple[str, str]:
+    """`(clave versionada, clave de ubicación)` de una consulta."""
+    return build_cache_key(query, conversation_history), build_location_key(query, conversation_history)
+
+
+def ttl_for(response) -> int:
+    """TTL según el modo de la respuesta; 0 significa no cachear."""
+    if not isinstance(response, dict) or response.get('fallback') or response.get('error'):
+        return 0
+    if response.get('search_mode') == 'location':
+        return int(getattr(settings, 'AI_SEARCH_CACHE_TTL_LOCATION', 60 * 60 * 24))
+    return int(getattr(settings, 'AI_SEARCH_CACHE_TTL_RECOMMENDATION', 300))
+
+
+def _incr_stat(name: str):
+    incr_counter(f"{STATS_PREFIX}:{name}")
+
+
+def get_cache_stats() -> dict:
+    stats = read_counters(STATS_PREFIX, STATS_KEYS)
+    total = sum(stats.values())
+    stats['total'] = total
+    stats['hit_rate'] = round((stats['hits'] + stats['coalesced']) / total, 4) if total else 0.0
+    return stats
+
+
+def reset_cache_stats():
+    reset_counters(STATS_PREFIX, STATS_KEYS)
+
+
+def _lookup(keys):
+    """Respuesta guardada bajo cualquiera de las claves (o None)."""
+    found = cache.get_many(list(keys))
+    for key in keys:
+        if found.get(key) is not None:
+            return found[key]
+    return None
+
+
+def _store(keys, response):
+    timeout = ttl_for(response)
+    if timeout > 0:
+        key = keys[1] if response.get('search_mode') == 'location' else keys[0]
+        cache.set(key, response, timeout=timeout)
+
+
+def get_cached_response(query: str, conversation_history=None):
+    """Respuesta cacheada (o None), contando el acierto/fallo en las estadísticas."""
+    cached = _lookup(build_cache_keys(query, conversation_history))
+    _incr_stat('hits' if cached is not None else 'misses')
+    return cached
+
+
+def store_response(query: str, conversation_history, response):
+    """Guarda una respuesta calculada fuera de `cached_search` (p. ej. en streaming)."""
+    _store(build_cache_keys(query, conversation_history), response)
+
+
+def _lock_key(keys) -> str:
+    return f"{LOCK_PREFIX}:{keys[0].rsplit(':', 1)[-1]}"
+
+
+def _wait_for_other_process(keys, lock_key):
+    """Sondea la caché mientras otro proceso tenga el candado de `keys`."""
+    deadline = time.monotonic() + float(getattr(settings, 'AI_SEARCH_COALESCE_WAIT_SECONDS', 20))
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        cached = _lookup(keys)
+        if cached is not None:
+            return cached
+        if cache.get(lock_key) is None:
+            break
+    return None
+
+
+def _release_lock(lock_key, token):
+    """Borra el candado solo si sigue siendo nuestro (puede haber expirado y tomarlo otro)."""
+    if token is not None and cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _compute_as_leader(keys, compute):
+    """Calcula la respuesta con el candado entre procesos tomado (si se puede)."""
+    lock_key = _lock_key(keys)
+    wait = float(getattr(settings, 'AI_SEARCH_COALESCE_WAIT_SECONDS', 20))
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, timeout=max(1, int(wait))):
+        cached = _wait_for_other_process(keys, lock_key)
+        if cached is not None:
+            return cached, 'coalesced'
+        # El otro proceso terminó sin guardar o se agotó la espera: se calcula aquí,
+        # con el candado solo si quedó libre
+        if not cache.add(lock_key, token, timeout=max(1, int(wait))):
+            token = None
+    try:
+        response = compute()
+        _store(keys, response)
+        return response, 'miss'
+    finally:
+        _release_lock(lock_key, token)
+
+
+def cached_search(query: str, conversation_history, compute):
+    """Devuelve `(response, source)` con source en {'hit', 'miss', 'coalesced'}.
+
+    `compute()` ejecuta la búsqueda IA real; se llama a lo sumo una vez por
+    clave entre las solicitudes concurrentes. Sus excepciones se propagan a
+    todas las solicitudes que esperaban el mismo resultado.
+    """
+    keys = build_cache_keys(query, conversation_history)
+    key = keys[0]
+    cached = _lookup(keys)
+    if cached is not None:
+        _incr_stat('hits')
+        return cached, 'hit'
+
+    with _inflight_lock:
+        slot = _inflight.get(key)
+        leader = slot is None
+        if leader:
+            slot = {'event': threading.Event(), 'response': None, 'error': None}
+            _inflight[key] = slot
+
+    if not leader:
+        slot['event'].wait()
+        if slot['error'] is not None:
+            raise slot['error']
+        _incr_stat('coalesced')
+        return slot['response'], 'coalesced'
+
+    try:
+        response, source = _compute_as_leader(keys, compute)
+        slot['response'] = response
+        _incr_stat('coalesced' if source == 'coalesced' else 'misses')
+        return response, source
+    except Exception as e:
+        slot['error'] = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        slot['event'].set()
+
+
+async def _acompute_as_leader(keys, compute):
+    lock_key = _lock_key(keys)
+    wait = float(getattr(settings, 'AI_SEARCH_COALESCE_WAIT_SECONDS', 20))
+    token = uuid.uuid4().hex
+    if not await cache.aadd(lock_key, token, timeout=max(1, int(wait))):
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            cached = await sync_to_async(_lookup)(keys)
+            if cached is not None:
+                return cached, 'coalesced'
+            if await cache.aget(lock_key) is None:
+                break
+        if not await cache.aadd(lock_key, token, timeout=max(1, int(wait))):
+            token = None
+    try:
+        response = await compute()
+        await sync_to_async(_store)(keys, response)
+        return response, 'miss'
+    finally:
+        await sync_to_async(_release_lock)(lock_key, token)
+
+
+async def acached_search(query: str, conversation_history, compute):
+    """Como `cached_search`, pero `compute` es una corrutina (función async sin argumentos)."""
+    keys = await sync_to_async(build_cache_keys)(query, conversation_history)
+    key = keys[0]
+    cached = await sync_to_async(_lookup)(keys)
+    if cached is not None:
+        await sync_to_async(_incr_stat)('hits')
+        return cached, 'hit'
+
+    loop = asyncio.get_running_loop()
+    future = _ainflight.get(key)
+    if future is not None and future.get_loop() is loop and not future.done():
+        response = await asyncio.shield(future)
+        await sync_to_async(_incr_stat)('coalesced')
+        return response, 'coalesced'
+
+    future = loop.create_future()
+    _ainflight[key] = future
+    try:
+        response, source = await _acompute_as_leader(keys, compute)
+        future.set_result(response)
+        await sync_to_async(_incr_stat)('coalesced' if source == 'coalesced' else 'misses')
+        return response, source
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # marcada como leída: sin seguidores no hay advertencia de asyncio
+        raise
+    finally:
+        if _ainflight.get(key) is future:
+            del _ainflight[key]
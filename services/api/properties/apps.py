@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.core.management import call_command
 
 
@@ -12,9 +12,36 @@ def create_listing_plans(sender, **kwargs):
         pass
 
 
+def bump_ai_search_catalog_version(sender, **kwargs):
+    """Las respuestas cacheadas de la búsqueda IA dejan de valer si cambia el catálogo"""
+    from .ai_search_cache import bump_catalog_version
+    bump_catalog_version()
+
+
+def bump_catalog_version_on_indexed_change(sender, instance, created=False, update_fields=None, **kwargs):
+    """Como `bump_ai_search_catalog_version`, pero solo si el guardado tocó campos indexados"""
+    from .retrieval import indexed_fields_changed
+    if created or indexed_fields_changed(instance, update_fields):
+        bump_ai_search_catalog_version(sender)
+
+
+def refresh_pilot_eligibility(sender, instance, **kwargs):
+    """La elegibilidad denormalizada del piloto sigue a sus documentos (API, admin y borrados)"""
+    from .models import PilotProfile
+    pilot = PilotProfile.objects.prefetch_related('documents').filter(pk=instance.pilot_id).first()
+    if pilot is not None:  # al borrar el piloto, sus documentos se van en cascada
+        pilot.update_compliance_status()
+
+
 class PropertiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'properties'
 
     def ready(self):
         post_migrate.connect(create_listing_plans, sender=self)
+        property_model = self.get_model('Property')
+        post_save.connect(bump_catalog_version_on_indexed_change, sender=property_model)
+        post_delete.connect(bump_ai_search_catalog_version, sender=property_model)
+        pilot_document_model = self.get_model('PilotDocument')
+        post_save.connect(refresh_pilot_eligibility, sender=pilot_document_model)
+        post_delete.connect(refresh_pilot_eligibility, sender=pilot_document_model)
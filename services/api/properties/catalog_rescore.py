@@ -0,0 +1,261 @@
+"""Re-scoring masivo del catálogo (plusvalía y/o categorías IA).
+
+Usado por `manage.py rescore_properties`. Los IDs se reparten en lotes entre
+un pool de procesos; cada lote se escribe con `bulk_update` (sin pasar por
+`Property.save()`, que volvería a encolar la plusvalía). Las llamadas reales a
+Sam pasan por un rate limit global compartido entre procesos y el avance se
+guarda en un checkpoint JSON para poder reanudar una corrida interrumpida.
+Las propiedades que fallan quedan fuera de los rangos completados (y en la
+lista `failed` del checkpoint), así la corrida siguiente las reintenta.
+"""
+import bisect
+import json
+import logging
+import multiprocessing
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+
+logger = logging.getLogger(__name__)
+
+TASK_PLUSVALIA = 'plusvalia'
+TASK_CATEGORIES = 'categories'
+TASKS = (TASK_PLUSVALIA, TASK_CATEGORIES)
+
+
+class SharedRateLimiter:
+    """Limita a `rate_per_minute` adquisiciones por minuto entre todos los procesos.
+
+    Reparte turnos espaciados 60/rate segundos usando un valor compartido
+    (multiprocessing.Value), así que funciona igual con 1 o N procesos.
+    """
+
+    def __init__(self, rate_per_minute: float, ctx=None):
+        ctx = ctx or multiprocessing
+        self.interval = 60.0 / rate_per_minute if rate_per_minute and rate_per_minute > 0 else 0.0
+        self._next_slot = ctx.Value('d', 0.0)
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._next_slot.get_lock():
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+    __call__ = acquire
+
+
+# ----------------------------------------------------------------------
+# Checkpoint
+# ----------------------------------------------------------------------
+
+class RescoreCheckpoint:
+    """Progreso persistido en un archivo JSON: rangos de IDs ya procesados y IDs con error."""
+
+    def __init__(self, path: str, tasks, force: bool):
+        self.path = path
+        self.tasks = sorted(tasks)
+        self.force = force
+        self.completed = []  # [[first_id, last_id], ...]
+        self.failed = set()  # IDs con error, pendientes de reintento
+        self.totals = {'processed': 0, 'updated': 0, 'failed': 0, 'ai_calls': 0}
+        self.started_at = datetime.now(dt_timezone.utc).isoformat()
+
+    def load(self) -> bool:
+        """Carga el checkpoint si corresponde a la misma configuración."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, encoding='utf-8') as fh:
+                data = json.load(fh)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Rescore] Checkpoint ilegible en {self.path}: {e}")
+            return False
+        if data.get('tasks') != self.tasks or data.get('force') != self.force:
+            logger.warning("[Rescore] Checkpoint de otra configuración; se ignora.")
+            return False
+        self.completed = [list(r) for r in data.get('completed', [])]
+        self.failed = set(data.get('failed', []))
+        self.totals.update(data.get('totals', {}))
+        self.started_at = data.get('started_at', self.started_at)
+        return True
+
+    def pending(self, ids):
+        """Filtra los IDs que no caen en ningún rango completado."""
+        ranges = []
+        for first, last in sorted(self.completed):
+            if ranges and first <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], last)
+            else:
+                ranges.append([first, last])
+        starts = [first for first, _ in ranges]
+        result = []
+        for pid in ids:
+            pos = bisect.bisect_right(starts, pid) - 1
+            if pos < 0 or pid > ranges[pos][1]:
+                result.append(pid)
+        return result
+
+    def mark(self, chunk_ids, result: dict):
+        """Registra un lote: sus IDs correctos pasan a completados; los fallidos no."""
+        failed = set(result.get('failed_ids', []))
+        run = []
+        for pid in sorted(chunk_ids):
+            if pid in failed:
+                if run:
+                    self.completed.append([run[0], run[-1]])
+                run = []
+            else:
+                run.append(pid)
+        if run:
+            self.completed.append([run[0], run[-1]])
+        self.failed = (self.failed - set(chunk_ids)) | failed
+        for key in self.totals:
+            if key != 'failed':
+                self.totals[key] += result.get(key, 0)
+        self.totals['failed'] = len(self.failed)
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump({
+                'tasks': self.tasks,
+                'force': self.force,
+                'started_at': self.started_at,
+                'completed': self.completed,
+                'failed': sorted(self.failed),
+                'totals': self.totals,
+            }, fh)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ----------------------------------------------------------------------
+# Worker
+# ----------------------------------------------------------------------
+
+_worker_limiter = None
+
+
+def init_worker(limiter):
+    """Inicializador de cada proceso del pool."""
+    global _worker_limiter
+    import django
+    from django.apps import apps
+
+    if not apps.ready:  # start method "spawn": el hijo no heredó Django configurado
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'skyterra_backend.settings')
+        django.setup()
+    from django.db import connections
+    connections.close_all()  # nunca reutilizar la conexión heredada del padre
+    _worker_limiter = limiter
+
+
+def rescore_chunk(chunk_ids, tasks, force=False, batch_size=200, limiter=None) -> dict:
+    """Recalcula un lote de propiedades y lo escribe con bulk_update.
+
+    Devuelve contadores del lote y `failed_ids`, las propiedades que fallaron.
+    """
+    from .models import Property
+    from .plusvalia_service import PlusvaliaService
+    from .services import categorize_property_with_ai
+
+    limiter = limiter or _worker_limiter
+    ai_calls = 0
+
+    def limited():
+        nonlocal ai_calls
+        ai_calls += 1
+        if limiter is not None:
+            limiter()
+
+    previous_hook = PlusvaliaService.ai_rate_limiter
+    PlusvaliaService.ai_rate_limiter = limited
+    updated, failed_ids = [], []
+    fields = set()
+    try:
+        for prop in Property.objects.filter(id__in=chunk_ids).order_by('id'):
+            changed = False
+            try:
+                if TASK_PLUSVALIA in tasks:
+                    score = PlusvaliaService.calculate(prop)
+                    if prop.plusvalia_score != score:
+                        prop.plusvalia_score = score
+                        fields.add('plusvalia_score')
+                        changed = True
+                if TASK_CATEGORIES in tasks and (force or not prop.ai_category or not prop.ai_summary):
+                    limited()
+                    data = categorize_property_with_ai(prop)
+                    for key, value in (data or {}).items():
+                        if value and getattr(prop, key) != value:
+                            setattr(prop, key, value)
+                            fields.add(key)
+                            changed = True
+            except Exception as e:
+                failed_ids.append(prop.pk)
+                logger.warning(f"[Rescore] Error recalculando propiedad {prop.pk}: {e}")
+                continue
+            if changed:
+                updated.append(prop)
+        if updated:
+            Property.objects.bulk_update(updated, sorted(fields), batch_size=batch_size)
+    finally:
+        PlusvaliaService.ai_rate_limiter = previous_hook
+
+    return {
+        'chunk': list(chunk_ids),
+        'processed': len(chunk_ids),
+        'updated': len(updated),
+        'failed': len(failed_ids),
+        'failed_ids': failed_ids,
+        'ai_calls': ai_calls,
+    }
+
+
+def _rescore_chunk_star(args):
+    return rescore_chunk(*args)
+
+
+def chunked(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def run_rescore(ids, tasks, checkpoint: RescoreCheckpoint, processes=1, chunk_size=50,
+                ai_rate_per_minute=0, force=False, on_progress=None):
+    """Ejecuta el re-scoring; `on_progress(done, total, result)` tras cada lote."""
+    pending_ids = checkpoint.pending(ids)
+    chunks = list(chunked(pending_ids, chunk_size))
+    total = len(pending_ids)
+    done = 0
+
+    def handle(result):
+        nonlocal done
+        checkpoint.mark(result['chunk'], result)
+        done += result['processed']
+        if on_progress:
+            on_progress(done, total, result)
+
+    if processes <= 1:
+        limiter = SharedRateLimiter(ai_rate_per_minute)
+        for chunk in chunks:
+            handle(rescore_chunk(chunk, tasks, force, limiter=limiter))
+        return total
+
+    from django.db import connections
+    connections.close_all()  # no compartir sockets de BD con los hijos
+    ctx = multiprocessing.get_context()
+    limiter = SharedRateLimiter(ai_rate_per_minute, ctx=ctx)
+    with ctx.Pool(processes=processes, initializer=init_worker, initargs=(limiter,)) as pool:
+        args = ((chunk, tasks, force) for chunk in chunks)
+        for result in pool.imap_unordered(_rescore_chunk_star, args):
+            handle(result)
+    return total
@@ -1,26 +1,78 @@
 import logging
+import math
 import os
-from typing import Optional
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import requests
+from django.conf import settings
 from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from skyterra_backend.resilience import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+CACHE_TIMEOUT = 60 * 60 * 24  # 24h
+
 class ExternalMarketDataServiceError(Exception):
     pass
 
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+clearcapital_breaker = CircuitBreaker(
+    failure_threshold=int(getattr(settings, 'MARKET_DATA_BREAKER_THRESHOLD', 5)),
+    reset_timeout=float(getattr(settings, 'MARKET_DATA_BREAKER_RESET_SECONDS', 60)),
+)
+
+
+def get_http_session() -> requests.Session:
+    """Sesión HTTP compartida por proceso (keep-alive + reintentos en 5xx)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=2,
+                    backoff_factor=0.3,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({'GET', 'POST'}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def quantize(latitude: float, longitude: float, cell_size: float) -> Tuple[int, int]:
+    """Índice de la celda de grilla (cell_size en grados) que contiene el punto."""
+    return math.floor(latitude / cell_size), math.floor(longitude / cell_size)
+
+
 class ExternalMarketDataService:
     """Wrapper para servicios externos de datos de mercado inmobiliario.
     Busca obtener valoraciones automáticas (AVM) y tasas de apreciación histórica.
     Actualmente implementa un stub para Clear Capital Property Valuation API.
     Requiere configurar CLEARCAPITAL_API_KEY en variables de entorno.
+
+    Las consultas se cuantizan a celdas de grilla (MARKET_DATA_CELL_SIZE_DEG),
+    de modo que propiedades cercanas comparten caché y una misma llamada. Cada
+    celda guarda AVM y apreciación juntos, obtenidos con el endpoint batch.
     """
 
     CLEARCAPITAL_BASE_URL = "https://api.clearcapital.com/v4/valuation"  # Ejemplo, puede cambiar
+    BATCH_CHUNK_SIZE = 100
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, cell_size: Optional[float] = None):
         self.api_key = api_key or os.getenv("CLEARCAPITAL_API_KEY")
+        self.base_url = (base_url or getattr(settings, 'CLEARCAPITAL_BASE_URL', None) or self.CLEARCAPITAL_BASE_URL).rstrip('/')
+        self.cell_size = float(cell_size or getattr(settings, 'MARKET_DATA_CELL_SIZE_DEG', 0.05))
+        self.timeout = float(getattr(settings, 'MARKET_DATA_TIMEOUT_SECONDS', 5))
         if not self.api_key:
             logger.warning("ExternalMarketDataService: CLEARCAPITAL_API_KEY no configurada. Se usarán valores por defecto.")
 
@@ -28,49 +80,147 @@ class ExternalMarketDataService:
     # API methods
     # ------------------------------------------------------------------
 
-    def _call_clearcapital(self, endpoint: str, params: dict) -> Optional[dict]:
+    def _request(self, method: str, endpoint: str, **kwargs) -> Optional[dict]:
         if not self.api_key:
             return None
+        if not clearcapital_breaker.allow():
+            logger.debug("ClearCapital circuit breaker abierto; omitiendo llamada")
+            return None
         try:
             headers = {"Authorization": f"Bearer {self.api_key}"}
-            response = requests.get(
-                f"{self.CLEARCAPITAL_BASE_URL}/{endpoint}",
-                params=params,
+            response = get_http_session().request(
+                method,
+                f"{self.base_url}/{endpoint}",
                 headers=headers,
-                timeout=5,
+                timeout=self.timeout,
+                **kwargs,
             )
             if response.status_code != 200:
                 logger.warning(f"ClearCapital API error {response.status_code}: {response.text[:200]}")
+                if response.status_code >= 500 or response.status_code == 429:
+                    clearcapital_breaker.record_failure()
                 return None
+            clearcapital_breaker.record_success()
             return response.json()
         except Exception as e:
+            clearcapital_breaker.record_failure()
             logger.error(f"Error calling ClearCapital API: {e}")
             return None
 
+    def _call_clearcapital(self, endpoint: str, params: dict) -> Optional[dict]:
+        return self._request("GET", endpoint, params=params)
+
+    def _call_clearcapital_batch(self, points: List[dict]) -> Optional[List[dict]]:
+        data = self._request("POST", "batch", json={"points": points})
+        if not data or not isinstance(data.get("results"), list):
+            return None
+        return data["results"]
+
+    # Grid helpers ------------------------------------------------------
+
+    def _cell_center(self, cell: Tuple[int, int]) -> Tuple[float, float]:
+        return (
+            round((cell[0] + 0.5) * self.cell_size, 6),
+            round((cell[1] + 0.5) * self.cell_size, 6),
+        )
+
+    def _cell_cache_key(self, cell: Tuple[int, int], years: int) -> str:
+        return f"ext:clearcapital:cell:{self.cell_size}:{cell[0]}:{cell[1]}:{years}"
+
+    def _fetch_cells(self, cells: List[Tuple[int, int]], years: int) -> Dict[Tuple[int, int], dict]:
+        """Obtiene datos de mercado para celdas sin caché (batch, con fallback por celda)."""
+        fetched: Dict[Tuple[int, int], dict] = {}
+        for start in range(0, len(cells), self.BATCH_CHUNK_SIZE):
+            chunk = cells[start:start + self.BATCH_CHUNK_SIZE]
+            points = []
+            for cell in chunk:
+                lat, lon = self._cell_center(cell)
+                points.append({"id": f"{cell[0]}:{cell[1]}", "lat": lat, "lon": lon, "years": years})
+            results = self._call_clearcapital_batch(points)
+            if results is not None:
+                by_id = {str(item.get("id")): item for item in results if isinstance(item, dict)}
+                for cell, point in zip(chunk, points):
+                    item = by_id.get(point["id"])
+                    if item is not None:
+                        fetched[cell] = {
+                            "estimated_value": item.get("estimated_value"),
+                            "annual_appreciation": item.get("annual_appreciation"),
+                        }
+                continue
+            # El proveedor no soporta batch (o falló): consultar por celda
+            for cell, point in zip(chunk, points):
+                if not clearcapital_breaker.would_allow():
+                    break
+                avm = self._call_clearcapital("avm", {"lat": point["lat"], "lon": point["lon"]})
+                appreciation = self._call_clearcapital(
+                    "appreciation", {"lat": point["lat"], "lon": point["lon"], "years": years}
+                )
+                if avm is None and appreciation is None:
+                    continue
+                fetched[cell] = {
+                    "estimated_value": (avm or {}).get("estimated_value"),
+                    "annual_appreciation": (appreciation or {}).get("annual_appreciation"),
+                }
+        return fetched
+
+    def get_cells_data(self, cells: Iterable[Tuple[int, int]], years: int = 3) -> Dict[Tuple[int, int], dict]:
+        """Datos de mercado por celda, usando la caché y consultando solo las faltantes."""
+        unique_cells = list(dict.fromkeys(cells))
+        if not unique_cells:
+            return {}
+        keys = {cell: self._cell_cache_key(cell, years) for cell in unique_cells}
+        cached = cache.get_many(list(keys.values()))
+        result = {cell: cached[key] for cell, key in keys.items() if key in cached}
+        missing = [cell for cell in unique_cells if cell not in result]
+        if missing:
+            fetched = self._fetch_cells(missing, years)
+            if fetched:
+                cache.set_many({keys[cell]: data for cell, data in fetched.items()}, timeout=CACHE_TIMEOUT)
+            result.update(fetched)
+        return result
+
     # Public helpers ----------------------------------------------------
 
+    def get_market_data_batch(self, coordinates: Iterable[Tuple[float, float]], years: int = 3) -> Dict[Tuple[float, float], dict]:
+        """Consulta AVM y apreciación para muchas coordenadas de una vez.
+
+        Devuelve {(lat, lon): {"estimated_value": float|None, "annual_appreciation": float|None}}
+        para cada coordenada válida recibida.
+        """
+        points = [
+            (lat, lon) for lat, lon in coordinates
+            if lat is not None and lon is not None
+        ]
+        cell_by_point = {point: quantize(point[0], point[1], self.cell_size) for point in points}
+        cells_data = self.get_cells_data(cell_by_point.values(), years=years)
+        result = {}
+        for point, cell in cell_by_point.items():
+            data = cells_data.get(cell) or {}
+            result[point] = {
+                "estimated_value": _to_float(data.get("estimated_value")),
+                "annual_appreciation": _to_float(data.get("annual_appreciation")),
+            }
+        return result
+
+    def get_market_snapshot(self, latitude: float, longitude: float, years: int = 3) -> dict:
+        """AVM y apreciación para un punto con una sola consulta (o caché)."""
+        if latitude is None or longitude is None:
+            return {"estimated_value": None, "annual_appreciation": None}
+        return self.get_market_data_batch([(latitude, longitude)], years=years)[(latitude, longitude)]
+
     def get_market_estimated_value(self, latitude: float, longitude: float) -> Optional[float]:
         """Devuelve un valor estimado de mercado en USD para la ubicación dada."""
-        if latitude is None or longitude is None:
-            return None
-        cache_key = f"ext:clearcapital:avm:{latitude}:{longitude}"
-        data = cache.get(cache_key)
-        if data is None:
-            data = self._call_clearcapital("avm", {"lat": latitude, "lon": longitude})
-            if data is not None:
-                cache.set(cache_key, data, timeout=60 * 60 * 24)  # 24h
-        if data and "estimated_value" in data:
-            return float(data["estimated_value"])
-        return None
+        return self.get_market_snapshot(latitude, longitude)["estimated_value"]
 
     def get_historical_appreciation_rate(self, latitude: float, longitude: float, years: int = 3) -> Optional[float]:
         """Devuelve la tasa anual compuesta de apreciación (%) para los últimos N años en la zona."""
-        cache_key = f"ext:clearcapital:appreciation:{latitude}:{longitude}:{years}"
-        data = cache.get(cache_key)
-        if data is None:
-            data = self._call_clearcapital("appreciation", {"lat": latitude, "lon": longitude, "years": years})
-            if data is not None:
-                cache.set(cache_key, data, timeout=60 * 60 * 24)  # 24h
-        if data and "annual_appreciation" in data:
-            return float(data["annual_appreciation"])
-        return None 
\ No newline at end of file
+        return self.get_market_snapshot(latitude, longitude, years=years)["annual_appreciation"]
+
+
+def _to_float(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
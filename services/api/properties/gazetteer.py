@@ -0,0 +1,144 @@
+"""Respuestas de ubicación sin LLM a partir de un nomenclátor local.
+
+Buena parte de las consultas a Sam son solo un lugar ("Muéstrame Villarrica",
+"llévame al lago Ranco") y se respondían pidiéndole a Gemini las coordenadas
+de `flyToLocation`. `data/gazetteer_cl.json` trae regiones, ciudades y
+comunas, lagos y lugares conocidos de Chile; se cargan una vez por proceso en
+un trie de prefijos por palabra (sin acentos, en minúsculas, igual que la
+clave de la caché de búsqueda IA).
+
+La coincidencia es conservadora: la consulta debe ser solo un lugar más
+palabras de relleno ("muéstrame", "llévame a", "dónde queda"...). Cualquier
+otra palabra ("terrenos", "agua", "barato") deja la consulta para Sam.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from django.conf import settings
+
+from .ai_search_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+DATASET_PATH = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer_cl.json')
+DEFAULT_ZOOM = {'region': 7, 'city': 12, 'lake': 11, 'landmark': 10}
+MAX_QUERY_WORDS = 10
+FILLER_WORDS = frozenset("""
+    a al hacia el la los las de del en por favor porfa me te quiero quisiera podrias puedes
+    muestrame muestra mostrar mostrame ensename ver veamos mira mirar llevame lleva llevar
+    lleveme vamos ir ve vuela volar viaja viajar anda andar donde queda esta estan ubicacion
+    ubica ubicame mapa zona sector area alrededores cerca centro hola sam gracias y
+""".split())
+
+
+def _words(text: str) -> list:
+    return normalize_query(text).replace(',', ' ').replace('.', ' ').split()
+
+
+class Gazetteer:
+    """Trie de nombres de lugares (secuencias de palabras normalizadas)."""
+
+    TERMINAL = '$'
+
+    def __init__(self, places):
+        self.root = {}
+        self.size = 0
+        for place in places:
+            for name in [place['name']] + list(place.get('aliases') or []):
+                self._insert(_words(name), place)
+
+    def _insert(self, words, place):
+        if not words:
+            return
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+        if self.TERMINAL not in node:  # ante nombres repetidos gana la primera entrada
+            node[self.TERMINAL] = place
+            self.size += 1
+
+    def longest_match(self, words, start: int):
+        """`(lugar, palabras consumidas)` del nombre más largo que empieza en `start`."""
+        node, best = self.root, (None, 0)
+        for offset, word in enumerate(words[start:], start=1):
+            node = node.get(word)
+            if node is None:
+                break
+            if self.TERMINAL in node:
+                best = (node[self.TERMINAL], offset)
+        return best
+
+    def match_query(self, query: str) -> Optional[dict]:
+        """El lugar si la consulta es solo ese lugar más relleno; si no, None."""
+        words = _words(query)
+        if not words or len(words) > MAX_QUERY_WORDS:
+            return None
+        found, i = None, 0
+        while i < len(words):
+            place, consumed = self.longest_match(words, i)
+            if place is not None:
+                if found is not None and found is not place:
+                    return None  # dos lugares distintos: ambiguo
+                found, i = place, i + consumed
+            elif words[i] in FILLER_WORDS:
+                i += 1
+            else:
+                return None
+        return found
+
+
+def load_places(path: str = DATASET_PATH) -> list:
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh).get('places', [])
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """Nomenclátor del proceso, cargado una sola vez."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer(load_places())
+                logger.debug(f"[Gazetteer] {_gazetteer.size} nombres de lugares cargados")
+    return _gazetteer
+
+
+def location_response(place: dict) -> dict:
+    """Respuesta `location` con la misma forma que devuelve Sam."""
+    name = place['name']
+    return {
+        'search_mode': 'location',
+        'assistant_message': f"Claro, llevándote a {name}.",
+        'flyToLocation': {
+            'center': [place['lon'], place['lat']],
+            'zoom': place.get('zoom') or DEFAULT_ZOOM.get(place.get('kind'), 10),
+            'pitch': 0,
+            'bearing': 0,
+        },
+        'suggestedFilters': None,
+        'recommendations': [],
+        'interpretation': f"El usuario quiere ver {name}.",
+    }
+
+
+def answer_location_query(query: str, conversation_history=None) -> Optional[dict]:
+    """Respuesta local para consultas que son solo un lugar conocido (None en otro caso).
+
+    Solo aplica al inicio de una conversación: con historial, "Pucón" puede ser
+    un refinamiento ("¿y en Pucón?") que Sam debe interpretar en contexto.
+    """
+    if not getattr(settings, 'AI_GAZETTEER_ENABLED', True) or conversation_history:
+        return None
+    try:
+        place = get_gazetteer().match_query(query)
+    except Exception as e:  # un dataset roto nunca debe tumbar la búsqueda
+        logger.error(f"[Gazetteer] Error consultando el nomenclátor: {e}")
+        return None
+    return location_response(place) if place else None
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from properties.wave_benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Cuenta los statements SQL de una ola de invitación a pilotos (datos temporales, sin dejar rastro)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pilots', type=int, nargs='+', default=[1, 5],
+                            help='Cantidades de pilotos candidatos a medir')
+
+    def handle(self, *args, **options):
+        for row in run_benchmark(options['pilots']):
+            self.stdout.write(
+                f"{row['pilots']} pilotos -> {row['offers']} ofertas, "
+                f"{row['statements']} statements ({row['writes']} escrituras)"
+            )
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
+from properties.ai_categorization import categorize_properties, needs_categorization
 from properties.models import Property
-from properties.services import categorize_property_with_ai
+
 
 class Command(BaseCommand):
     help = 'Clasifica y genera resumen IA para propiedades existentes (campos ai_category y ai_summary)'
@@ -8,23 +9,25 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--limit', type=int, default=200, help='Máximo de propiedades a procesar')
         parser.add_argument('--force', action='store_true', help='Recalcular aunque ya exista ai_category/ai_summary')
+        parser.add_argument('--batch-size', type=int, default=None, help='Propiedades por prompt')
+        parser.add_argument('--workers', type=int, default=None, help='Llamadas concurrentes a Sam')
+        parser.add_argument('--rate', type=float, default=None, help='Máximo de llamadas a Sam por minuto (0 = sin límite)')
 
     def handle(self, *args, **options):
         limit = options['limit']
         force = options['force']
-        qs = Property.objects.all().order_by('-updated_at')
-        if not force:
-            qs = qs.filter(ai_category__isnull=True) | Property.objects.filter(ai_summary__isnull=True)
-        processed = 0
-        updated = 0
-        for prop in qs[:limit]:
-            processed += 1
-            data = categorize_property_with_ai(prop)
-            if data:
-                for k, v in data.items():
-                    if v:
-                        setattr(prop, k, v)
-                prop.save(update_fields=[k for k, v in data.items() if v])
-                updated += 1
-                self.stdout.write(self.style.SUCCESS(f"Propiedad {prop.id} clasificada: {data}"))
-        self.stdout.write(self.style.SUCCESS(f"Procesadas {processed}, actualizadas {updated}."))
+        # Solo las que no tienen categoría/resumen o cambiaron desde la última categorización
+        pending = []
+        for prop in Property.objects.order_by('-updated_at').iterator(chunk_size=500):
+            if needs_categorization(prop, force):
+                pending.append(prop)
+                if len(pending) >= limit:
+                    break
+        stats = categorize_properties(
+            pending, force=force, batch_size=options['batch_size'],
+            max_workers=options['workers'], rate_per_minute=options['rate'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Procesadas {stats['processed']}, actualizadas {stats['updated']}, "
+            f"fallidas {stats['failed']} ({stats['ai_calls']} llamadas a Sam)."
+        ))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from properties.plusvalia_distribution import refresh_distribution_if_stale
+from properties.plusvalia_queue import default_worker_id, process_batch, release_stale_tasks
+
+
+class Command(BaseCommand):
+    help = 'Worker que consume la cola de recálculo de plusvalía (PlusvaliaRecomputeTask)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Tareas reservadas por iteración')
+        parser.add_argument('--idle-sleep', type=float, default=5.0, help='Segundos de espera cuando la cola está vacía')
+        parser.add_argument('--max-tasks', type=int, default=0, help='Detener tras procesar N tareas (0 = sin límite)')
+        parser.add_argument('--once', action='store_true', help='Procesar lo pendiente una vez y salir')
+        parser.add_argument('--worker-id', type=str, default='', help='Identificador del worker (por defecto host:pid)')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        idle_sleep = max(0.0, options['idle_sleep'])
+        max_tasks = options['max_tasks']
+        once = options['once']
+        worker_id = options['worker_id'] or default_worker_id()
+
+        self.stdout.write(f"Worker de plusvalía {worker_id} iniciado (lote={batch_size})")
+        processed = succeeded = failed = 0
+        try:
+            while True:
+                release_stale_tasks()
+                stats = process_batch(limit=batch_size, worker_id=worker_id)
+                processed += stats['claimed']
+                succeeded += stats['succeeded']
+                failed += stats['failed']
+                if stats['claimed']:
+                    self.stdout.write(
+                        f"Lote: {stats['succeeded']} ok, {stats['failed']} con error (total {processed})"
+                    )
+                refresh_distribution_if_stale()
+                if max_tasks and processed >= max_tasks:
+                    break
+                if not stats['claimed']:
+                    if once:
+                        break
+                    time.sleep(idle_sleep)
+        except KeyboardInterrupt:
+            self.stdout.write('Worker detenido por el usuario.')
+
+        # Dejar percentiles al día con lo procesado antes de salir
+        refresh_distribution_if_stale(respect_interval=False)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Procesadas {processed}: {succeeded} actualizadas, {failed} con error."
+        ))
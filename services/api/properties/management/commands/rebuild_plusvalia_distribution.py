@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from properties.plusvalia_distribution import rebuild_distribution
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye la distribución de puntajes de plusvalía y los percentiles guardados en cada propiedad'
+
+    def handle(self, *args, **options):
+        distribution = rebuild_distribution()
+        segments = distribution['segments']
+        self.stdout.write(self.style.SUCCESS(
+            f"Distribución reconstruida: {len(segments['global'])} puntajes en {len(segments)} segmentos."
+        ))
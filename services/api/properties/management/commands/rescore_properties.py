@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from properties.catalog_rescore import TASKS, RescoreCheckpoint, run_rescore
+from properties.models import Property
+
+
+class Command(BaseCommand):
+    help = 'Recalcula plusvalía y/o categorías IA de todo el catálogo en paralelo, con checkpoint reanudable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=str, default='plusvalia',
+                            help=f"Qué recalcular, separado por comas: {', '.join(TASKS)}")
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Procesos del pool (1 = sin pool)')
+        parser.add_argument('--chunk-size', type=int, default=50, help='Propiedades por lote (unidad de checkpoint)')
+        parser.add_argument('--ai-rate', type=float, default=60.0,
+                            help='Máximo de llamadas a Sam por minuto entre todos los procesos (0 = sin límite)')
+        parser.add_argument('--force', action='store_true', help='Recalcular categorías aunque ya existan')
+        parser.add_argument('--limit', type=int, default=0, help='Procesar solo las primeras N propiedades (0 = todas)')
+        parser.add_argument('--checkpoint', type=str, default='',
+                            help='Archivo de checkpoint (por defecto en el directorio temporal)')
+        parser.add_argument('--restart', action='store_true', help='Ignorar el checkpoint existente y empezar de cero')
+
+    def handle(self, *args, **options):
+        tasks = [t.strip() for t in options['tasks'].split(',') if t.strip()]
+        invalid = [t for t in tasks if t not in TASKS]
+        if not tasks or invalid:
+            raise CommandError(f"Tareas inválidas: {invalid or tasks}. Opciones: {', '.join(TASKS)}")
+        processes = max(1, options['processes'])
+        chunk_size = max(1, options['chunk_size'])
+        checkpoint_path = options['checkpoint'] or os.path.join(
+            tempfile.gettempdir(), f"skyterra_rescore_{'_'.join(sorted(tasks))}.json"
+        )
+
+        checkpoint = RescoreCheckpoint(checkpoint_path, tasks, options['force'])
+        if options['restart']:
+            checkpoint.clear()
+        elif checkpoint.load():
+            self.stdout.write(
+                f"Reanudando desde {checkpoint_path}: {checkpoint.totals['processed']} ya procesadas."
+            )
+
+        ids = list(Property.objects.order_by('id').values_list('id', flat=True))
+        if options['limit']:
+            ids = ids[:options['limit']]
+
+        self.stdout.write(
+            f"Re-scoring de {len(ids)} propiedades ({', '.join(tasks)}) con {processes} procesos, "
+            f"lotes de {chunk_size}, IA <= {options['ai_rate'] or '∞'}/min"
+        )
+        started = time.monotonic()
+
+        def on_progress(done, total, result):
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed > 0 else 0.0
+            eta = (total - done) / rate if rate > 0 else 0.0
+            self.stdout.write(
+                f"{done}/{total} ({rate:.1f} prop/s, ETA {eta / 60:.1f} min) "
+                f"lote: {result['updated']} actualizadas, {result['failed']} con error, {result['ai_calls']} llamadas IA"
+            )
+
+        try:
+            pending = run_rescore(
+                ids,
+                tasks,
+                checkpoint,
+                processes=processes,
+                chunk_size=chunk_size,
+                ai_rate_per_minute=options['ai_rate'],
+                force=options['force'],
+                on_progress=on_progress,
+            )
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(
+                f"Interrumpido. Progreso guardado en {checkpoint_path}; vuelva a ejecutar para reanudar."
+            ))
+            return
+
+        if 'plusvalia' in tasks:
+            from properties.plusvalia_distribution import rebuild_distribution
+            rebuild_distribution()
+
+        totals = checkpoint.totals
+        elapsed = time.monotonic() - started
+        if checkpoint.failed:
+            self.stdout.write(self.style.WARNING(
+                f"{len(checkpoint.failed)} propiedades con error quedan en {checkpoint_path}; "
+                f"vuelva a ejecutar para reintentarlas."
+            ))
+        else:
+            checkpoint.clear()
+        try:
+            from properties.views import invalidate_property_cache
+            invalidate_property_cache()
+        except Exception:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo en {elapsed:.1f}s ({pending} en esta corrida): {totals['processed']} procesadas, "
+            f"{totals['updated']} actualizadas, {totals['failed']} con error, {totals['ai_calls']} llamadas IA."
+        ))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from properties.offer_sweeper import sweep_expired_offers
+
+
+class Command(BaseCommand):
+    help = 'Vence invitaciones a pilotos y envía la siguiente ola (worker en bucle)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0, help='Segundos entre pasadas')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Ofertas vencidas por pasada')
+        parser.add_argument('--once', action='store_true', help='Hacer una pasada y salir')
+
+    def handle(self, *args, **options):
+        interval = max(0.5, options['interval'])
+        batch_size = max(1, options['batch_size'])
+        self.stdout.write(f"Barrido de invitaciones iniciado (cada {interval}s)")
+        try:
+            while True:
+                stats = sweep_expired_offers(limit=batch_size)
+                if stats['expired']:
+                    self.stdout.write(
+                        f"{stats['expired']} ofertas vencidas en {stats['jobs']} trabajos; "
+                        f"{stats['waves_sent']} olas nuevas"
+                    )
+                if options['once']:
+                    break
+                if stats['expired'] < batch_size:
+                    time.sleep(interval)
+                close_old_connections()
+        except KeyboardInterrupt:
+            self.stdout.write('Barrido detenido por el usuario.')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from properties.pilot_compliance import sweep_pilot_compliance
+
+
+class Command(BaseCommand):
+    help = 'Vence documentos de pilotos y recalcula su elegibilidad para el matching (ejecutar a diario)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recalcular todos los pilotos, no solo los afectados')
+
+    def handle(self, *args, **options):
+        stats = sweep_pilot_compliance(recompute_all=options['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Documentos vencidos: {stats['expired_documents']}; pilotos revisados: "
+            f"{stats['pilots_checked']}, con cambios: {stats['pilots_changed']}"
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from properties.models import Property
+from properties.proximity import HUB_FIELDS, get_hub_indexes, nearest_hubs_batch
+
+
+class Command(BaseCommand):
+    help = 'Recalcula en lote las distancias de cada propiedad a ciudad, aeropuerto y puerto más cercanos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Propiedades por consulta/bulk_update')
+        parser.add_argument('--only-missing', action='store_true', help='Solo propiedades sin distancias calculadas')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        backend = get_hub_indexes()['city'].backend
+        qs = Property.objects.order_by('id').only('id', 'latitude', 'longitude', *HUB_FIELDS)
+        if options['only_missing']:
+            qs = qs.filter(distance_to_city_km__isnull=True, latitude__isnull=False, longitude__isnull=False)
+
+        updated = 0
+        batch = []
+        for prop in qs.iterator(chunk_size=batch_size):
+            batch.append(prop)
+            if len(batch) >= batch_size:
+                updated += self._flush(batch, batch_size)
+                batch = []
+        if batch:
+            updated += self._flush(batch, batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Distancias actualizadas para {updated} propiedades (backend {backend})."))
+
+    def _flush(self, batch, batch_size):
+        rows = nearest_hubs_batch((p.latitude, p.longitude) for p in batch)
+        for prop, values in zip(batch, rows):
+            for field, value in values.items():
+                setattr(prop, field, value)
+        # bulk_update no pasa por Property.save(): no re-encola plusvalía
+        Property.objects.bulk_update(batch, list(HUB_FIELDS), batch_size=batch_size)
+        return len(batch)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from properties.external_market_service import ExternalMarketDataService, quantize
+from properties.models import Property
+
+
+class Command(BaseCommand):
+    help = 'Precarga en caché los datos de mercado externos para cada celda de grilla con propiedades'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=3, help='Años para la tasa de apreciación')
+        parser.add_argument('--cell-size', type=float, default=None, help='Tamaño de celda en grados (por defecto MARKET_DATA_CELL_SIZE_DEG)')
+        parser.add_argument('--chunk-size', type=int, default=0, help='Celdas por llamada batch (0 = valor por defecto)')
+
+    def handle(self, *args, **options):
+        svc = ExternalMarketDataService(cell_size=options['cell_size'])
+        if options['chunk_size'] > 0:
+            svc.BATCH_CHUNK_SIZE = options['chunk_size']
+        if not svc.api_key:
+            self.stdout.write(self.style.WARNING('CLEARCAPITAL_API_KEY no configurada; nada que precargar.'))
+            return
+
+        coords = Property.objects.filter(
+            latitude__isnull=False, longitude__isnull=False
+        ).values_list('latitude', 'longitude').iterator()
+        cells = {quantize(float(lat), float(lon), svc.cell_size) for lat, lon in coords}
+        self.stdout.write(f"{len(cells)} celdas con propiedades (celda={svc.cell_size}°)")
+
+        data = svc.get_cells_data(sorted(cells), years=options['years'])
+        missing = len(cells) - len(data)
+        self.stdout.write(self.style.SUCCESS(
+            f"Celdas con datos en caché: {len(data)}; sin datos: {missing}."
+        ))
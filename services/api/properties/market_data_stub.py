@@ -0,0 +1,129 @@
+"""Servidor HTTP local que imita la API de ClearCapital (avm, appreciation, batch).
+
+Pensado para tests y desarrollo sin credenciales reales:
+
+    with MarketDataStubServer() as stub:
+        svc = ExternalMarketDataService(api_key='test', base_url=stub.base_url)
+
+También se puede levantar a mano y apuntar `CLEARCAPITAL_BASE_URL` a él:
+
+    python -m properties.market_data_stub 8765
+"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def stub_values(lat: float, lon: float, years: int = 3) -> dict:
+    """Valores deterministas a partir de la coordenada (para poder verificarlos en tests)."""
+    estimated_value = round(100000 + abs(lat) * 1000 + abs(lon) * 100, 2)
+    annual_appreciation = round((abs(lat) + abs(lon)) % 10, 2)
+    return {'estimated_value': estimated_value, 'annual_appreciation': annual_appreciation, 'years': years}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'MarketDataStub/1.0'
+
+    def log_message(self, format, *args):  # silencioso en tests
+        pass
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _record(self, endpoint: str, **extra):
+        with self.server.lock:
+            self.server.calls.append({'endpoint': endpoint, **extra})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        endpoint = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        self._record(endpoint, params=params)
+        if self.server.fail_status:
+            return self._send(self.server.fail_status, {'error': 'stub failure'})
+        try:
+            lat, lon = float(params['lat']), float(params['lon'])
+        except (KeyError, ValueError):
+            return self._send(400, {'error': 'lat/lon requeridos'})
+        values = stub_values(lat, lon, int(params.get('years', 3)))
+        if endpoint == 'avm':
+            return self._send(200, {'estimated_value': values['estimated_value']})
+        if endpoint == 'appreciation':
+            return self._send(200, {'annual_appreciation': values['annual_appreciation']})
+        return self._send(404, {'error': 'endpoint desconocido'})
+
+    def do_POST(self):
+        endpoint = urlparse(self.path).path.rstrip('/').rsplit('/', 1)[-1]
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = {}
+        points = payload.get('points') or []
+        self._record(endpoint, points=len(points))
+        if self.server.fail_status:
+            return self._send(self.server.fail_status, {'error': 'stub failure'})
+        if endpoint != 'batch' or not self.server.batch_enabled:
+            return self._send(404, {'error': 'endpoint desconocido'})
+        results = []
+        for point in points:
+            values = stub_values(float(point['lat']), float(point['lon']), int(point.get('years', 3)))
+            results.append({'id': point.get('id'), **values})
+        return self._send(200, {'results': results})
+
+
+class MarketDataStubServer:
+    """Levanta el stub en un hilo; `calls` registra cada request recibido."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, batch_enabled: bool = True):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.calls = []
+        self.httpd.lock = threading.Lock()
+        self.httpd.batch_enabled = batch_enabled
+        self.httpd.fail_status = 0
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def calls(self) -> list:
+        return self.httpd.calls
+
+    def fail_with(self, status: int):
+        """Hace que todas las respuestas devuelvan `status` (0 para desactivar)."""
+        self.httpd.fail_status = status
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = MarketDataStubServer(port=port)
+    print(f"Stub de datos de mercado escuchando en {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
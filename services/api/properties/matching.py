@@ -4,7 +4,8 @@ from datetime import timedelta
 from typing import List, Tuple, TYPE_CHECKING
 
 from django.apps import apps
-from django.db.models import Prefetch
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
@@ -14,8 +15,8 @@ if TYPE_CHECKING:  # pragma: no cover
 
 # Importación lazy para evitar dependencias circulares
 def _get_notification_service():
-    from .notification_service import send_job_offers_notifications
-    return send_job_offers_notifications
+    from .notification_service import dispatch_job_offer_notifications
+    return dispatch_job_offer_notifications
 
 # Configuración por defecto; puede moverse a settings si se requiere.
 MATCHING_DEFAULTS = {
@@ -29,9 +30,12 @@ MATCHING_DEFAULTS = {
 }
 
 
+EARTH_RADIUS_KM = 6371.0
+
+
 def haversine_distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Distancia aproximada entre dos puntos (km)."""
-    radius = 6371.0
+    radius = EARTH_RADIUS_KM
     lat1_rad = math.radians(lat1)
     lat2_rad = math.radians(lat2)
     delta_lat = math.radians(lat2 - lat1)
@@ -41,20 +45,15 @@ def haversine_distance_km(lat1: float, lon1: float, lat2: float, lon2: float) ->
     return radius * c
 
 
-def pilot_is_operational(pilot: PilotProfile) -> bool:
-    """Requiere documentos aprobados y estado activo."""
-    if pilot.status != "approved":
+def pilot_is_operational(pilot: "PilotProfile") -> bool:
+    """Requiere estado aprobado y documentos al día (campos que mantiene
+    `PilotProfile.update_compliance_status`; no consulta los documentos)."""
+    if pilot.status != "approved" or not pilot.is_operational:
         return False
-    docs = getattr(pilot, "_prefetched_documents", None) or list(pilot.documents.all())
-    if not docs:
-        return False
-    for doc in docs:
-        if doc.status in {"pending", "rejected", "expired"}:
-            return False
-    return True
+    return pilot.operational_until is None or pilot.operational_until >= timezone.localdate()
 
 
-def compute_score(pilot: PilotProfile, distance_km: float, radius_km: float) -> float:
+def compute_score(pilot: "PilotProfile", distance_km: float, radius_km: float) -> float:
     """Score simple basado en rating, distancia y actividad."""
     rating_component = float(pilot.rating or 0) / 5.0
     distance_norm = min(distance_km / radius_km, 1.0) if radius_km > 0 else 1.0
@@ -77,71 +76,96 @@ def compute_score(pilot: PilotProfile, distance_km: float, radius_km: float) ->
     )
 
 
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """Caja `(lat_min, lat_max, lon_min, lon_max)` que contiene el círculo de `radius_km`.
+
+    Sirve de prefiltro en SQL; la distancia exacta se calcula después solo
+    para los pilotos que caen dentro.
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    lat_min, lat_max = max(lat - delta_lat, -90.0), min(lat + delta_lat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    if cos_lat <= 1e-6 or radius_km / EARTH_RADIUS_KM >= math.pi * cos_lat:
+        return lat_min, lat_max, -180.0, 180.0  # cerca de los polos: sin acotar la longitud
+    delta_lon = min(math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)), 180.0)
+    return lat_min, lat_max, lon - delta_lon, lon + delta_lon
+
+
+def distances_km(lat: float, lon: float, points) -> List[float]:
+    """Haversine desde `(lat, lon)` a cada `(lat, lon)` de `points`, en una sola pasada."""
+    lat1 = math.radians(lat)
+    lon1 = math.radians(lon)
+    cos_lat1 = math.cos(lat1)
+    sin, cos, asin, sqrt, rad = math.sin, math.cos, math.asin, math.sqrt, math.radians
+    return [
+        2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(
+            sin((rad(lat2) - lat1) / 2) ** 2 + cos_lat1 * cos(rad(lat2)) * sin((rad(lon2) - lon1) / 2) ** 2
+        )))
+        for lat2, lon2 in points
+    ]
+
+
 def shortlist_pilots(job: "Job", wave: int) -> List[Tuple["PilotProfile", float, float]]:
-    """Devuelve pilotos elegibles ordenados (pilot, distancia, score)."""
+    """Devuelve pilotos elegibles ordenados (pilot, distancia, score).
+
+    Solo se traen de la base de datos los pilotos dentro de la caja que
+    contiene el radio de la ola y con documentos al día (índice sobre estado,
+    disponibilidad, elegibilidad y coordenadas), así que el costo depende de
+    los pilotos cercanos a la propiedad y no del total nacional. La tabla de
+    documentos no se toca.
+    """
     property_obj = job.property
-    logger.info(f"Shortlisting pilots for job {job.id} (property: {property_obj.name})")
-
     if property_obj.latitude is None or property_obj.longitude is None:
         logger.warning(f"Property {property_obj.id} has no coordinates")
         return []
 
     PilotProfile = apps.get_model("properties", "PilotProfile")
-    PilotDocument = apps.get_model("properties", "PilotDocument")
-    invited_ids = set(job.offers.values_list("pilot_id", flat=True))
-
-    # Count available pilots
-    total_pilots = PilotProfile.objects.filter(status="approved", is_available=True).count()
-    logger.info(f"Total approved and available pilots: {total_pilots}")
-
-    base_qs = (
-        PilotProfile.objects.filter(status="approved", is_available=True)
-        .exclude(id__in=invited_ids)
-        .select_related("user")
-        .prefetch_related(Prefetch("documents", queryset=PilotDocument.objects.all()))
-    )
-
-    logger.info(f"Found {base_qs.count()} eligible pilots (excluding already invited)")
+    lat, lon = float(property_obj.latitude), float(property_obj.longitude)
 
     radius_km = min(
         MATCHING_DEFAULTS["initial_radius_km"] + (wave - 1) * MATCHING_DEFAULTS["radius_step_km"],
         MATCHING_DEFAULTS["max_radius_km"],
     )
-
-    pilots = []
-    pilots_with_coords = 0
-    pilots_in_radius = 0
-
-    for pilot in base_qs:
-        if pilot.location_latitude is None or pilot.location_longitude is None:
-            continue
-
-        pilots_with_coords += 1
-        distance_km = haversine_distance_km(
-            property_obj.latitude,
-            property_obj.longitude,
-            pilot.location_latitude,
-            pilot.location_longitude,
+    lat_min, lat_max, lon_min, lon_max = bounding_box(lat, lon, radius_km)
+
+    nearby = (
+        PilotProfile.objects.filter(
+            status="approved",
+            is_available=True,
+            is_operational=True,
+            location_latitude__range=(lat_min, lat_max),
+            location_longitude__range=(lon_min, lon_max),
         )
+        .filter(Q(operational_until__isnull=True) | Q(operational_until__gte=timezone.localdate()))
+        .exclude(id__in=job.offers.values("pilot_id"))
+        .select_related("user")
+    )
+    candidates = list(nearby)
+    distances = distances_km(lat, lon, [(p.location_latitude, p.location_longitude) for p in candidates])
 
+    pilots = []
+    for pilot, distance_km in zip(candidates, distances):
         if distance_km > radius_km:
-            continue
-
-        pilots_in_radius += 1
-        pilot._prefetched_documents = list(pilot.documents.all())
-        if not pilot_is_operational(pilot):
-            continue
-        score = compute_score(pilot, distance_km, radius_km)
-        pilots.append((pilot, distance_km, score))
-
-    logger.info(f"Pilots with coordinates: {pilots_with_coords}, in radius: {pilots_in_radius}, operational: {len(pilots)}")
+            continue  # esquina de la caja, fuera del círculo
+        pilots.append((pilot, distance_km, compute_score(pilot, distance_km, radius_km)))
 
+    logger.info(
+        f"Shortlisting job {job.id}: {len(candidates)} pilots in bounding box of {radius_km} km, "
+        f"{len(pilots)} in radius"
+    )
     pilots.sort(key=lambda item: item[2], reverse=True)
     return pilots[: MATCHING_DEFAULTS["invite_count"]]
 
 
 def send_wave(job: "Job", wave: int, actor=None) -> List["JobOffer"]:
-    """Genera invitaciones para una ola específica."""
+    """Genera invitaciones para una ola específica.
+
+    Las ofertas se insertan con un solo `bulk_create(ignore_conflicts=True)`
+    (un piloto ya invitado por otra vía se omite) y el trabajo, la propiedad y
+    la línea de tiempo se actualizan en la misma transacción con un statement
+    cada uno. Las notificaciones se despachan después del commit, fuera de la
+    solicitud (`notification_service.dispatch_job_offer_notifications`).
+    """
     logger.info(f"Sending invite wave {wave} for job {job.id} (property: {job.property.name})")
 
     if wave > MATCHING_DEFAULTS["max_waves"]:
@@ -149,6 +173,7 @@ def send_wave(job: "Job", wave: int, actor=None) -> List["JobOffer"]:
         return []
 
     JobOffer = apps.get_model("properties", "JobOffer")
+    JobTimelineEvent = apps.get_model("properties", "JobTimelineEvent")
     job.expire_pending_offers(auto=False)
     candidates = shortlist_pilots(job, wave)
     logger.info(f"Found {len(candidates)} pilot candidates for job {job.id}")
@@ -157,32 +182,40 @@ def send_wave(job: "Job", wave: int, actor=None) -> List["JobOffer"]:
         logger.warning(f"No pilot candidates found for job {job.id}")
         return []
 
-    offers = []
     now = timezone.now()
     expires = now + timedelta(seconds=MATCHING_DEFAULTS["ttl_seconds"])
-    for pilot, distance_km, score in candidates:
-        offer, created = JobOffer.objects.get_or_create(
-            job=job,
-            pilot=pilot,
-            defaults={
-                "wave": wave,
-                "score": score,
-                "radius_km": distance_km,
-                "ttl_seconds": MATCHING_DEFAULTS["ttl_seconds"],
-                "expires_at": expires,
-                "metadata": {"wave": wave, "distance_km": distance_km},
-            },
+    with transaction.atomic():
+        JobOffer.objects.bulk_create(
+            [
+                JobOffer(
+                    job=job,
+                    pilot=pilot,
+                    wave=wave,
+                    score=score,
+                    radius_km=distance_km,
+                    ttl_seconds=MATCHING_DEFAULTS["ttl_seconds"],
+                    expires_at=expires,
+                    metadata={"wave": wave, "distance_km": distance_km},
+                )
+                for pilot, distance_km, score in candidates
+            ],
+            ignore_conflicts=True,
         )
-        if created:
-            offers.append(offer)
+        # ignore_conflicts no devuelve PKs: las ofertas de esta ola son las que llevan su `expires_at`
+        pilots_by_id = {pilot.id: pilot for pilot, _, _ in candidates}
+        offers = list(job.offers.filter(wave=wave, expires_at=expires, pilot_id__in=pilots_by_id))
+        for offer in offers:
+            offer.job = job
+            offer.pilot = pilots_by_id[offer.pilot_id]
+        offers.sort(key=lambda offer: offer.id)
+        if not offers:
+            return []
 
-    if offers:
         job.invite_wave = wave
         job.status = "inviting"
         job.last_status_change_at = now
         job.save(update_fields=["invite_wave", "status", "last_status_change_at", "updated_at"])
-        job.property.transition_to("inviting", actor=actor, metadata={"wave": wave}, commit=True)
-        JobTimelineEvent = apps.get_model("properties", "JobTimelineEvent")
+        job.property.transition_to("inviting", actor=actor, metadata={"wave": wave}, commit=True, via_update=True)
         JobTimelineEvent.objects.create(
             job=job,
             kind=f"invite_wave_{wave}",
@@ -194,13 +227,11 @@ def send_wave(job: "Job", wave: int, actor=None) -> List["JobOffer"]:
             actor=getattr(actor, "user", actor),
         )
 
-        # Enviar notificaciones push a los pilotos
-        if offers:
-            try:
-                notification_service = _get_notification_service()
-                notification_service(offers)
-            except Exception as notification_error:
-                # No bloquear el flujo por fallos de notificaciones
-                logger.warning(f"Failed to send notifications for job {job.id}: {notification_error}")
+        # Notificaciones push a los pilotos, después del commit y fuera de la solicitud
+        try:
+            _get_notification_service()(offers)
+        except Exception as notification_error:
+            # No bloquear el flujo por fallos de notificaciones
+            logger.warning(f"Failed to queue notifications for job {job.id}: {notification_error}")
 
     return offers
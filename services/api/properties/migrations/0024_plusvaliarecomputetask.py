@@ -0,0 +1,40 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0023_pilot_device'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlusvaliaRecomputeTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('running', 'En proceso'), ('done', 'Completada'), ('failed', 'Fallida')], default='pending', max_length=20)),
+                ('priority', models.SmallIntegerField(default=0)),
+                ('reason', models.CharField(blank=True, max_length=64)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('coalesced_count', models.PositiveIntegerField(default=0, help_text='Encolados adicionales fusionados en esta tarea.')),
+                ('rerun_requested', models.BooleanField(default=False, help_text='La propiedad cambió mientras se procesaba; volver a encolar al terminar.')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=64)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('enqueued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('property', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='plusvalia_task', to='properties.property')),
+            ],
+            options={
+                'ordering': ['-priority', 'next_attempt_at'],
+                'indexes': [models.Index(fields=['status', 'priority', 'next_attempt_at'], name='properties__status_ca6522_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0024_plusvaliarecomputetask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlusvaliaAIEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_hash', models.CharField(max_length=64, unique=True)),
+                ('model_key', models.CharField(blank=True, max_length=120)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('score', models.PositiveSmallIntegerField()),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-last_used_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0025_plusvaliaaievaluation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='distance_to_airport_km',
+            field=models.FloatField(blank=True, help_text='Distancia al aeropuerto comercial más cercano (km).', null=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='distance_to_city_km',
+            field=models.FloatField(blank=True, db_index=True, help_text='Distancia al centro urbano más cercano (km).', null=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='distance_to_port_km',
+            field=models.FloatField(blank=True, help_text='Distancia al puerto más cercano (km).', null=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='nearest_city_name',
+            field=models.CharField(blank=True, help_text='Centro urbano más cercano según el dataset de referencia.', max_length=120),
+        ),
+    ]
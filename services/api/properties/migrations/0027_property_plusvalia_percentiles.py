@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-19 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0026_property_hub_distances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='plusvalia_percentile',
+            field=models.FloatField(blank=True, help_text='Percentil (0-100) del puntaje entre propiedades aprobadas.', null=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='plusvalia_region_percentile',
+            field=models.FloatField(blank=True, help_text='Percentil (0-100) del puntaje dentro de su región.', null=True),
+        ),
+    ]
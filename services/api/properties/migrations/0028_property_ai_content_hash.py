@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0027_property_plusvalia_percentiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='ai_content_hash',
+            field=models.CharField(blank=True, default='', help_text='Huella del contenido con el que se generaron ai_category/ai_summary.', max_length=40),
+        ),
+    ]
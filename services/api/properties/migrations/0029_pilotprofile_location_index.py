@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0028_property_ai_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pilotprofile',
+            index=models.Index(fields=['status', 'is_available', 'location_latitude', 'location_longitude'], name='properties__status_f7a64a_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:13
+
+from django.db import migrations, models
+from django.utils import timezone
+
+REQUIRED_DOCUMENT_TYPES = ['id', 'license', 'drone_registration', 'insurance', 'background_check']
+BLOCKING_STATUSES = {'pending', 'rejected', 'expired'}
+
+
+def backfill_operational(apps, schema_editor):
+    PilotProfile = apps.get_model('properties', 'PilotProfile')
+    today = timezone.localdate()
+    for pilot in PilotProfile.objects.prefetch_related('documents').iterator(chunk_size=500):
+        docs = list(pilot.documents.all())
+        by_type = {doc.doc_type: doc for doc in docs}
+        compliant = all(
+            doc_type in by_type
+            and by_type[doc_type].status == 'approved'
+            and not (by_type[doc_type].expires_at and by_type[doc_type].expires_at < today)
+            for doc_type in REQUIRED_DOCUMENT_TYPES
+        )
+        pilot.is_operational = bool(docs) and compliant and not any(doc.status in BLOCKING_STATUSES for doc in docs)
+        pilot.operational_until = min((doc.expires_at for doc in docs if doc.expires_at), default=None)
+        pilot.save(update_fields=['is_operational', 'operational_until'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0029_pilotprofile_location_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='pilotprofile',
+            name='properties__status_f7a64a_idx',
+        ),
+        migrations.AddField(
+            model_name='pilotprofile',
+            name='is_operational',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='pilotprofile',
+            name='operational_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pilotprofile',
+            index=models.Index(fields=['status', 'is_available', 'is_operational', 'location_latitude', 'location_longitude'], name='properties__status_1df733_idx'),
+        ),
+        migrations.RunPython(backfill_operational, migrations.RunPython.noop),
+    ]
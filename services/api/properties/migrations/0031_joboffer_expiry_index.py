@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-19 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0030_pilotprofile_operational'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='joboffer',
+            index=models.Index(fields=['status', 'expires_at'], name='properties__status_52e268_idx'),
+        ),
+    ]
@@ -176,9 +176,18 @@ class Property(models.Model):
     rent_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
     rental_terms = models.TextField(blank=True)
     plusvalia_score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, help_text="Métrica que refleja el potencial de plusvalía (0-100). Visible para suscriptores Pro.")
+    # Percentiles precalculados por properties/plusvalia_distribution.py (no editar a mano)
+    plusvalia_percentile = models.FloatField(null=True, blank=True, help_text="Percentil (0-100) del puntaje entre propiedades aprobadas.")
+    plusvalia_region_percentile = models.FloatField(null=True, blank=True, help_text="Percentil (0-100) del puntaje dentro de su región.")
     # Campos enriquecidos por IA (clasificación y resumen). No se usan para filtrar en la UI.
     ai_category = models.CharField(max_length=100, null=True, blank=True, help_text="Categoría inferida por IA (ej. Farm, Ranch, Forest, Lake) o etiquetas internas.")
     ai_summary = models.TextField(null=True, blank=True, help_text="Resumen corto generado por IA para mejorar búsquedas y recomendaciones.")
+    ai_content_hash = models.CharField(max_length=40, blank=True, default='', help_text="Huella del contenido con el que se generaron ai_category/ai_summary.")
+    # Distancias (km) al centro de referencia más cercano; ver properties/proximity.py
+    distance_to_city_km = models.FloatField(null=True, blank=True, db_index=True, help_text="Distancia al centro urbano más cercano (km).")
+    distance_to_airport_km = models.FloatField(null=True, blank=True, help_text="Distancia al aeropuerto comercial más cercano (km).")
+    distance_to_port_km = models.FloatField(null=True, blank=True, help_text="Distancia al puerto más cercano (km).")
+    nearest_city_name = models.CharField(max_length=120, blank=True, help_text="Centro urbano más cercano según el dataset de referencia.")
     terrain = models.CharField(max_length=50, choices=TERRAIN_CHOICES, default='flat', blank=True)
     access = models.CharField(max_length=50, choices=ACCESS_CHOICES, default='paved', blank=True)
     legal_status = models.CharField(max_length=50, choices=LEGAL_STATUS_CHOICES, default='clear', blank=True)
@@ -280,8 +289,13 @@ class Property(models.Model):
             payload['hours'] = plan_eta
         return payload
 
-    def transition_to(self, substate, actor=None, message=None, metadata=None, commit=True):
-        """Actualiza el estado del flujo y registra historial."""
+    def transition_to(self, substate, actor=None, message=None, metadata=None, commit=True, via_update=False):
+        """Actualiza el estado del flujo y registra historial.
+
+        Con `via_update=True` se guarda con un UPDATE directo de los campos del
+        flujo (sin `full_clean` ni señales: no cambian nada que vea la búsqueda
+        IA), para caminos calientes como el envío de olas de invitación.
+        """
         if substate not in WORKFLOW_SUBSTATE_DEFINITIONS:
             raise ValidationError({'workflow_substate': f'Estado "{substate}" no es válido.'})
 
@@ -308,11 +322,20 @@ class Property(models.Model):
                 )
 
         metadata = metadata or {}
-        if commit:
+        if commit and via_update:
+            self.updated_at = timezone.now()
+            Property.objects.filter(pk=self.pk).update(
+                workflow_substate=self.workflow_substate,
+                workflow_node=self.workflow_node,
+                workflow_progress=self.workflow_progress,
+                updated_at=self.updated_at,
+            )
+        elif commit:
             self.save(
                 update_fields=['workflow_substate', 'workflow_node', 'workflow_progress', 'updated_at'],
                 recalculate_plusvalia=False,
             )
+        if commit:
             PropertyStatusHistory.objects.create(
                 property=self,
                 node=self.workflow_node,
@@ -574,23 +597,62 @@ class Property(models.Model):
             'required_documents': list(required_docs),
         }
 
+    def _refresh_hub_distances(self, save_kwargs):
+        """Recalcula las distancias a centros de referencia (consulta en memoria)."""
+        from .proximity import HUB_FIELDS, nearest_hubs
+
+        update_fields = save_kwargs.get('update_fields')
+        if update_fields is not None and not {'latitude', 'longitude'} & set(update_fields):
+            return
+        try:
+            values = nearest_hubs(self.latitude, self.longitude)
+        except Exception as e:
+            logger.warning(f"No se pudieron calcular distancias a centros para propiedad {self.id}: {e}")
+            return
+        for field, value in values.items():
+            setattr(self, field, value)
+        if update_fields is not None:
+            save_kwargs['update_fields'] = list(dict.fromkeys(list(update_fields) + list(HUB_FIELDS)))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores leídos de la BD: `retrieval.indexed_fields_changed` compara contra ellos
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
-        """Override save para calcular automáticamente el plusvalia_score antes de guardar."""
+        """Override save que agenda el recálculo del plusvalia_score.
+
+        Por defecto el cálculo (que incluye una llamada a Sam) se encola en
+        `PlusvaliaRecomputeTask` y lo procesa `process_plusvalia_queue`; con
+        PLUSVALIA_ASYNC_RECOMPUTE=False se mantiene el cálculo en línea.
+        """
+        from .plusvalia_queue import async_recompute_enabled, enqueue_plusvalia_recompute
+
         # Ejecuta validaciones estándar
         is_new = self.pk is None
         self.full_clean()
-        # Calcular puntaje de plusvalía (si no se pasa explícitamente o si se fuerza recálculo)
         # El parámetro de palabra clave 'recalculate_plusvalia' permite recalcular desde callers
         recalc = kwargs.pop('recalculate_plusvalia', False)
-        if self.plusvalia_score is None or recalc:
+        needs_score = self.plusvalia_score is None or recalc
+        run_async = async_recompute_enabled()
+        self._refresh_hub_distances(kwargs)
+        if needs_score and not run_async:
             try:
                 self.plusvalia_score = self.calculate_plusvalia_score()
             except Exception as e:
                 # No impedir el guardado si algo falla; dejar puntaje en None
-                import logging
-                logging.getLogger(__name__).error(f"Error calculando plusvalia_score para propiedad {self.id}: {e}")
+                logger.error(f"Error calculando plusvalia_score para propiedad {self.id}: {e}")
         super().save(*args, **kwargs)
 
+        # Guardados parciales (update_fields) solo encolan si se pide explícitamente.
+        if needs_score and run_async and (recalc or kwargs.get('update_fields') is None):
+            try:
+                enqueue_plusvalia_recompute(self, reason='created' if is_new else 'updated', is_new=is_new)
+            except Exception as e:
+                logger.error(f"Error encolando recálculo de plusvalía para propiedad {self.id}: {e}")
+
         if is_new:
             try:
                 has_history = self.status_history.exists()
@@ -823,6 +885,9 @@ class PilotProfile(models.Model):
     is_available = models.BooleanField(default=False)
     location_latitude = models.FloatField(null=True, blank=True)
     location_longitude = models.FloatField(null=True, blank=True)
+    # Documentos al día para operar (lo mantiene update_compliance_status); vence el día siguiente a operational_until
+    is_operational = models.BooleanField(default=False)
+    operational_until = models.DateField(null=True, blank=True)
     last_heartbeat_at = models.DateTimeField(null=True, blank=True)
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -830,6 +895,10 @@ class PilotProfile(models.Model):
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Elegibilidad + prefiltro por caja del matching (matching.shortlist_pilots)
+            models.Index(fields=['status', 'is_available', 'is_operational', 'location_latitude', 'location_longitude']),
+        ]
 
     def __str__(self):
         return self.display_name or self.user.get_full_name() or self.user.username
@@ -870,13 +939,34 @@ class PilotProfile(models.Model):
                 pending.append(f'{label} en revisión')
         return pending
 
+    def compute_operational_window(self, pending=None):
+        """`(is_operational, operational_until)` según los documentos del piloto.
+
+        Opera con todos los requisitos cumplidos y ningún documento pendiente,
+        rechazado o vencido; `operational_until` es el primer vencimiento.
+        """
+        docs = list(self.documents.all())
+        if pending is None:
+            pending = self.compute_pending_requirements()
+        blocked = any(doc.status in PilotDocument.BLOCKING_STATUSES for doc in docs)
+        is_operational = bool(docs) and not pending and not blocked
+        operational_until = min((doc.expires_at for doc in docs if doc.expires_at), default=None)
+        return is_operational, operational_until
+
     def update_compliance_status(self, commit=True):
         pending = self.compute_pending_requirements()
         new_status = 'approved' if not pending else 'pending'
+        is_operational, operational_until = self.compute_operational_window(pending)
         updates = []
         if self.status != new_status:
             self.status = new_status
             updates.append('status')
+        if self.is_operational != is_operational:
+            self.is_operational = is_operational
+            updates.append('is_operational')
+        if self.operational_until != operational_until:
+            self.operational_until = operational_until
+            updates.append('operational_until')
         if updates and commit:
             updates.append('updated_at')
             self.save(update_fields=updates)
@@ -917,6 +1007,8 @@ class PilotDocument(models.Model):
         ('rejected', 'Rechazado'),
         ('expired', 'Vencido'),
     ]
+    # Estados que impiden operar aunque el documento no sea obligatorio
+    BLOCKING_STATUSES = frozenset({'pending', 'rejected', 'expired'})
 
     pilot = models.ForeignKey(PilotProfile, related_name='documents', on_delete=models.CASCADE)
     doc_type = models.CharField(max_length=50, choices=DOCUMENT_TYPES)
@@ -1016,32 +1108,50 @@ class Job(models.Model):
         return offers
 
     def expire_pending_offers(self, auto=True):
-        """Marca ofertas vencidas y opcionalmente envía la siguiente ola."""
-        from .matching import MATCHING_DEFAULTS
+        """Marca ofertas vencidas y opcionalmente envía la siguiente ola.
 
+        En producción lo hace en bloque `offer_sweeper.sweep_expired_offers`
+        (`manage.py sweep_job_offers`); los endpoints de lectura no lo llaman.
+        """
         now = timezone.now()
-        pending = self.offers.filter(status='pending', expires_at__lt=now)
-        count = pending.update(status='expired', responded_at=now) if pending.exists() else 0
+        count = self.offers.filter(status='pending', expires_at__lt=now).update(status='expired', responded_at=now)
 
         if auto and count:
-            next_wave = self.invite_wave + 1 if self.invite_wave else 1
-            if next_wave <= MATCHING_DEFAULTS['max_waves']:
-                offers = self.send_invite_wave(wave=next_wave, actor=None)
-                if not offers:
-                    self.property.add_alert(
-                        'warning',
-                        'Seguimos sin pilotos disponibles. Nuestro equipo coordinará manualmente.',
-                        payload={'wave': next_wave},
-                        commit=True,
-                    )
-            else:
+            self.advance_invite_wave()
+        return count
+
+    def advance_invite_wave(self):
+        """Tras vencer una ola sin respuesta, envía la siguiente o avisa que se agotaron.
+
+        Si no sale ninguna oferta, `invite_wave` igual avanza: la ola queda
+        intentada y el barrido (`offer_sweeper.stalled_job_ids`) no la repite.
+        """
+        from .matching import MATCHING_DEFAULTS
+
+        next_wave = self.invite_wave + 1 if self.invite_wave else 1
+        if next_wave <= MATCHING_DEFAULTS['max_waves']:
+            offers = self.send_invite_wave(wave=next_wave, actor=None)
+            if not offers:
+                self._mark_wave_attempted(next_wave)
                 self.property.add_alert(
                     'warning',
-                    'Se agotaron las invitaciones automáticas. Contactaremos contigo en breve.',
+                    'Seguimos sin pilotos disponibles. Nuestro equipo coordinará manualmente.',
                     payload={'wave': next_wave},
                     commit=True,
                 )
-        return count
+            return offers
+        self._mark_wave_attempted(next_wave)
+        self.property.add_alert(
+            'warning',
+            'Se agotaron las invitaciones automáticas. Contactaremos contigo en breve.',
+            payload={'wave': next_wave},
+            commit=True,
+        )
+        return []
+
+    def _mark_wave_attempted(self, wave):
+        self.invite_wave = wave
+        Job.objects.filter(pk=self.pk).update(invite_wave=wave, updated_at=timezone.now())
 
     def transition(self, status, actor=None, message=None, metadata=None, commit=True):
         if status not in dict(self.STATUS_CHOICES):
@@ -1115,16 +1225,30 @@ class JobOffer(models.Model):
     class Meta:
         ordering = ['-sent_at']
         unique_together = ('job', 'pilot')
+        indexes = [
+            # Barrido de vencimientos (offer_sweeper) y bandeja de ofertas vigentes
+            models.Index(fields=['status', 'expires_at']),
+        ]
 
     def __str__(self):
         return f"Offer {self.id} job {self.job_id} -> {self.pilot_id} ({self.status})"
 
+    @property
+    def is_expired(self):
+        """Vencida aunque el barrido todavía no haya cambiado su estado."""
+        return self.status == 'expired' or (
+            self.status == 'pending' and self.expires_at is not None and self.expires_at < timezone.now()
+        )
+
     def accept(self, actor_user=None):
-        if self.status != 'pending':
+        if self.status != 'pending' or self.is_expired:
+            raise ValidationError("La invitación ya no está disponible.")
+        now = timezone.now()
+        # UPDATE condicional: el barrido de vencimientos puede haberla tomado entre tanto
+        if not JobOffer.objects.filter(pk=self.pk, status='pending').update(status='accepted', responded_at=now):
             raise ValidationError("La invitación ya no está disponible.")
         self.status = 'accepted'
-        self.responded_at = timezone.now()
-        self.save(update_fields=['status', 'responded_at'])
+        self.responded_at = now
 
         self.job.assigned_pilot = self.pilot
         self.job.transition(status='assigned', actor=actor_user, message='Piloto aceptó el trabajo.')
@@ -1178,3 +1302,71 @@ class RecordingOrder(models.Model):
 
     def __str__(self):
         return f"RecordingOrder {self.id} for {self.property.name} - {self.get_status_display()}"
+
+
+# -----------------------------
+# Cola de recálculo de plusvalía
+# -----------------------------
+
+class PlusvaliaRecomputeTask(models.Model):
+    """Solicitud pendiente de recálculo de plusvalía para una propiedad.
+
+    Existe a lo más una fila por propiedad: los encolados repetidos se
+    fusionan sobre la misma tarea (ver `properties.plusvalia_queue`).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('running', 'En proceso'),
+        ('done', 'Completada'),
+        ('failed', 'Fallida'),
+    ]
+
+    PRIORITY_NORMAL = 0
+    PRIORITY_NEW = 10
+    PRIORITY_PUBLISHED = 20
+
+    property = models.OneToOneField(Property, related_name='plusvalia_task', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    priority = models.SmallIntegerField(default=PRIORITY_NORMAL)
+    reason = models.CharField(max_length=64, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    coalesced_count = models.PositiveIntegerField(default=0, help_text="Encolados adicionales fusionados en esta tarea.")
+    rerun_requested = models.BooleanField(default=False, help_text="La propiedad cambió mientras se procesaba; volver a encolar al terminar.")
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    enqueued_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-priority', 'next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"Plusvalía {self.property_id} ({self.status}, intento {self.attempts})"
+
+
+class PlusvaliaAIEvaluation(models.Model):
+    """Memo persistente de puntajes IA de plusvalía.
+
+    La clave es un hash de los datos exactos del prompt + modelo/versión, de
+    modo que mientras esos datos no cambien no se vuelve a consultar a Sam.
+    """
+    input_hash = models.CharField(max_length=64, unique=True)
+    model_key = models.CharField(max_length=120, blank=True)
+    prompt_version = models.CharField(max_length=20)
+    score = models.PositiveSmallIntegerField()
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-last_used_at']
+
+    def __str__(self):
+        return f"IA plusvalía {self.input_hash[:12]} = {self.score} ({self.model_key})"
@@ -1,23 +1,30 @@
 import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from django.conf import settings
+from django.db import close_old_connections, transaction
 from .models import PilotDevice, JobOffer
 
 logger = logging.getLogger(__name__)
 
 
-def send_job_offer_notification(offer: JobOffer) -> bool:
+def send_job_offer_notification(offer: JobOffer, devices=None) -> bool:
     """
     Envía notificaciones push a los dispositivos del piloto sobre una nueva oferta de trabajo.
 
+    `devices` permite pasar los dispositivos activos ya cargados (envíos por lote).
+
     Returns:
         bool: True si se enviaron notificaciones exitosamente, False en caso contrario
     """
     try:
         pilot = offer.pilot
-        devices = PilotDevice.objects.filter(pilot=pilot, is_active=True)
+        if devices is None:
+            devices = list(PilotDevice.objects.filter(pilot=pilot, is_active=True))
 
-        if not devices.exists():
+        if not devices:
             logger.info(f"No active devices found for pilot {pilot.id}")
             return False
 
@@ -65,15 +72,70 @@ def send_job_offers_notifications(offers: List[JobOffer]) -> int:
     Returns:
         int: Número de notificaciones enviadas exitosamente
     """
+    devices_by_pilot = defaultdict(list)
+    for device in PilotDevice.objects.filter(pilot_id__in={offer.pilot_id for offer in offers}, is_active=True):
+        devices_by_pilot[device.pilot_id].append(device)
+
     sent_count = 0
     for offer in offers:
-        if send_job_offer_notification(offer):
+        if send_job_offer_notification(offer, devices=devices_by_pilot.get(offer.pilot_id, [])):
             sent_count += 1
 
     logger.info(f"Sent {sent_count}/{len(offers)} job offer notifications successfully")
     return sent_count
 
 
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(getattr(settings, 'JOB_OFFER_NOTIFICATION_WORKERS', 2))
+                _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='job-offer-notify')
+    return _executor
+
+
+def deliver_job_offer_notifications(offer_ids: List[int]) -> int:
+    """Carga las ofertas (con piloto, trabajo y propiedad) y envía sus notificaciones."""
+    try:
+        offers = list(
+            JobOffer.objects.filter(id__in=offer_ids).select_related('pilot__user', 'job__property')
+        )
+        return send_job_offers_notifications(offers)
+    except Exception as e:
+        logger.error(f"Error delivering job offer notifications {offer_ids}: {e}")
+        return 0
+    finally:
+        close_old_connections()
+
+
+def dispatch_job_offer_notifications(offers: List[JobOffer]) -> None:
+    """
+    Encola las notificaciones de una ola para después del commit.
+
+    Con JOB_OFFER_NOTIFICATIONS_ASYNC (por defecto) se envían en un pool de
+    hilos, fuera de la transacción y de la solicitud que generó la ola; si no,
+    se envían en línea al confirmar la transacción.
+    """
+    offer_ids = [offer.id for offer in offers]
+    if not offer_ids:
+        return
+
+    def submit():
+        if getattr(settings, 'JOB_OFFER_NOTIFICATIONS_ASYNC', True):
+            _get_executor().submit(deliver_job_offer_notifications, offer_ids)
+        else:
+            send_job_offers_notifications(
+                list(JobOffer.objects.filter(id__in=offer_ids).select_related('pilot__user', 'job__property'))
+            )
+
+    transaction.on_commit(submit)
+
+
 def send_job_status_notification(pilot, job, status: str, message: str = None) -> bool:
     """
     Envía notificaciones push sobre cambios de estado de trabajos.
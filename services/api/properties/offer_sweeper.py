@@ -0,0 +1,102 @@
+"""Vencimiento de invitaciones a pilotos en segundo plano.
+
+Antes cada GET de la bandeja del piloto (`JobViewSet.available`) y del
+detalle de un trabajo llamaba a `Job.expire_pending_offers(auto=True)`: con un
+TTL de 20 segundos y muchos pilotos consultando, una lectura podía hacer
+UPDATEs y hasta enviar una ola nueva con notificaciones. Ahora las lecturas
+solo filtran por `expires_at` y este barrido
+(`python manage.py sweep_job_offers`, en bucle) hace el trabajo:
+
+- vence en bloque las ofertas pendientes con `expires_at` pasado (índice
+  `status, expires_at`), con un UPDATE condicional para no pisar una
+  aceptación simultánea,
+- para cada trabajo que sigue invitando y ya no tiene ofertas vigentes, envía
+  la siguiente ola (o deja la alerta de olas agotadas). Cada trabajo se
+  bloquea con `select_for_update` para que dos barridos no envíen la misma ola.
+
+Los trabajos a avanzar se eligen por su estado (`stalled_job_ids`), no por las
+ofertas vencidas en el pase actual: si un pase falla o se interrumpe entre el
+vencimiento y el envío, el siguiente lo retoma.
+"""
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Job, JobOffer
+
+logger = logging.getLogger(__name__)
+
+
+def expire_offers(now=None, limit: int = 1000) -> dict:
+    """Vence hasta `limit` ofertas pendientes. Devuelve `{job_id: ofertas vencidas}`."""
+    now = now or timezone.now()
+    due = list(
+        JobOffer.objects.filter(status='pending', expires_at__lt=now)
+        .order_by('expires_at')
+        .values_list('id', 'job_id')[:limit]
+    )
+    if not due:
+        return {}
+    JobOffer.objects.filter(id__in=[offer_id for offer_id, _ in due], status='pending').update(
+        status='expired', responded_at=now,
+    )
+    per_job = {}
+    for _, job_id in due:
+        per_job[job_id] = per_job.get(job_id, 0) + 1
+    return per_job
+
+
+def stalled_job_ids(now=None, limit: int = 1000) -> list:
+    """Trabajos que siguen invitando, sin piloto y cuya ola actual ya no tiene ofertas vigentes."""
+    now = now or timezone.now()
+    current_wave = JobOffer.objects.filter(job=OuterRef('pk'), wave=OuterRef('invite_wave'))
+    live = JobOffer.objects.filter(job=OuterRef('pk'), status='pending', expires_at__gte=now)
+    return list(
+        Job.objects.filter(status='inviting', assigned_pilot__isnull=True)
+        .filter(Exists(current_wave))
+        .exclude(Exists(live))
+        .order_by('last_status_change_at')
+        .values_list('id', flat=True)[:limit]
+    )
+
+
+def advance_waves(job_ids, now=None) -> int:
+    """Envía la siguiente ola a los trabajos de `job_ids` que quedaron sin ofertas vigentes."""
+    now = now or timezone.now()
+    advanced = 0
+    for job_id in job_ids:
+        try:
+            with transaction.atomic():
+                qs = Job.objects.select_related('property')
+                if connection.features.has_select_for_update_skip_locked:
+                    qs = qs.select_for_update(skip_locked=True, of=('self',))
+                job = qs.filter(pk=job_id, status='inviting', assigned_pilot__isnull=True).first()
+                if (
+                    job is None
+                    or not job.offers.filter(wave=job.invite_wave).exists()
+                    or job.offers.filter(status='pending', expires_at__gte=now).exists()
+                ):
+                    continue  # otro barrido ya lo avanzó
+                job.advance_invite_wave()
+                advanced += 1
+        except Exception as e:
+            # Un trabajo con datos inconsistentes no debe frenar el resto del barrido
+            logger.error(f"[OfferSweeper] Error avanzando la ola del trabajo {job_id}: {e}")
+    return advanced
+
+
+def sweep_expired_offers(now=None, limit: int = 1000) -> dict:
+    """Un pase del barrido: vence ofertas y avanza olas."""
+    now = now or timezone.now()
+    per_job = expire_offers(now, limit=limit)
+    stalled = stalled_job_ids(now, limit=limit)
+    stats = {
+        'expired': sum(per_job.values()),
+        'jobs': len(per_job),
+        'waves_sent': advance_waves(stalled, now) if stalled else 0,
+    }
+    if per_job or stalled:
+        logger.info(f"[OfferSweeper] {stats}")
+    return stats
@@ -0,0 +1,44 @@
+"""Barrido diario de vencimientos de documentos de pilotos.
+
+`PilotProfile.is_operational` / `operational_until` se recalculan cada vez que
+se guarda o borra un documento del piloto (señales en `apps.py`, que cubren
+la API y el admin). Lo único
+que cambia sin que nadie edite nada es el calendario: este barrido
+(`python manage.py sweep_pilot_compliance`, una vez al día) marca como
+vencidos los documentos aprobados con `expires_at` pasado y recalcula solo los
+pilotos afectados.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PilotDocument, PilotProfile
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_pilot_compliance(today=None, recompute_all=False) -> dict:
+    """Vence documentos y recalcula la elegibilidad de los pilotos afectados."""
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        expired_docs = PilotDocument.objects.filter(status='approved', expires_at__lt=today)
+        pilot_ids = set(expired_docs.values_list('pilot_id', flat=True))
+        expired = expired_docs.update(status='expired')
+
+        pilots = PilotProfile.objects.all()
+        if not recompute_all:
+            pilots = pilots.filter(
+                Q(id__in=pilot_ids) | Q(is_operational=True, operational_until__lt=today)
+            )
+        changed = checked = 0
+        for pilot in pilots.prefetch_related('documents').iterator(chunk_size=500):
+            checked += 1
+            before = (pilot.status, pilot.is_operational, pilot.operational_until)
+            pilot.update_compliance_status()
+            changed += before != (pilot.status, pilot.is_operational, pilot.operational_until)
+
+    stats = {'expired_documents': expired, 'pilots_checked': checked, 'pilots_changed': changed}
+    logger.info(f"[PilotCompliance] Barrido {today}: {stats}")
+    return stats
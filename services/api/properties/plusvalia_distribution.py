@@ -0,0 +1,213 @@
+"""Distribución precalculada de puntajes de plusvalía (global, por región y por tipo).
+
+La distribución se reconstruye con una sola consulta a partir de las
+propiedades aprobadas con puntaje y se guarda en la caché como arreglos
+ordenados por segmento, más un histograma de 10 tramos. Con eso el percentil
+de cualquier puntaje se obtiene con `bisect` en O(log n).
+
+Cada segmento va en su propia clave (`plusvalia:distribution:<versión>:<segmento>`)
+y una clave pequeña de metadatos indica la versión vigente; una consulta lee
+solo los metadatos y los tres segmentos que necesita, no la distribución
+completa. Al publicar una versión nueva se borran las claves de la anterior.
+
+Cuando cambian puntajes (worker de la cola, rescore masivo) se marca la
+distribución como obsoleta; `refresh_distribution_if_stale` la reconstruye
+como máximo cada PLUSVALIA_DISTRIBUTION_REFRESH_SECONDS y de paso actualiza
+los campos `plusvalia_percentile` / `plusvalia_region_percentile`.
+"""
+import bisect
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Property
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'plusvalia:distribution'
+META_KEY = 'plusvalia:distribution:meta'
+STALE_KEY = 'plusvalia:distribution:stale'
+LOCK_KEY = 'plusvalia:distribution:lock'
+HISTOGRAM_BINS = 10
+PERCENTILE_FIELDS = ('plusvalia_percentile', 'plusvalia_region_percentile')
+
+
+def _min_segment_size() -> int:
+    return int(getattr(settings, 'PLUSVALIA_DISTRIBUTION_MIN_SEGMENT', 5))
+
+
+def _refresh_seconds() -> int:
+    return int(getattr(settings, 'PLUSVALIA_DISTRIBUTION_REFRESH_SECONDS', 300))
+
+
+def region_key(region: str) -> str:
+    return f"region:{(region or '').strip().lower()}"
+
+
+def type_key(prop_type: str) -> str:
+    return f"type:{prop_type or ''}"
+
+
+def _histogram(sorted_scores):
+    counts = []
+    for i in range(HISTOGRAM_BINS):
+        low = i * 100 / HISTOGRAM_BINS
+        high = (i + 1) * 100 / HISTOGRAM_BINS
+        lo_idx = bisect.bisect_left(sorted_scores, low)
+        hi_idx = bisect.bisect_left(sorted_scores, high) if i < HISTOGRAM_BINS - 1 else len(sorted_scores)
+        counts.append(hi_idx - lo_idx)
+    return counts
+
+
+def percentile_in(sorted_scores, score) -> float | None:
+    """Percentil (0-100, rango medio) de `score` dentro de la lista ordenada."""
+    n = len(sorted_scores)
+    if not n or score is None:
+        return None
+    score = float(score)
+    below = bisect.bisect_left(sorted_scores, score)
+    equal = bisect.bisect_right(sorted_scores, score) - below
+    return round((below + 0.5 * equal) * 100.0 / n, 2)
+
+
+def build_distribution() -> dict:
+    """Construye la distribución desde la base de datos (una consulta)."""
+    segments = {'global': []}
+    rows = Property.objects.filter(
+        publication_status='approved', plusvalia_score__isnull=False
+    ).values_list('address_region', 'type', 'plusvalia_score')
+    for region, prop_type, score in rows.iterator():
+        value = float(score)
+        segments['global'].append(value)
+        segments.setdefault(region_key(region), []).append(value)
+        segments.setdefault(type_key(prop_type), []).append(value)
+    for values in segments.values():
+        values.sort()
+    return {
+        'built_at': time.time(),
+        'segments': segments,
+        'histograms': {key: _histogram(values) for key, values in segments.items()},
+    }
+
+
+def _segment_cache_key(version, key) -> str:
+    return f"{CACHE_KEY}:{version}:{key}"
+
+
+def _store_distribution(distribution) -> dict:
+    """Publica cada segmento en su clave y después los metadatos que apuntan a ellos."""
+    previous = cache.get(META_KEY)
+    version = f"{distribution['built_at']:.6f}"
+    cache.set_many({
+        _segment_cache_key(version, key): {'values': values, 'histogram': distribution['histograms'][key]}
+        for key, values in distribution['segments'].items()
+    }, timeout=None)
+    meta = {'version': version, 'built_at': distribution['built_at'], 'segments': list(distribution['segments'])}
+    cache.set(META_KEY, meta, timeout=None)
+    if previous and previous.get('version') != version:
+        cache.delete_many([_segment_cache_key(previous['version'], key) for key in previous.get('segments', [])])
+    return meta
+
+
+def get_segments(keys) -> tuple[dict, dict]:
+    """Lee de la caché solo los segmentos pedidos: `(meta, {clave: {'values', 'histogram'}})`.
+
+    Si faltan los metadatos o un segmento que debería existir (caché vaciada
+    o desalojo), reconstruye y publica la distribución completa.
+    """
+    keys = list(dict.fromkeys(keys))
+    meta = cache.get(META_KEY)
+    if meta is not None:
+        wanted = [key for key in keys if key in meta['segments']]
+        cache_keys = {_segment_cache_key(meta['version'], key): key for key in wanted}
+        found = cache.get_many(list(cache_keys))
+        if len(found) == len(cache_keys):
+            return meta, {cache_keys[cache_key]: segment for cache_key, segment in found.items()}
+    distribution = build_distribution()
+    meta = _store_distribution(distribution)
+    return meta, {
+        key: {'values': distribution['segments'][key], 'histogram': distribution['histograms'][key]}
+        for key in keys if key in distribution['segments']
+    }
+
+
+def _segment_summary(segments, key, score):
+    segment = segments.get(key) or {}
+    values = segment.get('values') or []
+    count = len(values)
+    enough = count >= _min_segment_size() or key == 'global'
+    percentile = percentile_in(values, score) if enough else None
+    return {
+        'key': key,
+        'count': count,
+        'percentile': percentile,
+        'top_percent': round(100.0 - percentile, 2) if percentile is not None else None,
+        'histogram': segment.get('histogram') or [0] * HISTOGRAM_BINS,
+    }
+
+
+def property_percentiles(prop) -> dict:
+    """Percentil global, por región y por tipo para una propiedad."""
+    keys = {'global': 'global', 'region': region_key(prop.address_region), 'type': type_key(prop.type)}
+    meta, segments = get_segments(keys.values())
+    score = prop.plusvalia_score
+    return {
+        'property_id': prop.pk,
+        'score': float(score) if score is not None else None,
+        **{name: _segment_summary(segments, key, score) for name, key in keys.items()},
+        'histogram_bin_width': 100 // HISTOGRAM_BINS,
+        'built_at': meta['built_at'],
+    }
+
+
+def rebuild_distribution(batch_size: int = 500) -> dict:
+    """Reconstruye la distribución y actualiza los percentiles guardados en Property."""
+    distribution = build_distribution()
+    _store_distribution(distribution)
+    cache.delete(STALE_KEY)
+
+    changed = []
+    qs = Property.objects.only('id', 'address_region', 'plusvalia_score', *PERCENTILE_FIELDS)
+    for prop in qs.iterator(chunk_size=batch_size):
+        if prop.plusvalia_score is None:
+            new_values = (None, None)
+        else:
+            region_values = distribution['segments'].get(region_key(prop.address_region)) or []
+            new_values = (
+                percentile_in(distribution['segments']['global'], prop.plusvalia_score),
+                percentile_in(region_values, prop.plusvalia_score)
+                if len(region_values) >= _min_segment_size() else None,
+            )
+        if (prop.plusvalia_percentile, prop.plusvalia_region_percentile) != new_values:
+            prop.plusvalia_percentile, prop.plusvalia_region_percentile = new_values
+            changed.append(prop)
+    if changed:
+        # bulk_update no pasa por Property.save(): no re-encola plusvalía
+        Property.objects.bulk_update(changed, list(PERCENTILE_FIELDS), batch_size=batch_size)
+    logger.info(
+        f"[PlusvaliaDistribution] {len(distribution['segments']['global'])} puntajes, "
+        f"{len(distribution['segments'])} segmentos, {len(changed)} percentiles actualizados"
+    )
+    return distribution
+
+
+def mark_distribution_stale():
+    cache.set(STALE_KEY, True, timeout=None)
+
+
+def refresh_distribution_if_stale(respect_interval: bool = True) -> bool:
+    """Reconstruye si hubo cambios de puntaje (y pasó el intervalo mínimo, salvo que se ignore)."""
+    if not cache.get(STALE_KEY):
+        return False
+    current = cache.get(META_KEY)
+    if respect_interval and current and time.time() - current['built_at'] < _refresh_seconds():
+        return False
+    if not cache.add(LOCK_KEY, True, timeout=300):
+        return False  # otro proceso ya la está reconstruyendo
+    try:
+        rebuild_distribution()
+    finally:
+        cache.delete(LOCK_KEY)
+    return True
@@ -1,25 +1,85 @@
-from typing import Callable, Dict
-
 """Registro global de factores para el cálculo de plusvalía.
-Cada factor debe ser una función callable(property) -> int/float (0-100).
+Cada factor debe ser una función callable(property) -> int/float (0-100), o
+callable(property, context) si necesita resultados de otros factores o datos
+compartidos (ver `FactorContext`).
 Los pesos se almacenan en un diccionario paralelo.
 Esto permite incorporar fácilmente docenas o cientos de factores externos sin tocar
 el core de PlusvaliaService: basta con registrar nuevas funciones usando el decorador
 `@register_factor`.
+
+Evaluación (`evaluate_factors`):
+- Los factores declaran dependencias (`depends_on`) y se evalúan en orden
+  topológico; un factor recibe en `context.results` el valor de sus dependencias.
+- Los factores `kind="io"` (servicios externos) corren en paralelo en un pool de
+  hilos acotado (PLUSVALIA_FACTOR_MAX_WORKERS) con timeout por factor; los
+  `kind="cpu"` corren en el hilo que llama (pueden usar el ORM sin problema).
+- Si un factor falla o excede su timeout se usa su valor `default`.
+- Se mide el tiempo de cada factor; los lentos quedan en el log.
 """
+import inspect
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+FACTOR_KINDS = ("cpu", "io")
+
+
+@dataclass(frozen=True)
+class FactorSpec:
+    name: str
+    func: Callable
+    weight: float
+    depends_on: Tuple[str, ...] = ()
+    kind: str = "cpu"
+    timeout: Optional[float] = None
+    default: float = 50
+    accepts_context: bool = False
+
 
 _factor_funcs: Dict[str, Callable] = {}
 _factor_weights: Dict[str, float] = {}
+_factor_specs: Dict[str, FactorSpec] = {}
 
-def register_factor(name: str, weight: float):
+def register_factor(name: str, weight: float, depends_on=(), kind: str = "cpu",
+                    timeout: Optional[float] = None, default: float = 50):
     """Decorador para registrar un nuevo factor.
     Args:
         name (str): ID único del factor.
         weight (float): peso relativo (0-1). Se normalizará en runtime si la suma !=1.
+        depends_on (iterable[str]): factores que deben evaluarse antes.
+        kind (str): "io" si espera red/servicios externos, "cpu" en otro caso.
+        timeout (float|None): segundos máximos (solo "io"); por defecto
+            PLUSVALIA_FACTOR_TIMEOUT_SECONDS.
+        default (float): valor usado si el factor falla o excede el timeout.
     """
+    if kind not in FACTOR_KINDS:
+        raise ValueError(f"kind inválido para factor '{name}': {kind}")
+
     def decorator(func: Callable):
+        try:
+            accepts_context = len(inspect.signature(func).parameters) >= 2
+        except (TypeError, ValueError):
+            accepts_context = False
         _factor_funcs[name] = func
         _factor_weights[name] = weight
+        _factor_specs[name] = FactorSpec(
+            name=name,
+            func=func,
+            weight=weight,
+            depends_on=tuple(depends_on),
+            kind=kind,
+            timeout=timeout,
+            default=default,
+            accepts_context=accepts_context,
+        )
         return func
     return decorator
 
@@ -27,4 +87,197 @@ def get_factors():
     return _factor_funcs
 
 def get_weights():
-    return _factor_weights 
\ No newline at end of file
+    return _factor_weights
+
+def get_specs():
+    return _factor_specs
+
+
+# ----------------------------------------------------------------------
+# Contexto compartido por evaluación
+# ----------------------------------------------------------------------
+
+class FactorContext:
+    """Estado compartido durante la evaluación de los factores de una propiedad.
+
+    `shared(key, compute)` calcula un valor una sola vez por evaluación aunque
+    varios factores lo pidan en paralelo (p. ej. una única consulta de datos de
+    mercado para `relative_market_price` y `appreciation_rate`).
+    """
+
+    def __init__(self, property):
+        self.property = property
+        self.results: Dict[str, float] = {}
+        self._shared: Dict[str, Any] = {}
+        self._shared_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def shared(self, key: str, compute: Callable[[], Any]):
+        with self._lock:
+            if key in self._shared:
+                return self._shared[key]
+            key_lock = self._shared_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._shared:
+                    return self._shared[key]
+            value = compute()
+            with self._lock:
+                self._shared[key] = value
+            return value
+
+
+@dataclass
+class FactorEvaluation:
+    results: Dict[str, float] = field(default_factory=dict)
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    timed_out: Tuple[str, ...] = ()
+    total_ms: float = 0.0
+
+    def weighted_score(self, weights: Optional[Dict[str, float]] = None) -> float:
+        """Promedio ponderado (0-100) renormalizando los pesos de los factores evaluados."""
+        weights = weights if weights is not None else _factor_weights
+        total_w = sum(weights.get(name, 0.0) for name in self.results) or 1.0
+        return sum(value * weights.get(name, 0.0) for name, value in self.results.items()) / total_w
+
+
+# ----------------------------------------------------------------------
+# Evaluación
+# ----------------------------------------------------------------------
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(getattr(settings, 'PLUSVALIA_FACTOR_MAX_WORKERS', 8))
+                _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='plusvalia-factor')
+    return _executor
+
+
+def load_default_factors():
+    """Importa los factores por defecto (se registran al importar el módulo)."""
+    from . import plusvalia_factors_defaults  # noqa: F401
+
+
+def _topological_order(specs: Dict[str, FactorSpec]):
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"Dependencia circular entre factores: {' -> '.join(path + [name])}")
+        if name not in specs:
+            raise ValueError(f"Factor desconocido en dependencias: {name} (requerido por {path[-1]})")
+        state[name] = 'visiting'
+        for dep in specs[name].depends_on:
+            visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in specs:
+        visit(name, [])
+    return order
+
+
+def _run_factor(spec: FactorSpec, context: FactorContext):
+    start = time.perf_counter()
+    try:
+        if spec.accepts_context:
+            value = spec.func(context.property, context)
+        else:
+            value = spec.func(context.property)
+        return float(value), None, (time.perf_counter() - start) * 1000
+    except Exception as exc:
+        return None, exc, (time.perf_counter() - start) * 1000
+
+
+def _run_factor_in_thread(spec: FactorSpec, context: FactorContext):
+    try:
+        return _run_factor(spec, context)
+    finally:
+        # Las conexiones de BD son por hilo: no dejarlas abiertas en el pool
+        connections.close_all()
+
+
+def evaluate_factors(property, names=None, context: Optional[FactorContext] = None) -> FactorEvaluation:
+    """Evalúa los factores registrados (o solo `names` y sus dependencias)."""
+    load_default_factors()
+    specs = dict(_factor_specs)
+    order = _topological_order(specs)
+    if names is not None:
+        needed, stack = set(), list(names)
+        while stack:
+            name = stack.pop()
+            if name in needed:
+                continue
+            if name not in specs:
+                raise ValueError(f"Factor desconocido: {name}")
+            needed.add(name)
+            stack.extend(specs[name].depends_on)
+        order = [name for name in order if name in needed]
+
+    context = context or FactorContext(property)
+    evaluation = FactorEvaluation()
+    default_timeout = float(getattr(settings, 'PLUSVALIA_FACTOR_TIMEOUT_SECONDS', 5))
+    slow_ms = float(getattr(settings, 'PLUSVALIA_FACTOR_SLOW_MS', 1000))
+    timed_out = []
+    started = time.perf_counter()
+
+    def record(spec, value, error, elapsed_ms):
+        if error is not None:
+            evaluation.errors[spec.name] = str(error)[:500]
+            logger.warning(f"[PlusvaliaFactors] Factor '{spec.name}' falló: {error}")
+            value = spec.default
+        context.results[spec.name] = value
+        evaluation.results[spec.name] = value
+        evaluation.timings_ms[spec.name] = round(elapsed_ms, 2)
+        if elapsed_ms >= slow_ms:
+            logger.warning(f"[PlusvaliaFactors] Factor lento '{spec.name}': {elapsed_ms:.0f} ms")
+
+    pending = list(order)
+    running = {}  # future -> (spec, deadline, submitted_at)
+    while pending or running:
+        done_names = set(evaluation.results)
+        ready = [n for n in pending if all(dep in done_names for dep in specs[n].depends_on)]
+        for name in ready:
+            pending.remove(name)
+            spec = specs[name]
+            if spec.kind == "io":
+                timeout = spec.timeout if spec.timeout is not None else default_timeout
+                submitted = time.perf_counter()
+                future = _get_executor().submit(_run_factor_in_thread, spec, context)
+                running[future] = (spec, submitted + timeout, submitted)
+        for name in ready:
+            spec = specs[name]
+            if spec.kind == "cpu":
+                record(spec, *_run_factor(spec, context))
+        if not running:
+            if pending and not ready:
+                raise ValueError(f"Factores sin dependencias resolubles: {pending}")
+            continue
+
+        now = time.perf_counter()
+        next_deadline = min(deadline for _, deadline, _ in running.values())
+        done, _ = wait(list(running), timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+        for future in done:
+            spec, _, _ = running.pop(future)
+            record(spec, *future.result())
+        now = time.perf_counter()
+        for future, (spec, deadline, submitted) in list(running.items()):
+            if now >= deadline:
+                # No se puede interrumpir el hilo: se abandona el resultado
+                running.pop(future)
+                future.cancel()
+                timed_out.append(spec.name)
+                record(spec, None, TimeoutError(f"timeout tras {deadline - submitted:.1f}s"), (now - submitted) * 1000)
+
+    evaluation.timed_out = tuple(timed_out)
+    evaluation.total_ms = round((time.perf_counter() - started) * 1000, 2)
+    return evaluation
@@ -1,4 +1,3 @@
-from math import radians, cos, sin, asin, sqrt
 from datetime import timedelta
 import logging
 
@@ -7,26 +6,23 @@ from django.utils import timezone
 from .plusvalia_factor_registry import register_factor
 from .external_market_service import ExternalMarketDataService
 from .models import PropertyVisit
+from .proximity import hub_proximity_score, property_hub_distances
 
 logger = logging.getLogger(__name__)
 
 # Helpers ---------------------------------------------------------
 
-def _haversine(lat1, lon1, lat2, lon2):
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371
-    return c * r
+def _market_snapshot(property, context):
+    """Una sola consulta de mercado por evaluación, compartida entre factores."""
+    def fetch():
+        return ExternalMarketDataService().get_market_snapshot(property.latitude, property.longitude, years=3)
+    return context.shared("market_snapshot", fetch)
 
 # Factor definitions ---------------------------------------------
 
-@register_factor("relative_market_price", 0.15)
-def relative_market_price(property):
-    svc = ExternalMarketDataService()
-    est_value = svc.get_market_estimated_value(property.latitude, property.longitude)
+@register_factor("relative_market_price", 0.15, kind="io")
+def relative_market_price(property, context):
+    est_value = _market_snapshot(property, context)["estimated_value"]
     if not est_value:
         return 50
     ratio = float(property.price) / est_value
@@ -36,10 +32,9 @@ def relative_market_price(property):
         return 0
     return max(0, 100 - ((ratio - 0.8) * 100 / (1.5 - 0.8)))
 
-@register_factor("appreciation_rate", 0.12)
-def appreciation_rate(property):
-    svc = ExternalMarketDataService()
-    rate = svc.get_historical_appreciation_rate(property.latitude, property.longitude, years=3)
+@register_factor("appreciation_rate", 0.12, kind="io")
+def appreciation_rate(property, context):
+    rate = _market_snapshot(property, context)["annual_appreciation"]
     if rate is None:
         return 50
     if rate >= 10:
@@ -91,16 +86,12 @@ def size(property):
         return 0
     return (property.size - 10) * 100 / (500 - 10)
 
-@register_factor("proximity_santiago", 0.08)
+@register_factor("proximity_hubs", 0.08)
 def proximity(property):
     if property.latitude is None or property.longitude is None:
         return 50
-    dist = _haversine(property.latitude, property.longitude, -33.4489, -70.6693)
-    if dist <= 50:
-        return 100
-    if dist >= 500:
-        return 0
-    return max(0, 100 - ((dist - 50) * 100 / (500 - 50)))
+    score = hub_proximity_score(property_hub_distances(property))
+    return 50 if score is None else score
 
 @register_factor("listing_type", 0.04)
 def listing_type(property):
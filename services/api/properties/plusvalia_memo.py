@@ -0,0 +1,101 @@
+"""Memoización de la evaluación IA de plusvalía por hash de contenido.
+
+La clave combina los datos exactos que entran al prompt (nombre, tipo, precio,
+tamaño, agua, vistas, descripción), la versión del prompt y el modelo
+configurado. Se consulta primero la caché de Django y luego la tabla
+`PlusvaliaAIEvaluation`; solo si ambas fallan se llama a Sam.
+"""
+import hashlib
+import json
+import logging
+
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from skyterra_backend.counters import incr_counter, read_counters, reset_counters
+
+from .models import PlusvaliaAIEvaluation
+
+logger = logging.getLogger(__name__)
+
+PROMPT_VERSION = 'v1'
+CACHE_PREFIX = 'plusvalia:ai_memo'
+CACHE_TIMEOUT = 60 * 60 * 24 * 7  # 7 días
+STATS_PREFIX = f'{CACHE_PREFIX}:stats'
+STATS_KEYS = ('hits_cache', 'hits_db', 'misses')
+
+
+def build_input_hash(inputs: dict, model_key: str, prompt_version: str = PROMPT_VERSION) -> str:
+    payload = json.dumps(
+        {'inputs': inputs, 'model': model_key or '', 'version': prompt_version},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _cache_key(input_hash: str) -> str:
+    return f"{CACHE_PREFIX}:{input_hash}"
+
+
+def _incr_stat(name: str):
+    incr_counter(f"{STATS_PREFIX}:{name}")
+
+
+def get_memo_stats() -> dict:
+    """Contadores de aciertos/fallos de la memo y tasa de acierto (0-1)."""
+    stats = read_counters(STATS_PREFIX, STATS_KEYS)
+    total = sum(stats.values())
+    hits = stats['hits_cache'] + stats['hits_db']
+    stats['total'] = total
+    stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+    stats['stored_evaluations'] = PlusvaliaAIEvaluation.objects.count()
+    return stats
+
+
+def reset_memo_stats():
+    reset_counters(STATS_PREFIX, STATS_KEYS)
+
+
+def get_or_compute(inputs: dict, model_key: str, compute):
+    """Devuelve `(score, source)` con source en {'cache', 'db', 'miss'}.
+
+    `compute` se invoca solo ante un miss y debe devolver un entero 0-100;
+    sus excepciones se propagan sin guardar nada.
+    """
+    input_hash = build_input_hash(inputs, model_key)
+    key = _cache_key(input_hash)
+
+    cached = cache.get(key)
+    if cached is not None:
+        _incr_stat('hits_cache')
+        return int(cached), 'cache'
+
+    memo = PlusvaliaAIEvaluation.objects.filter(input_hash=input_hash).only('id', 'score').first()
+    if memo is not None:
+        PlusvaliaAIEvaluation.objects.filter(pk=memo.pk).update(
+            hit_count=F('hit_count') + 1,
+            last_used_at=timezone.now(),
+        )
+        cache.set(key, memo.score, CACHE_TIMEOUT)
+        _incr_stat('hits_db')
+        return int(memo.score), 'db'
+
+    _incr_stat('misses')
+    score = int(compute())
+    try:
+        PlusvaliaAIEvaluation.objects.update_or_create(
+            input_hash=input_hash,
+            defaults={
+                'model_key': (model_key or '')[:120],
+                'prompt_version': PROMPT_VERSION,
+                'score': score,
+                'last_used_at': timezone.now(),
+            },
+        )
+    except Exception as e:
+        logger.warning(f"[PlusvaliaMemo] No se pudo persistir evaluación IA: {e}")
+    cache.set(key, score, CACHE_TIMEOUT)
+    return score, 'miss'
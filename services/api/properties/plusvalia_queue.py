@@ -0,0 +1,218 @@
+"""Cola durable (en base de datos) para recalcular el puntaje de plusvalía.
+
+`Property.save()` ya no calcula la plusvalía en línea (incluye una llamada a
+Sam con timeouts largos): solo encola una `PlusvaliaRecomputeTask`. El comando
+`process_plusvalia_queue` consume la cola fuera del ciclo request/response.
+
+- Coalescing: hay una sola tarea por propiedad; encolar de nuevo solo ajusta
+  prioridad o marca `rerun_requested` si ya se está procesando.
+- Prioridad: publicaciones recién aprobadas > propiedades nuevas > resto.
+- Reintentos con backoff exponencial; el estado queda visible en el admin.
+"""
+import logging
+import random
+import socket
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Property, PlusvaliaRecomputeTask
+from .plusvalia_distribution import mark_distribution_stale
+
+logger = logging.getLogger(__name__)
+
+
+def async_recompute_enabled() -> bool:
+    return bool(getattr(settings, 'PLUSVALIA_ASYNC_RECOMPUTE', True))
+
+
+def _max_attempts() -> int:
+    return int(getattr(settings, 'PLUSVALIA_QUEUE_MAX_ATTEMPTS', 5))
+
+
+def _backoff_base_seconds() -> float:
+    return float(getattr(settings, 'PLUSVALIA_QUEUE_BACKOFF_SECONDS', 30))
+
+
+def _lease_seconds() -> int:
+    return int(getattr(settings, 'PLUSVALIA_QUEUE_LEASE_SECONDS', 600))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+
+def compute_backoff(attempts: int) -> timedelta:
+    """Backoff exponencial con jitter (tope de 1 hora)."""
+    base = _backoff_base_seconds()
+    delay = min(3600.0, base * (2 ** max(0, attempts - 1)))
+    return timedelta(seconds=delay + random.uniform(0, base))
+
+
+def default_priority(property_obj, is_new=False) -> int:
+    if property_obj.publication_status == 'approved':
+        return PlusvaliaRecomputeTask.PRIORITY_PUBLISHED
+    if is_new:
+        return PlusvaliaRecomputeTask.PRIORITY_NEW
+    return PlusvaliaRecomputeTask.PRIORITY_NORMAL
+
+
+def enqueue_plusvalia_recompute(property_obj, priority=None, reason='', is_new=False):
+    """Encola (o fusiona) un recálculo de plusvalía para la propiedad."""
+    if property_obj.pk is None:
+        raise ValueError("La propiedad debe estar guardada antes de encolar su plusvalía")
+    if priority is None:
+        priority = default_priority(property_obj, is_new=is_new)
+    now = timezone.now()
+
+    with transaction.atomic():
+        task, created = PlusvaliaRecomputeTask.objects.select_for_update().get_or_create(
+            property_id=property_obj.pk,
+            defaults={
+                'priority': priority,
+                'reason': reason[:64],
+                'max_attempts': _max_attempts(),
+                'next_attempt_at': now,
+                'enqueued_at': now,
+            },
+        )
+        if created:
+            return task
+
+        if task.status == 'running':
+            # El worker está calculando con datos posiblemente obsoletos.
+            task.rerun_requested = True
+            task.priority = max(task.priority, priority)
+            task.coalesced_count += 1
+            task.save(update_fields=['rerun_requested', 'priority', 'coalesced_count', 'updated_at'])
+        elif task.status == 'pending':
+            task.priority = max(task.priority, priority)
+            task.coalesced_count += 1
+            update_fields = ['priority', 'coalesced_count', 'updated_at']
+            if task.attempts == 0 and task.next_attempt_at > now:
+                task.next_attempt_at = now
+                update_fields.append('next_attempt_at')
+            task.save(update_fields=update_fields)
+        else:
+            task.status = 'pending'
+            task.priority = priority
+            task.reason = reason[:64]
+            task.attempts = 0
+            task.max_attempts = _max_attempts()
+            task.coalesced_count = 0
+            task.rerun_requested = False
+            task.next_attempt_at = now
+            task.enqueued_at = now
+            task.finished_at = None
+            task.last_error = ''
+            task.locked_by = ''
+            task.locked_at = None
+            task.save()
+    return task
+
+
+def release_stale_tasks(lease_seconds=None) -> int:
+    """Devuelve a 'pending' las tareas cuyo worker murió sin terminarlas."""
+    lease = lease_seconds if lease_seconds is not None else _lease_seconds()
+    cutoff = timezone.now() - timedelta(seconds=lease)
+    released = PlusvaliaRecomputeTask.objects.filter(status='running', locked_at__lt=cutoff).update(
+        status='pending',
+        locked_by='',
+        locked_at=None,
+        next_attempt_at=timezone.now(),
+        last_error='Lease expirado: el worker no finalizó la tarea.',
+    )
+    if released:
+        logger.warning(f"[PlusvaliaQueue] {released} tareas liberadas por lease expirado")
+    return released
+
+
+def claim_tasks(limit: int, worker_id: str):
+    """Reserva hasta `limit` tareas listas para procesar (mayor prioridad primero)."""
+    now = timezone.now()
+    with transaction.atomic():
+        qs = PlusvaliaRecomputeTask.objects.filter(status='pending', next_attempt_at__lte=now).order_by(
+            '-priority', 'next_attempt_at'
+        )
+        if connection.features.has_select_for_update_skip_locked:
+            qs = qs.select_for_update(skip_locked=True)
+        ids = list(qs.values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        PlusvaliaRecomputeTask.objects.filter(id__in=ids, status='pending').update(
+            status='running',
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+    return list(
+        PlusvaliaRecomputeTask.objects.filter(id__in=ids, status='running', locked_by=worker_id)
+        .select_related('property')
+        .order_by('-priority', 'next_attempt_at')
+    )
+
+
+def _finish_task(task_id: int, error: Exception | None = None):
+    now = timezone.now()
+    with transaction.atomic():
+        task = PlusvaliaRecomputeTask.objects.select_for_update().get(pk=task_id)
+        task.locked_by = ''
+        task.locked_at = None
+        if error is None:
+            task.last_error = ''
+            if task.rerun_requested:
+                task.status = 'pending'
+                task.rerun_requested = False
+                task.attempts = 0
+                task.next_attempt_at = now
+            else:
+                task.status = 'done'
+                task.finished_at = now
+        else:
+            task.last_error = str(error)[:2000]
+            task.rerun_requested = False
+            if task.attempts >= task.max_attempts:
+                task.status = 'failed'
+                task.finished_at = now
+            else:
+                task.status = 'pending'
+                task.next_attempt_at = now + compute_backoff(task.attempts)
+        task.save()
+    return task
+
+
+def run_task(task) -> bool:
+    """Calcula y persiste el puntaje de una tarea reservada."""
+    from .plusvalia_service import PlusvaliaService  # Import aquí para evitar ciclos
+
+    prop = task.property
+    try:
+        score = PlusvaliaService.calculate(prop)
+    except Exception as exc:
+        logger.warning(f"[PlusvaliaQueue] Error recalculando plusvalía de propiedad {prop.pk} (intento {task.attempts}): {exc}")
+        _finish_task(task.pk, error=exc)
+        return False
+
+    # update() evita pasar por Property.save() y volver a encolar.
+    Property.objects.filter(pk=prop.pk).update(plusvalia_score=score)
+    _finish_task(task.pk)
+    return True
+
+
+def process_batch(limit: int = 20, worker_id: str | None = None) -> dict:
+    """Procesa un lote de tareas. Devuelve contadores para logging/monitoreo."""
+    worker_id = worker_id or default_worker_id()
+    tasks = claim_tasks(limit, worker_id)
+    stats = {'claimed': len(tasks), 'succeeded': 0, 'failed': 0}
+    for task in tasks:
+        if run_task(task):
+            stats['succeeded'] += 1
+        else:
+            stats['failed'] += 1
+    if stats['succeeded']:
+        mark_distribution_stale()
+    return stats
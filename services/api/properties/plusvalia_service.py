@@ -28,6 +28,7 @@ except Exception:
     ExternalMarketDataService = None
 
 from .models import PropertyVisit
+from .proximity import hub_proximity_score, property_hub_distances
 
 logger = logging.getLogger(__name__)
 
@@ -38,10 +39,6 @@ class PlusvaliaService:
     lógica de confianza. Además aplica penalización ambiental menor.
     """
 
-    # Coordenadas aproximadas de Santiago de Chile, referencia para proximidad a grandes centros urbanos
-    REFERENCE_LAT = -33.4489
-    REFERENCE_LON = -70.6693
-
     # Pesos base para los bloques (suman 1.0)
     BLOCK_WEIGHTS = {
         "P": 0.30,  # Mercado / precios / tendencia
@@ -55,6 +52,10 @@ class PlusvaliaService:
     # Penalización máxima ambiental (restamos hasta 10 puntos)
     AMBIENTAL_PENALTY_MAX = 10.0
 
+    # Hook opcional invocado antes de cada llamada real a Sam (p. ej. rate limit global
+    # del comando rescore_properties). Las respuestas memoizadas no lo consumen.
+    ai_rate_limiter = None
+
     @staticmethod
     def _haversine(lat1, lon1, lat2, lon2):
         """Calcula la distancia en kilómetros entre dos puntos usando la fórmula de Haversine."""
@@ -102,12 +103,8 @@ class PlusvaliaService:
     def _proximity_score(cls, property):
         if property.latitude is None or property.longitude is None:
             return 50  # Puntaje medio si no hay ubicación exacta
-        dist = cls._haversine(property.latitude, property.longitude, cls.REFERENCE_LAT, cls.REFERENCE_LON)
-        if dist <= 50:
-            return 100
-        if dist >= 500:
-            return 0
-        return max(0, 100 - ((dist - 50) * 100 / (500 - 50)))
+        score = hub_proximity_score(property_hub_distances(property))
+        return 50 if score is None else score
 
     @classmethod
     def _listing_type_score(cls, property):
@@ -123,26 +120,47 @@ class PlusvaliaService:
         return 100 if property.publication_status == 'approved' else 0
 
     # IA evaluation ---------------------------------------------------------
-    @classmethod
-    def _ai_score(cls, property):
-        """Solicita a Sam un puntaje 0-100. Si falla, lanza excepción.
+    @staticmethod
+    def _ai_prompt_inputs(property):
+        """Datos exactos que entran al prompt de IA (también definen la clave de memo)."""
+        return {
+            "name": property.name,
+            "type": property.type,
+            "price": str(property.price),
+            "size": property.size,
+            "has_water": property.has_water,
+            "has_views": property.has_views,
+            "description": (property.description or "")[:500],
+        }
 
-        Requisito del negocio: no ocultar errores; no devolver valores neutrales.
-        """
+    @staticmethod
+    def _ai_model_key():
+        """Modelo configurado para Sam; forma parte de la clave de memo."""
+        try:
+            from ai_management.config_cache import get_sam_config
+            return getattr(get_sam_config().current_model, 'api_name', '') or ''
+        except Exception:
+            return ''
+
+    @classmethod
+    def _request_ai_score(cls, inputs):
+        """Solicita a Sam un puntaje 0-100 para los datos dados. Si falla, lanza excepción."""
         if not SkyTerraSamService:
             raise SamServiceError("SamService no disponible")
+        if cls.ai_rate_limiter is not None:
+            cls.ai_rate_limiter()
         try:
             sam = SkyTerraSamService()
             prompt = (
                 "Eres un modelo que evalúa el potencial de plusvalía de propiedades rurales. "
                 "Responde SOLO con un número entero entre 0 y 100 (sin texto extra).\n\n"
-                f"Nombre: {property.name}\n"
-                f"Tipo: {property.type}\n"
-                f"Precio: {property.price}\n"
-                f"Tamaño (ha): {property.size}\n"
-                f"Tiene agua: {property.has_water}\n"
-                f"Tiene vistas: {property.has_views}\n"
-                f"Descripción: {property.description[:500]}\n"
+                f"Nombre: {inputs['name']}\n"
+                f"Tipo: {inputs['type']}\n"
+                f"Precio: {inputs['price']}\n"
+                f"Tamaño (ha): {inputs['size']}\n"
+                f"Tiene agua: {inputs['has_water']}\n"
+                f"Tiene vistas: {inputs['has_views']}\n"
+                f"Descripción: {inputs['description']}\n"
                 "\nPuntaje (0-100):"
             )
             result = sam.generate_response(prompt, request_type="plusvalia_eval")
@@ -159,6 +177,26 @@ class PlusvaliaService:
             logger.error(f"Error llamando a SamService para plusvalía: {e}", exc_info=True)
             raise SamServiceError(str(e))
 
+    @classmethod
+    def _ai_score_with_source(cls, property):
+        """Puntaje IA memoizado por hash de contenido: devuelve (score, source).
+
+        source es 'cache', 'db' o 'miss' (solo en 'miss' se consulta a Sam).
+        """
+        from .plusvalia_memo import get_or_compute
+
+        inputs = cls._ai_prompt_inputs(property)
+        return get_or_compute(inputs, cls._ai_model_key(), lambda: cls._request_ai_score(inputs))
+
+    @classmethod
+    def _ai_score(cls, property):
+        """Solicita a Sam un puntaje 0-100. Si falla, lanza excepción.
+
+        Requisito del negocio: no ocultar errores; no devolver valores neutrales.
+        """
+        score, _source = cls._ai_score_with_source(property)
+        return score
+
     # -------------------- Demanda interna ---------------------
     @classmethod
     def _demand_score(cls, property, lookback_days: int = 30):
@@ -224,8 +262,10 @@ class PlusvaliaService:
         appr_rate = None
         try:
             if svc and property.latitude is not None and property.longitude is not None:
-                est_value = svc.get_market_estimated_value(property.latitude, property.longitude)
-                appr_rate = svc.get_historical_appreciation_rate(property.latitude, property.longitude, years=3)
+                # Una sola consulta (o acierto de caché por celda) para AVM y apreciación
+                snapshot = svc.get_market_snapshot(property.latitude, property.longitude, years=3)
+                est_value = snapshot.get("estimated_value")
+                appr_rate = snapshot.get("annual_appreciation")
         except Exception as e:
             logger.warning(f"Error obteniendo datos de mercado: {e}")
 
@@ -280,21 +320,19 @@ class PlusvaliaService:
     def _connectivity_index(cls, property):
         """Bloque C: conectividad/accesibilidad (0-100) y confianza.
 
-        Combina proximidad a gran centro urbano (60%), tipo de acceso (25%) y
-        disponibilidad de servicios como proxy (15%).
+        Combina proximidad al centro urbano, aeropuerto y puerto más cercanos
+        (60%), tipo de acceso (25%) y disponibilidad de servicios como proxy (15%).
         """
         # Proximidad
-        if property.latitude is None or property.longitude is None:
+        distances = {}
+        score_prox = None
+        if property.latitude is not None and property.longitude is not None:
+            distances = property_hub_distances(property)
+            score_prox = hub_proximity_score(distances)
+        if score_prox is None:
             score_prox = 50
             conf_prox = 0.3
         else:
-            dist = cls._haversine(property.latitude, property.longitude, cls.REFERENCE_LAT, cls.REFERENCE_LON)
-            if dist <= 50:
-                score_prox = 100
-            elif dist >= 500:
-                score_prox = 0
-            else:
-                score_prox = max(0, 100 - ((dist - 50) * 100 / (500 - 50)))
             conf_prox = 0.9
 
         # Acceso
@@ -317,6 +355,10 @@ class PlusvaliaService:
         confidence = max(0.0, min(1.0, (0.60 * conf_prox + 0.25 * conf_access + 0.15 * conf_utils)))
         return score, confidence, {
             "proximity": score_prox,
+            "nearest_city": distances.get("nearest_city_name") or None,
+            "distance_to_city_km": distances.get("distance_to_city_km"),
+            "distance_to_airport_km": distances.get("distance_to_airport_km"),
+            "distance_to_port_km": distances.get("distance_to_port_km"),
             "access": score_access,
             "utilities": score_utils,
         }
@@ -457,8 +499,8 @@ class PlusvaliaService:
         ai_weight = 0.15
         blocks_weight_share = 1.0 - ai_weight
         try:
-            ai_score = cls._ai_score(property)
-            ai_info = {"score": ai_score, "weight": ai_weight}
+            ai_score, ai_source = cls._ai_score_with_source(property)
+            ai_info = {"score": ai_score, "weight": ai_weight, "memo": ai_source}
         except SamServiceError as e:
             # Propagar el error hacia arriba: no ocultar fallas de IA
             raise
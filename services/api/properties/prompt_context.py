@@ -0,0 +1,111 @@
+"""Contexto compacto de propiedades para los prompts de Sam.
+
+Antes cada prompt consultaba `Property.objects.all()[:20]` y lo serializaba
+con `json.dumps(..., indent=2)`: una consulta por llamada y cientos de
+tokens de espacios. Ahora el contexto es una tabla de texto (una fila por
+propiedad, columnas separadas por `|`), limitada por cantidad de filas y de
+caracteres, y se guarda en caché por versión del catálogo (la misma que
+invalida la caché de búsqueda IA al guardar/borrar propiedades).
+
+Con una consulta, `get_relevant_property_context` arma la misma tabla pero
+solo con las candidatas que preselecciona el índice local (`retrieval`).
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .ai_search_cache import get_catalog_version
+from .models import Property
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'prompt_context:properties'
+CACHE_TIMEOUT = 60 * 60 * 24
+EMPTY_CONTEXT = "No hay propiedades disponibles en la base de datos actualmente."
+HEADER = "id|nombre|tipo|precio|ha|agua|vistas|lat,lng|descripción"
+CONTEXT_FIELDS = ('id', 'name', 'type', 'price', 'size', 'has_water', 'has_views', 'latitude', 'longitude', 'description')
+
+
+def _clean(value, limit=None) -> str:
+    text = ' '.join(str(value or '').split()).replace('|', '/')
+    if limit and len(text) > limit:
+        text = text[:limit - 1].rstrip() + '…'
+    return text
+
+
+def _format_number(value) -> str:
+    if value is None:
+        return ''
+    number = float(value)
+    return str(int(number)) if number.is_integer() else f"{number:.2f}".rstrip('0')
+
+
+def format_row(row: dict, description_chars: int) -> str:
+    coords = ''
+    if row['latitude'] is not None and row['longitude'] is not None:
+        coords = f"{row['latitude']:.4f},{row['longitude']:.4f}"
+    return '|'.join((
+        str(row['id']),
+        _clean(row['name'], 60),
+        row['type'] or '',
+        _format_number(row['price']),
+        _format_number(row['size']),
+        'si' if row['has_water'] else 'no',
+        'si' if row['has_views'] else 'no',
+        coords,
+        _clean(row['description'], description_chars),
+    ))
+
+
+def build_property_context(max_items=None, max_chars=None) -> str:
+    """Tabla compacta de propiedades que no excede `max_chars` caracteres."""
+    max_items = max_items or int(getattr(settings, 'PROMPT_CONTEXT_MAX_PROPERTIES', 20))
+    max_chars = max_chars or int(getattr(settings, 'PROMPT_CONTEXT_MAX_CHARS', 3000))
+    description_chars = int(getattr(settings, 'PROMPT_CONTEXT_DESCRIPTION_CHARS', 80))
+
+    rows = list(Property.objects.values(*CONTEXT_FIELDS)[:max_items])
+    if not rows:
+        return EMPTY_CONTEXT
+    return render_table((format_row(row, description_chars) for row in rows), max_chars)
+
+
+def render_table(lines, max_chars: int) -> str:
+    """Encabezado + filas ya formateadas, cortando antes de pasar `max_chars`."""
+    table = [HEADER]
+    used = len(HEADER)
+    for line in lines:
+        if used + len(line) + 1 > max_chars:
+            break
+        table.append(line)
+        used += len(line) + 1
+    return '\n'.join(table)
+
+
+def get_property_context() -> str:
+    """Contexto de propiedades cacheado por versión del catálogo."""
+    key = f"{CACHE_PREFIX}:{get_catalog_version()}"
+    context = cache.get(key)
+    if context is None:
+        try:
+            context = build_property_context()
+        except Exception as e:
+            logger.error(f"Error obteniendo contexto de propiedades: {e}")
+            return "Error al obtener información de propiedades."
+        cache.set(key, context, timeout=CACHE_TIMEOUT)
+    return context
+
+
+def get_relevant_property_context(query: str, filters=None) -> str:
+    """Tabla solo con las propiedades que el índice local considera relevantes."""
+    from .retrieval import retrieve_candidates
+
+    max_chars = int(getattr(settings, 'PROMPT_CONTEXT_MAX_CHARS', 3000))
+    try:
+        candidates = retrieve_candidates(query, filters=filters)
+    except Exception as e:
+        logger.error(f"Error en la preselección de propiedades, usando el contexto general: {e}")
+        return get_property_context()
+    if not candidates:
+        return EMPTY_CONTEXT
+    return render_table((doc['line'] for doc in candidates), max_chars)
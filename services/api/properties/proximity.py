@@ -0,0 +1,221 @@
+"""Índice de proximidad a centros de referencia (ciudades, aeropuertos, puertos).
+
+El dataset (`data/reference_hubs.json`) se carga una vez por proceso en un
+índice espacial en memoria por tipo de centro. Los puntos se proyectan a la
+esfera unitaria (x, y, z), donde el vecino más cercano por distancia euclidiana
+es también el más cercano por distancia de gran círculo.
+
+Backends, del más rápido al más simple:
+- scipy disponible: `cKDTree` (consultas batch vectorizadas).
+- solo NumPy: producto punto vectorizado contra todos los centros (el dataset
+  es de decenas/cientos de puntos, así que es O(n) pero en C).
+- sin dependencias: KD-tree 3D en Python puro.
+"""
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:  # Dependencias opcionales
+    import numpy as np
+except ImportError:  # pragma: no cover - depende del entorno
+    np = None
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # pragma: no cover - depende del entorno
+    cKDTree = None
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+HUB_TYPES = ('city', 'airport', 'port')
+DATASET_PATH = os.path.join(os.path.dirname(__file__), 'data', 'reference_hubs.json')
+
+# Campo de Property donde se guarda la distancia al centro más cercano de cada tipo
+DISTANCE_FIELDS = {
+    'city': 'distance_to_city_km',
+    'airport': 'distance_to_airport_km',
+    'port': 'distance_to_port_km',
+}
+HUB_FIELDS = tuple(DISTANCE_FIELDS.values()) + ('nearest_city_name',)
+
+
+def _to_xyz(lat: float, lon: float) -> Tuple[float, float, float]:
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    cos_lat = math.cos(lat_r)
+    return (cos_lat * math.cos(lon_r), cos_lat * math.sin(lon_r), math.sin(lat_r))
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class _PyKDTree:
+    """KD-tree 3D mínimo (vecino más cercano) para cuando no hay scipy/NumPy."""
+
+    def __init__(self, points: Sequence[Tuple[float, float, float]]):
+        self.points = list(points)
+        self.root = self._build(list(range(len(self.points))), 0)
+
+    def _build(self, idxs, depth):
+        if not idxs:
+            return None
+        axis = depth % 3
+        idxs.sort(key=lambda i: self.points[i][axis])
+        mid = len(idxs) // 2
+        return (idxs[mid], axis, self._build(idxs[:mid], depth + 1), self._build(idxs[mid + 1:], depth + 1))
+
+    def query(self, point) -> Tuple[float, int]:
+        best = [float('inf'), -1]
+
+        def visit(node):
+            if node is None:
+                return
+            idx, axis, left, right = node
+            candidate = self.points[idx]
+            d2 = sum((a - b) ** 2 for a, b in zip(point, candidate))
+            if d2 < best[0]:
+                best[0], best[1] = d2, idx
+            diff = point[axis] - candidate[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if diff * diff < best[0]:
+                visit(far)
+
+        visit(self.root)
+        return math.sqrt(best[0]), best[1]
+
+
+class HubIndex:
+    """Índice de vecino más cercano para un conjunto de centros de un mismo tipo."""
+
+    def __init__(self, hubs: List[dict]):
+        self.hubs = hubs
+        xyz = [_to_xyz(h['lat'], h['lon']) for h in hubs]
+        if cKDTree is not None:
+            self.backend = 'scipy'
+            self._tree = cKDTree(np.asarray(xyz))
+        elif np is not None:
+            self.backend = 'numpy'
+            self._xyz = np.asarray(xyz)
+        else:
+            self.backend = 'python'
+            self._tree = _PyKDTree(xyz)
+
+    def query_batch(self, coords: Sequence[Tuple[float, float]]) -> List[Tuple[float, dict]]:
+        """[(lat, lon), ...] -> [(distancia_km, centro), ...] en el mismo orden."""
+        if not coords or not self.hubs:
+            return [(None, None)] * len(coords)
+        if self.backend == 'python':
+            results = []
+            for lat, lon in coords:
+                chord, idx = self._tree.query(_to_xyz(lat, lon))
+                results.append((_chord_to_km(chord), self.hubs[idx]))
+            return results
+
+        lat_r = np.radians(np.asarray([c[0] for c in coords], dtype=float))
+        lon_r = np.radians(np.asarray([c[1] for c in coords], dtype=float))
+        cos_lat = np.cos(lat_r)
+        points = np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+        if self.backend == 'scipy':
+            chords, idxs = self._tree.query(points, k=1)
+        else:
+            dots = points @ self._xyz.T
+            idxs = dots.argmax(axis=1)
+            best = np.clip(dots[np.arange(len(points)), idxs], -1.0, 1.0)
+            chords = np.sqrt(np.maximum(0.0, 2.0 - 2.0 * best))
+        km = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chords) / 2, 0.0, 1.0))
+        return [(float(d), self.hubs[int(i)]) for d, i in zip(km, idxs)]
+
+    def query(self, lat: float, lon: float) -> Tuple[float, dict]:
+        return self.query_batch([(lat, lon)])[0]
+
+
+_indexes: Optional[Dict[str, HubIndex]] = None
+_indexes_lock = threading.Lock()
+
+
+def load_hubs(path: str = DATASET_PATH) -> List[dict]:
+    with open(path, encoding='utf-8') as fh:
+        data = json.load(fh)
+    return [h for h in data.get('hubs', []) if h.get('type') in HUB_TYPES]
+
+
+def get_hub_indexes() -> Dict[str, HubIndex]:
+    """Índices por tipo de centro, construidos una vez por proceso."""
+    global _indexes
+    if _indexes is None:
+        with _indexes_lock:
+            if _indexes is None:
+                hubs = load_hubs()
+                _indexes = {
+                    hub_type: HubIndex([h for h in hubs if h['type'] == hub_type])
+                    for hub_type in HUB_TYPES
+                }
+                logger.debug(f"[Proximity] {len(hubs)} centros cargados (backend {_indexes['city'].backend})")
+    return _indexes
+
+
+def nearest_hubs_batch(coords: Iterable[Tuple[Optional[float], Optional[float]]]) -> List[dict]:
+    """Distancias (km) al centro más cercano de cada tipo para muchas coordenadas.
+
+    Devuelve una lista alineada con `coords` de dicts con las claves de
+    `HUB_FIELDS`; las coordenadas nulas producen valores None.
+    """
+    coords = list(coords)
+    valid = [i for i, (lat, lon) in enumerate(coords) if lat is not None and lon is not None]
+    results = [{**{field: None for field in DISTANCE_FIELDS.values()}, 'nearest_city_name': ''} for _ in coords]
+    if not valid:
+        return results
+    points = [(float(coords[i][0]), float(coords[i][1])) for i in valid]
+    for hub_type, index in get_hub_indexes().items():
+        field = DISTANCE_FIELDS[hub_type]
+        for i, (dist, hub) in zip(valid, index.query_batch(points)):
+            results[i][field] = round(dist, 2) if dist is not None else None
+            if hub_type == 'city' and hub is not None:
+                results[i]['nearest_city_name'] = hub['name']
+    return results
+
+
+def nearest_hubs(lat: Optional[float], lon: Optional[float]) -> dict:
+    return nearest_hubs_batch([(lat, lon)])[0]
+
+
+def _linear_score(dist: Optional[float], best_km: float, worst_km: float) -> Optional[float]:
+    if dist is None:
+        return None
+    if dist <= best_km:
+        return 100.0
+    if dist >= worst_km:
+        return 0.0
+    return 100.0 - ((dist - best_km) * 100.0 / (worst_km - best_km))
+
+
+# (peso, distancia con puntaje 100, distancia con puntaje 0) por tipo de centro
+PROXIMITY_CURVES = {
+    'city': (0.60, 20.0, 200.0),
+    'airport': (0.25, 30.0, 300.0),
+    'port': (0.15, 50.0, 400.0),
+}
+
+
+def hub_proximity_score(distances: dict) -> Optional[float]:
+    """Puntaje 0-100 combinando cercanía a ciudad, aeropuerto y puerto."""
+    total = weight_sum = 0.0
+    for hub_type, (weight, best_km, worst_km) in PROXIMITY_CURVES.items():
+        score = _linear_score(distances.get(DISTANCE_FIELDS[hub_type]), best_km, worst_km)
+        if score is not None:
+            total += weight * score
+            weight_sum += weight
+    return total / weight_sum if weight_sum else None
+
+
+def property_hub_distances(property) -> dict:
+    """Distancias guardadas en la propiedad; si faltan, las calcula al vuelo."""
+    stored = {field: getattr(property, field, None) for field in HUB_FIELDS}
+    if stored.get('distance_to_city_km') is not None:
+        return stored
+    return nearest_hubs(getattr(property, 'latitude', None), getattr(property, 'longitude', None))
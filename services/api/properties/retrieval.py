@@ -0,0 +1,195 @@
+"""Preselección local de propiedades candidatas para la búsqueda IA.
+
+Antes Sam veía siempre las mismas 20 primeras filas del catálogo y
+recomendaba desde ese recorte arbitrario. Ahora, antes de armar el prompt, se
+consulta un índice en memoria:
+
+- BM25 sobre nombre (con doble peso), resumen IA, descripción, categoría,
+  comuna, región y ciudad cercana, con texto sin acentos y plurales simples
+  ("Terrenos con vistas" == "terreno con vista"),
+- filtros por atributos que `GeminiService._extract_basic_filters` ya
+  extrae de la consulta (tipo, agua, vistas, rango de precio). Si los filtros
+  dejan el catálogo vacío se ignoran.
+
+Solo las `AI_RETRIEVAL_TOP_K` mejores filas entran al prompt. Si la consulta
+casi no coincide con nada se completa hasta `AI_RETRIEVAL_MIN_RESULTS` con las
+propiedades de mejor plusvalía que cumplen los filtros.
+
+El índice se construye una vez por proceso y por versión del catálogo (la
+misma que invalida la caché de búsqueda IA), así que una búsqueda no toca la
+base de datos. Un `Property.save()` solo sube esa versión si cambió alguno de
+los campos indexados (`indexed_fields_changed`): los guardados de workflow,
+alertas o percentiles no obligan a reconstruir el índice.
+"""
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .ai_search_cache import get_catalog_version, normalize_query
+from .models import Property
+from .prompt_context import CONTEXT_FIELDS, format_row
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+INDEX_FIELDS = CONTEXT_FIELDS + (
+    'ai_summary', 'ai_category', 'address_city', 'address_region', 'nearest_city_name', 'plusvalia_score',
+)
+# (campo, peso): el peso repite los términos del campo en el documento
+TEXT_FIELDS = (
+    ('name', 2), ('ai_summary', 1), ('description', 1), ('ai_category', 1), ('type', 1),
+    ('address_city', 1), ('address_region', 1), ('nearest_city_name', 1),
+)
+STOPWORDS = frozenset("""
+    a al algo algun alguna busco buscando cerca como con cual cuales de del desde donde el ella en entre
+    es esta este esto favor hay la las lo los mas me mi muestrame muy necesito o para pero por porfa
+    que quiero se sea ser si sin sobre su sus te tenga tengan tiene tienen un una uno unos unas y ya
+    terreno propiedad parcela campo
+""".split())
+_TOKEN_RE = re.compile(r'[a-z0-9ñ]+')
+
+
+def tokenize(text: str) -> list:
+    """Términos sin acentos, sin stopwords y con el plural simple recortado."""
+    tokens = []
+    for token in _TOKEN_RE.findall(normalize_query(text)):
+        if len(token) > 3 and token.endswith('s'):
+            token = token[:-1]
+        if len(token) > 1 and token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+class PropertySearchIndex:
+    """Índice invertido BM25 + atributos de un snapshot del catálogo."""
+
+    def __init__(self, rows, description_chars: int = 80):
+        self.docs = []
+        self.postings = defaultdict(list)  # término -> [(doc, frecuencia)]
+        lengths = []
+        for row in rows:
+            terms = []
+            for field, weight in TEXT_FIELDS:
+                terms.extend(tokenize(row.get(field) or '') * weight)
+            for term, freq in Counter(terms).items():
+                self.postings[term].append((len(self.docs), freq))
+            lengths.append(len(terms))
+            self.docs.append({
+                'id': row['id'],
+                'kind': ' '.join(filter(None, (row.get('type'), row.get('ai_category')))).lower(),
+                'price': float(row['price']) if row.get('price') is not None else None,
+                'has_water': bool(row.get('has_water')),
+                'has_views': bool(row.get('has_views')),
+                'plusvalia': float(row['plusvalia_score']) if row.get('plusvalia_score') is not None else -1.0,
+                'line': format_row(row, description_chars),
+            })
+        self.lengths = lengths
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.docs) - df + 0.5) / (df + 0.5))
+
+    def _matches(self, doc, filters) -> bool:
+        types = filters.get('propertyTypes') or []
+        if types and not any(t in doc['kind'] for t in types):
+            return False
+        features = filters.get('features') or []
+        if 'hasWater' in features and not doc['has_water']:
+            return False
+        if 'hasViews' in features and not doc['has_views']:
+            return False
+        low, high = (list(filters.get('priceRange') or []) + [None, None])[:2]
+        price = doc['price']
+        if (low is not None or high is not None) and price is None:
+            return False
+        if low is not None and price < low:
+            return False
+        if high is not None and price > high:
+            return False
+        return True
+
+    def search(self, query: str, filters=None, k: int = 12, min_results: int = 5) -> list:
+        """Hasta `k` documentos (dicts con `id` y `line`), del más al menos relevante."""
+        if not self.docs:
+            return []
+        allowed = None
+        if filters:
+            allowed = {i for i, doc in enumerate(self.docs) if self._matches(doc, filters)}
+            if not allowed:
+                allowed = None
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf(term)
+            for doc_index, freq in self.postings.get(term, ()):
+                if allowed is not None and doc_index not in allowed:
+                    continue
+                norm = 1 - BM25_B + BM25_B * self.lengths[doc_index] / (self.avg_length or 1)
+                scores[doc_index] += idf * freq * (BM25_K1 + 1) / (freq + BM25_K1 * norm)
+
+        ranked = sorted(scores, key=lambda i: (-scores[i], -self.docs[i]['plusvalia']))[:k]
+        if len(ranked) < min_results:
+            chosen = set(ranked)
+            pool = range(len(self.docs)) if allowed is None else allowed
+            extra = sorted((i for i in pool if i not in chosen), key=lambda i: -self.docs[i]['plusvalia'])
+            ranked.extend(extra[:min(k, min_results) - len(ranked)])
+        return [self.docs[i] for i in ranked]
+
+
+def indexed_fields_changed(instance, update_fields=None) -> bool:
+    """¿El guardado de `instance` cambió algún campo que lee el índice (o el prompt)?
+
+    Compara con los valores cargados de la BD (`Property.from_db`); una
+    instancia nueva o sin esos valores cuenta como cambio. Tras comparar deja
+    los valores actuales como referencia para el próximo guardado.
+    """
+    fields = INDEX_FIELDS if update_fields is None else [f for f in INDEX_FIELDS if f in set(update_fields)]
+    if not fields:
+        return False
+    loaded = getattr(instance, '_loaded_values', None)
+    changed = loaded is None or any(
+        field not in loaded or loaded[field] != getattr(instance, field) for field in fields
+    )
+    if loaded is not None:
+        loaded.update({field: getattr(instance, field) for field in fields})
+    return changed
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def build_search_index() -> PropertySearchIndex:
+    description_chars = int(getattr(settings, 'PROMPT_CONTEXT_DESCRIPTION_CHARS', 80))
+    rows = Property.objects.values(*INDEX_FIELDS).order_by('id').iterator(chunk_size=2000)
+    return PropertySearchIndex(rows, description_chars=description_chars)
+
+
+def get_search_index() -> PropertySearchIndex:
+    """Índice del proceso; se reconstruye cuando cambia la versión del catálogo."""
+    global _index, _index_version
+    version = get_catalog_version()
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = build_search_index()
+                _index_version = version
+                logger.info(f"[Retrieval] Índice de {len(_index)} propiedades (catálogo v{version})")
+    return _index
+
+
+def retrieve_candidates(query: str, filters=None, k=None) -> list:
+    """Propiedades más relevantes para `query` según el índice local."""
+    k = k or int(getattr(settings, 'AI_RETRIEVAL_TOP_K', 12))
+    min_results = int(getattr(settings, 'AI_RETRIEVAL_MIN_RESULTS', 5))
+    return get_search_index().search(query, filters=filters, k=k, min_results=min_results)
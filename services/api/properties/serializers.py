@@ -305,6 +305,8 @@ class PilotProfileSerializer(serializers.ModelSerializer):
             'is_available',
             'location_latitude',
             'location_longitude',
+            'is_operational',
+            'operational_until',
             'last_heartbeat_at',
             'notes',
             'documents',
@@ -312,7 +314,7 @@ class PilotProfileSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ['rating', 'score', 'completed_jobs', 'last_heartbeat_at', 'created_at', 'updated_at', 'pending_requirements', 'status_label']
+        read_only_fields = ['rating', 'score', 'completed_jobs', 'is_operational', 'operational_until', 'last_heartbeat_at', 'created_at', 'updated_at', 'pending_requirements', 'status_label']
         extra_kwargs = {
             'website': {'required': False, 'allow_blank': True},
             'portfolio_url': {'required': False, 'allow_blank': True},
@@ -344,6 +346,8 @@ class JobTimelineEventSerializer(serializers.ModelSerializer):
 class JobOfferSerializer(serializers.ModelSerializer):
     pilot_id = serializers.IntegerField(source='pilot.id', read_only=True)
     pilot_profile = PilotProfileSerializer(source='pilot', read_only=True)
+    # Estado efectivo: una oferta vencida se muestra como tal aunque el barrido no haya pasado
+    status = serializers.SerializerMethodField()
     remaining_seconds = serializers.SerializerMethodField()
     status_label = serializers.SerializerMethodField()
 
@@ -378,6 +382,9 @@ class JobOfferSerializer(serializers.ModelSerializer):
             'status_label',
         ]
 
+    def get_status(self, obj):
+        return 'expired' if obj.is_expired else obj.status
+
     def get_remaining_seconds(self, obj):
         if not obj.expires_at or obj.status != 'pending':
             return 0
@@ -385,7 +392,8 @@ class JobOfferSerializer(serializers.ModelSerializer):
         return max(int(delta), 0)
 
     def get_status_label(self, obj):
-        return dict(JobOffer.STATUS_CHOICES).get(obj.status, obj.status)
+        status = self.get_status(obj)
+        return dict(JobOffer.STATUS_CHOICES).get(status, status)
 
 
 class JobSerializer(serializers.ModelSerializer):
@@ -518,7 +526,11 @@ class PropertySerializer(serializers.ModelSerializer):
                  'workflow_node', 'workflow_substate', 'workflow_progress', 'workflow_alerts',
                  'plan', 'plan_details', 'preferred_time_windows', 'access_notes', 'seller_notes',
                  'status_history', 'status_bar', 'workflow_timeline', 'submission_requirements',
-                 'ai_category', 'ai_summary']
+                 'ai_category', 'ai_summary',
+                 'distance_to_city_km', 'distance_to_airport_km', 'distance_to_port_km', 'nearest_city_name',
+                 'plusvalia_percentile', 'plusvalia_region_percentile']
+        read_only_fields = ['distance_to_city_km', 'distance_to_airport_km', 'distance_to_port_km', 'nearest_city_name',
+                            'plusvalia_percentile', 'plusvalia_region_percentile']
         extra_kwargs = {
             'workflow_node': {'read_only': True},
             'workflow_substate': {'read_only': True},
@@ -631,7 +643,8 @@ class PropertyListSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'type', 'price', 'size', 'latitude', 'longitude',
                  'has_water', 'has_views', 'image_count', 'has_tour', 'boundary_polygon', 'has_boundary',
                  'publication_status', 'workflow_node', 'workflow_substate', 'workflow_progress', 'workflow_timeline',
-                 'owner_details', 'created_at', 'listing_type', 'rent_price', 'rental_terms', 'plusvalia_score']
+                 'owner_details', 'created_at', 'listing_type', 'rent_price', 'rental_terms', 'plusvalia_score',
+                 'distance_to_city_km', 'nearest_city_name', 'plusvalia_percentile', 'plusvalia_region_percentile']
 
     def get_plusvalia_score(self, obj):
         # Beta/prelanzamiento: visible para todos
@@ -1,8 +1,48 @@
+import os
+import asyncio
+import multiprocessing
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.urls import reverse
+from django.test import TestCase
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 from django.contrib.auth import get_user_model
-from .models import Property
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from ai_management.llm_stub import GeminiStubServer
+from ai_management.llm_transport import get_transport
+from ai_management.models import AIUsageLog
+from ai_management.usage_buffer import UsageLogBuffer
+from payments.models import Subscription
+from .ai_categorization import categorize_properties
+from .ai_search_cache import LOCK_PREFIX, build_cache_keys, get_catalog_version, cached_search, get_cache_stats, normalize_query, ttl_for
+from .catalog_rescore import RescoreCheckpoint, run_rescore
+from .gazetteer import get_gazetteer
+from .external_market_service import ExternalMarketDataService, clearcapital_breaker
+from .market_data_stub import MarketDataStubServer
+from .offer_sweeper import sweep_expired_offers
+from .wave_benchmark import measure_wave_statements
+from .matching import bounding_box, haversine_distance_km, send_wave, shortlist_pilots
+from .models import Job, JobOffer, JobTimelineEvent, PilotDevice, PilotDocument, PilotProfile, Property, PlusvaliaAIEvaluation, PlusvaliaRecomputeTask
+from .plusvalia_factor_registry import _factor_funcs, _factor_specs, _factor_weights, evaluate_factors, register_factor
+from .plusvalia_distribution import mark_distribution_stale, property_percentiles, rebuild_distribution, refresh_distribution_if_stale
+from .plusvalia_memo import get_memo_stats
+from .pilot_compliance import sweep_pilot_compliance
+from .plusvalia_service import PlusvaliaService
+from .proximity import HubIndex, _PyKDTree, _chord_to_km, _to_xyz, load_hubs
+from .prompt_context import build_property_context, get_property_context
+from .retrieval import retrieve_candidates
+from .services import GeminiService
+from .plusvalia_queue import claim_tasks, enqueue_plusvalia_recompute, process_batch, run_task
 
 User = get_user_model()
 
@@ -169,3 +209,981 @@ class PropertyAPITests(APITestCase):
         self.assertEqual(response_reject.status_code, status.HTTP_200_OK)
         self.assertEqual(response_reject.data['publication_status'], 'rejected')
         self.assertEqual(response_reject.data['name'], 'Admin Rejected Name')
+
+
+class PlusvaliaRecomputeQueueTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='queueowner', email='queue@example.com', password='password123')
+
+    def _create_property(self, **extra):
+        data = {'owner': self.owner, 'name': 'Queue Farm', 'price': 50000, 'size': 20, 'description': 'Campo de prueba'}
+        data.update(extra)
+        return Property.objects.create(**data)
+
+    def test_save_enqueues_instead_of_calculating_inline(self):
+        with mock.patch('properties.plusvalia_service.PlusvaliaService.calculate') as calculate:
+            prop = self._create_property()
+        calculate.assert_not_called()
+        task = PlusvaliaRecomputeTask.objects.get(property=prop)
+        self.assertEqual(task.status, 'pending')
+        self.assertEqual(task.priority, PlusvaliaRecomputeTask.PRIORITY_NEW)
+        self.assertIsNone(prop.plusvalia_score)
+
+    def test_repeated_enqueues_are_coalesced(self):
+        prop = self._create_property()
+        enqueue_plusvalia_recompute(prop, reason='updated')
+        enqueue_plusvalia_recompute(prop, priority=PlusvaliaRecomputeTask.PRIORITY_PUBLISHED, reason='published')
+        tasks = PlusvaliaRecomputeTask.objects.filter(property=prop)
+        self.assertEqual(tasks.count(), 1)
+        task = tasks.get()
+        self.assertEqual(task.coalesced_count, 2)
+        self.assertEqual(task.priority, PlusvaliaRecomputeTask.PRIORITY_PUBLISHED)
+
+    def test_worker_persists_score_and_prioritizes_published(self):
+        first = self._create_property(name='Normal')
+        second = self._create_property(name='Publicada')
+        enqueue_plusvalia_recompute(second, priority=PlusvaliaRecomputeTask.PRIORITY_PUBLISHED)
+
+        with mock.patch('properties.plusvalia_service.PlusvaliaService.calculate', return_value=Decimal('71.50')):
+            claimed = claim_tasks(1, 'test-worker')
+            self.assertEqual([t.property_id for t in claimed], [second.id])
+            self.assertTrue(run_task(claimed[0]))
+            stats = process_batch(limit=10, worker_id='test-worker')
+
+        self.assertEqual(stats['succeeded'], 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.plusvalia_score, Decimal('71.50'))
+        self.assertEqual(second.plusvalia_score, Decimal('71.50'))
+        self.assertFalse(PlusvaliaRecomputeTask.objects.exclude(status='done').exists())
+
+    def test_failures_are_retried_with_backoff_then_marked_failed(self):
+        prop = self._create_property()
+        PlusvaliaRecomputeTask.objects.filter(property=prop).update(max_attempts=2)
+
+        with mock.patch('properties.plusvalia_service.PlusvaliaService.calculate', side_effect=RuntimeError('Sam caído')):
+            process_batch(limit=5, worker_id='test-worker')
+            task = PlusvaliaRecomputeTask.objects.get(property=prop)
+            self.assertEqual(task.status, 'pending')
+            self.assertEqual(task.attempts, 1)
+            self.assertGreater(task.next_attempt_at, timezone.now())
+            self.assertIn('Sam caído', task.last_error)
+
+            PlusvaliaRecomputeTask.objects.filter(pk=task.pk).update(next_attempt_at=timezone.now())
+            process_batch(limit=5, worker_id='test-worker')
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'failed')
+        self.assertEqual(task.attempts, 2)
+
+
+class PlusvaliaAIMemoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.prop = Property.objects.create(name='Memo Farm', price=80000, size=30, description='Campo con río')
+
+    def test_ai_score_is_requested_once_for_unchanged_inputs(self):
+        with mock.patch.object(PlusvaliaService, '_request_ai_score', return_value=64) as request_score:
+            self.assertEqual(PlusvaliaService._ai_score_with_source(self.prop), (64, 'miss'))
+            self.assertEqual(PlusvaliaService._ai_score_with_source(self.prop), (64, 'cache'))
+            cache.clear()
+            self.assertEqual(PlusvaliaService._ai_score_with_source(self.prop), (64, 'db'))
+        self.assertEqual(request_score.call_count, 1)
+        self.assertEqual(PlusvaliaAIEvaluation.objects.get().hit_count, 1)
+
+        stats = get_memo_stats()
+        self.assertEqual(stats['hits_db'], 1)
+        self.assertEqual(stats['misses'], 0)  # cache.clear() también reinició los contadores
+
+    def test_changed_inputs_miss_the_memo(self):
+        with mock.patch.object(PlusvaliaService, '_request_ai_score', side_effect=[40, 75]) as request_score:
+            PlusvaliaService._ai_score(self.prop)
+            self.prop.description = 'Campo con río y vista al volcán'
+            self.assertEqual(PlusvaliaService._ai_score(self.prop), 75)
+        self.assertEqual(request_score.call_count, 2)
+        self.assertEqual(get_memo_stats()['hit_rate'], 0.0)
+
+    def test_memo_hit_makes_no_queries_once_config_is_warm(self):
+        with mock.patch.object(PlusvaliaService, '_request_ai_score', return_value=58):
+            PlusvaliaService._ai_score(self.prop)  # calienta la instantánea de configuración y la memo
+            with self.assertNumQueries(0):
+                self.assertEqual(PlusvaliaService._ai_score_with_source(self.prop), (58, 'cache'))
+
+
+class ExternalMarketDataServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clearcapital_breaker.reset()
+        self.stub = MarketDataStubServer().start()
+        self.addCleanup(self.stub.stop)
+        self.addCleanup(clearcapital_breaker.reset)
+        self.svc = ExternalMarketDataService(api_key='test', base_url=self.stub.base_url, cell_size=0.05)
+
+    def test_batch_groups_nearby_points_into_one_call(self):
+        coords = [(-33.4501, -70.6601), (-33.4502, -70.6602), (-36.8201, -73.0401)]
+        data = self.svc.get_market_data_batch(coords)
+
+        self.assertEqual(len(self.stub.calls), 1)
+        self.assertEqual(self.stub.calls[0]['points'], 2)  # dos celdas distintas
+        self.assertEqual(data[coords[0]], data[coords[1]])
+        self.assertIsNotNone(data[coords[2]]['estimated_value'])
+
+        # Un punto cercano ya está en caché: no hay nuevas llamadas
+        self.svc.get_market_estimated_value(-33.4503, -70.6603)
+        self.assertEqual(len(self.stub.calls), 1)
+
+    def test_falls_back_to_single_endpoints_and_opens_breaker(self):
+        self.stub.httpd.batch_enabled = False
+        snapshot = self.svc.get_market_snapshot(-33.45, -70.66)
+        self.assertIsNotNone(snapshot['estimated_value'])
+        self.assertIsNotNone(snapshot['annual_appreciation'])
+        self.assertEqual([c['endpoint'] for c in self.stub.calls], ['batch', 'avm', 'appreciation'])
+
+        cache.clear()
+        self.stub.fail_with(500)
+        with mock.patch('properties.external_market_service.Retry.sleep'):
+            for _ in range(clearcapital_breaker.failure_threshold):
+                self.svc.get_market_snapshot(-10.0, -60.0)
+        self.assertEqual(clearcapital_breaker.state, 'open')
+        calls_before = len(self.stub.calls)
+        self.assertIsNone(self.svc.get_market_estimated_value(-11.0, -61.0))
+        self.assertEqual(len(self.stub.calls), calls_before)
+
+
+class PlusvaliaFactorRegistryTests(TestCase):
+    def setUp(self):
+        self.prop = Property(name='Registry', type='farm', price=Decimal('100000'), size=50,
+                             latitude=-33.45, longitude=-70.66)
+        self.registered = []
+
+    def tearDown(self):
+        for name in self.registered:
+            for registry in (_factor_funcs, _factor_weights, _factor_specs):
+                registry.pop(name, None)
+
+    def _register(self, name, weight, **kwargs):
+        self.registered.append(name)
+        return register_factor(name, weight, **kwargs)
+
+    def test_io_factors_run_concurrently_with_dependencies_and_timeouts(self):
+        import time
+
+        @self._register('t_io_a', 0.5, kind='io')
+        def io_a(prop):
+            time.sleep(0.3)
+            return 80
+
+        @self._register('t_io_b', 0.5, kind='io')
+        def io_b(prop):
+            time.sleep(0.3)
+            return 40
+
+        @self._register('t_combined', 0.0, depends_on=('t_io_a', 't_io_b'))
+        def combined(prop, context):
+            return (context.results['t_io_a'] + context.results['t_io_b']) / 2
+
+        @self._register('t_slow', 0.0, kind='io', timeout=0.1, default=7)
+        def slow(prop):
+            time.sleep(1)
+            return 99
+
+        evaluation = evaluate_factors(self.prop, names=['t_combined', 't_slow'])
+
+        self.assertEqual(evaluation.results['t_combined'], 60)
+        self.assertEqual(evaluation.results['t_slow'], 7)
+        self.assertEqual(evaluation.timed_out, ('t_slow',))
+        self.assertLess(evaluation.total_ms, 550)  # secuencial serían >= 600 ms
+        self.assertGreaterEqual(evaluation.timings_ms['t_io_a'], 250)
+
+    def test_market_factors_share_one_fetch(self):
+        snapshot = {'estimated_value': 100000.0, 'annual_appreciation': 5.0}
+        with mock.patch.object(ExternalMarketDataService, 'get_market_snapshot', return_value=snapshot) as fetch:
+            evaluation = evaluate_factors(self.prop, names=['relative_market_price', 'appreciation_rate'])
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(evaluation.results['appreciation_rate'], 50)
+        self.assertFalse(evaluation.errors)
+
+
+class RescorePropertiesCommandTests(TestCase):
+    def setUp(self):
+        import tempfile
+
+        owner = User.objects.create_user(username='rescoreowner', email='rescore@example.com', password='password123')
+        self.props = [
+            Property.objects.create(owner=owner, name=f'Rescore {i}', price=50000, size=20, description='Campo')
+            for i in range(3)
+        ]
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.checkpoint_path = f"{tmpdir.name}/rescore.json"
+
+    def test_resumes_from_checkpoint_and_bulk_updates(self):
+        from django.core.management import call_command
+
+        checkpoint = RescoreCheckpoint(self.checkpoint_path, ['plusvalia'], False)
+        checkpoint.mark([self.props[0].id], {'processed': 1})
+
+        with mock.patch.object(PlusvaliaService, 'calculate', return_value=Decimal('77.00')) as calculate:
+            call_command('rescore_properties', processes=1, chunk_size=1, ai_rate=0,
+                         checkpoint=self.checkpoint_path, stdout=mock.MagicMock())
+
+        self.assertEqual(calculate.call_count, 2)
+        scores = dict(Property.objects.filter(id__in=[p.id for p in self.props]).values_list('id', 'plusvalia_score'))
+        self.assertIsNone(scores[self.props[0].id])
+        self.assertEqual(scores[self.props[1].id], Decimal('77.00'))
+        self.assertEqual(scores[self.props[2].id], Decimal('77.00'))
+        self.assertFalse(os.path.exists(self.checkpoint_path))  # corrida completa: checkpoint eliminado
+
+    def test_failed_properties_are_retried_on_resume(self):
+        from django.core.management import call_command
+
+        failing = self.props[1].id
+
+        def flaky(prop):
+            if prop.pk == failing:
+                raise RuntimeError('Sam no respondió')
+            return Decimal('77.00')
+
+        with mock.patch.object(PlusvaliaService, 'calculate', side_effect=flaky):
+            call_command('rescore_properties', processes=1, chunk_size=3, ai_rate=0,
+                         checkpoint=self.checkpoint_path, stdout=mock.MagicMock())
+
+        checkpoint = RescoreCheckpoint(self.checkpoint_path, ['plusvalia'], False)
+        self.assertTrue(checkpoint.load())  # quedó un error: el checkpoint se conserva
+        self.assertEqual(checkpoint.failed, {failing})
+        self.assertEqual(checkpoint.pending([p.id for p in self.props]), [failing])
+
+        with mock.patch.object(PlusvaliaService, 'calculate', return_value=Decimal('66.00')) as calculate:
+            call_command('rescore_properties', processes=1, chunk_size=3, ai_rate=0,
+                         checkpoint=self.checkpoint_path, stdout=mock.MagicMock())
+
+        self.assertEqual(calculate.call_count, 1)
+        self.assertEqual(Property.objects.get(pk=failing).plusvalia_score, Decimal('66.00'))
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_pool_results_are_merged_into_the_checkpoint(self):
+        ids = list(range(1, 21))
+
+        def fake_chunk(chunk_ids, tasks, force=False, batch_size=200, limiter=None):
+            # Corre en los procesos hijos (fork): no toca la BD de la prueba
+            failed = [pid for pid in chunk_ids if pid % 7 == 0]
+            return {'chunk': list(chunk_ids), 'processed': len(chunk_ids), 'updated': len(chunk_ids) - len(failed),
+                    'failed': len(failed), 'failed_ids': failed, 'ai_calls': 0, 'pid': os.getpid()}
+
+        checkpoint = RescoreCheckpoint(self.checkpoint_path, ['plusvalia'], False)
+        results = []
+        with mock.patch('properties.catalog_rescore.rescore_chunk', side_effect=fake_chunk), \
+                mock.patch('properties.catalog_rescore.multiprocessing.get_context',
+                           return_value=multiprocessing.get_context('fork')):
+            total = run_rescore(ids, ['plusvalia'], checkpoint, processes=2, chunk_size=4,
+                                on_progress=lambda done, total, result: results.append(result))
+
+        self.assertEqual(total, 20)
+        self.assertEqual(len(results), 5)
+        self.assertNotIn(os.getpid(), {result['pid'] for result in results})
+        self.assertEqual(checkpoint.pending(ids), [7, 14])
+        self.assertEqual(checkpoint.totals['processed'], 20)
+        self.assertEqual(checkpoint.totals['failed'], 2)
+
+
+class HubProximityIndexTests(TestCase):
+    def test_kdtree_matches_brute_force(self):
+        import math
+        import random
+
+        hubs = load_hubs()
+        tree = _PyKDTree([_to_xyz(h['lat'], h['lon']) for h in hubs])
+        rng = random.Random(7)
+        for _ in range(200):
+            point = _to_xyz(rng.uniform(-56, -17), rng.uniform(-76, -66))
+            expected = min(range(len(hubs)), key=lambda i: math.dist(point, _to_xyz(hubs[i]['lat'], hubs[i]['lon'])))
+            self.assertEqual(tree.query(point)[1], expected)
+
+    def test_save_stores_distances_to_nearest_patagonian_hubs(self):
+        owner = User.objects.create_user(username='hubowner', email='hub@example.com', password='password123')
+        prop = Property.objects.create(owner=owner, name='Estancia', price=90000, size=300, description='Campo',
+                                       latitude=-51.70, longitude=-72.40)
+        self.assertEqual(prop.nearest_city_name, 'Puerto Natales')
+        self.assertLess(prop.distance_to_city_km, 15)
+        self.assertLess(prop.distance_to_airport_km, 15)
+        self.assertLess(prop.distance_to_port_km, 15)
+
+        index = HubIndex([h for h in load_hubs() if h['type'] == 'city'])
+        results = index.query_batch([(-33.45, -70.66), (-53.16, -70.91)])
+        self.assertEqual([hub['name'] for _, hub in results], ['Santiago', 'Punta Arenas'])
+        self.assertAlmostEqual(_chord_to_km(0), 0)
+
+
+class PlusvaliaDistributionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username='distowner', email='dist@example.com', password='password123')
+        self.props = [
+            Property.objects.create(owner=owner, name=f'Dist {i}', price=50000, size=20, description='Campo',
+                                    address_region='Maule', publication_status='approved',
+                                    plusvalia_score=Decimal(i * 10))
+            for i in range(1, 11)
+        ]
+        self.subscriber = User.objects.create_user(username='distpro', email='distpro@example.com', password='password123')
+        Subscription.objects.create(user=self.subscriber, status='active')
+
+    def test_rebuild_stores_percentiles_and_endpoint_reports_rank(self):
+        rebuild_distribution()
+        top = Property.objects.get(pk=self.props[-1].pk)
+        self.assertEqual(top.plusvalia_percentile, 95.0)
+        self.assertEqual(top.plusvalia_region_percentile, 95.0)
+
+        url = reverse('property-plusvalia-percentile', kwargs={'pk': top.pk})
+        self.client.force_authenticate(self.subscriber)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['region']['key'], 'region:maule')
+        self.assertEqual(response.data['region']['top_percent'], 5.0)
+        self.assertEqual(sum(response.data['global']['histogram']), 10)
+
+    def test_endpoint_requires_subscription_and_visible_property(self):
+        rebuild_distribution()
+        url = reverse('property-plusvalia-percentile', kwargs={'pk': self.props[0].pk})
+        self.assertIn(self.client.get(url).status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        lapsed = User.objects.create_user(username='distlapsed', email='lapsed@example.com', password='password123')
+        Subscription.objects.create(user=lapsed, status='canceled')
+        self.client.force_authenticate(lapsed)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        draft = Property.objects.create(owner=self.props[0].owner, name='Borrador', price=1, size=1,
+                                        publication_status='pending', plusvalia_score=Decimal('50'))
+        self.client.force_authenticate(self.subscriber)
+        draft_url = reverse('property-plusvalia-percentile', kwargs={'pk': draft.pk})
+        self.assertEqual(self.client.get(draft_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(self.props[0].owner)
+        Subscription.objects.create(user=self.props[0].owner, status='trialing')
+        self.assertEqual(self.client.get(draft_url).status_code, status.HTTP_200_OK)
+
+    def test_lookup_reads_only_its_segments(self):
+        rebuild_distribution()
+        with mock.patch('properties.plusvalia_distribution.cache.get_many', wraps=cache.get_many) as get_many:
+            result = property_percentiles(self.props[4])
+        self.assertEqual(len(get_many.call_args.args[0]), 3)
+        self.assertEqual(result['global']['percentile'], 45.0)
+        self.assertEqual(result['type']['count'], 10)
+
+        cache.clear()  # sin metadatos: se reconstruye y vuelve a publicar
+        self.assertEqual(property_percentiles(self.props[4])['global']['count'], 10)
+
+    def test_stale_flag_triggers_refresh(self):
+        rebuild_distribution()
+        Property.objects.filter(pk=self.props[0].pk).update(plusvalia_score=Decimal('99'))
+        self.assertFalse(refresh_distribution_if_stale(respect_interval=False))
+        mark_distribution_stale()
+        self.assertTrue(refresh_distribution_if_stale(respect_interval=False))
+        self.assertEqual(Property.objects.get(pk=self.props[0].pk).plusvalia_percentile, 85.0)
+
+
+class AISearchCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('project-ai-search')
+
+    @override_settings(AI_GAZETTEER_ENABLED=False)  # "Muéstrame Villarrica" la respondería el nomenclátor
+    def test_equivalent_queries_share_cached_response_until_catalog_changes(self):
+        answer = {'search_mode': 'location', 'assistant_message': 'Villarrica', 'recommendations': [],
+                  'flyToLocation': {'center': [-72.2, -39.3], 'zoom': 11}}
+        recommendation = {'search_mode': 'property_recommendation', 'assistant_message': 'Campos', 'recommendations': []}
+        with mock.patch('properties.views.GeminiService') as service_cls:
+            service = service_cls.return_value
+            service.search_properties_with_ai.side_effect = lambda query, *args, **kwargs: (
+                answer if 'villarrica' in normalize_query(query) else recommendation)
+            first = self.client.post(self.url, {'query': 'Muéstrame Villarrica'}, format='json')
+            second = self.client.post(self.url, {'query': 'muestrame   villarrica '}, format='json')
+            self.client.post(self.url, {'query': 'Campos con agua'}, format='json')
+            Property.objects.create(
+                owner=User.objects.create_user(username='aisearch', password='password123'),
+                name='Nueva', price=1000, size=1, description='Nueva',
+            )
+            third = self.client.post(self.url, {'query': 'muestrame villarrica'}, format='json')
+            fourth = self.client.post(self.url, {'query': 'campos con agua'}, format='json')
+
+        self.assertEqual(normalize_query('¡Muéstrame  Villarrica!'), 'muestrame villarrica')
+        self.assertEqual(first['X-AI-Search-Cache'], 'miss')
+        self.assertEqual(second['X-AI-Search-Cache'], 'hit')
+        self.assertEqual(second.data, answer)
+        # Las respuestas de ubicación no dependen del catálogo; las recomendaciones sí
+        self.assertEqual(third['X-AI-Search-Cache'], 'hit')
+        self.assertEqual(fourth['X-AI-Search-Cache'], 'miss')
+        self.assertEqual(service.search_properties_with_ai.call_count, 3)
+        self.assertGreater(ttl_for(answer), ttl_for({'search_mode': 'property_recommendation'}))
+        self.assertEqual(ttl_for({'search_mode': 'chat', 'fallback': True}), 0)
+
+    def test_concurrent_identical_queries_are_coalesced(self):
+        import threading
+        release = threading.Event()
+        compute = mock.Mock(side_effect=lambda: release.wait(5) and {'search_mode': 'chat'})
+        history = [{'role': 'user', 'content': 'Hola'}]
+        results = []
+
+        def worker():
+            results.append(cached_search('Terrenos con agua', history, compute))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        time.sleep(0.2)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(sorted(source for _, source in results), ['coalesced', 'coalesced', 'coalesced', 'miss'])
+        self.assertEqual(get_cache_stats()['coalesced'], 3)
+        # Otra conversación no reutiliza la respuesta
+        self.assertEqual(cached_search('Terrenos con agua', [], compute)[1], 'miss')
+
+    @override_settings(AI_SEARCH_COALESCE_WAIT_SECONDS=0.2)
+    def test_waiter_that_times_out_does_not_release_foreign_lock(self):
+        keys = build_cache_keys('Parcelas en Pucón', [])
+        lock_key = f"{LOCK_PREFIX}:{keys[0].rsplit(':', 1)[-1]}"
+        cache.set(lock_key, 'other-process', timeout=60)
+
+        response, source = cached_search('Parcelas en Pucón', [], lambda: {'search_mode': 'chat'})
+
+        self.assertEqual(source, 'miss')
+        self.assertEqual(response, {'search_mode': 'chat'})
+        self.assertEqual(cache.get(lock_key), 'other-process')
+        cached_search('Otra consulta', [], lambda: {'search_mode': 'chat'})
+        self.assertIsNone(cache.get(f"{LOCK_PREFIX}:{build_cache_keys('Otra consulta', [])[0].rsplit(':', 1)[-1]}"))
+
+
+class PromptContextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='ctxowner', password='password123')
+        for i in range(5):
+            Property.objects.create(owner=self.owner, name=f'Campo {i}', price=100000 + i, size=12.5,
+                                    description='Campo con | vista\n al lago ' * 10, has_water=True,
+                                    latitude=-39.28, longitude=-72.23)
+
+    def test_context_is_compact_cached_and_invalidated_by_catalog_changes(self):
+        context = get_property_context()
+        lines = context.split('\n')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[1].endswith('…'))
+        self.assertIn('|100000|12.5|si|no|-39.2800,-72.2300|', lines[1])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_property_context(), context)
+
+        Property.objects.create(owner=self.owner, name='Campo nuevo', price=1, size=1, description='Nuevo')
+        self.assertEqual(len(get_property_context().split('\n')), 7)
+        self.assertLessEqual(len(build_property_context(max_chars=300)), 300)
+
+
+class PropertyRetrievalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='retrievalowner', password='password123')
+        for i in range(30):
+            Property.objects.create(owner=self.owner, name=f'Parcela genérica {i}', price=90000 + i, size=5,
+                                    description='Terreno plano cerca de la carretera.', type='farm')
+        self.lake = Property.objects.create(
+            owner=self.owner, name='Refugio del Lago', price=180000, size=20, type='lake', has_water=True,
+            description='Orilla de lago con bosque nativo.', address_region='Los Ríos', has_views=True,
+        )
+        self.forest = Property.objects.create(
+            owner=self.owner, name='Bosque Alto', price=95000, size=40, type='forest',
+            description='Bosques y vistas a la cordillera.', ai_summary='Bosque nativo con vistas',
+        )
+
+    def test_candidates_are_ranked_by_relevance_and_attributes_without_queries(self):
+        candidates = retrieve_candidates('orilla de lagos en los rios')
+        self.assertEqual(candidates[0]['id'], self.lake.id)
+        with self.assertNumQueries(0):  # el índice ya está en memoria
+            ranked = retrieve_candidates('bosque nativo', filters={'propertyTypes': ['forest'], 'priceRange': [None, 150000]})
+        self.assertEqual([doc['id'] for doc in ranked][:1], [self.forest.id])
+        self.assertNotIn(self.lake.id, [doc['id'] for doc in ranked])
+
+        service = GeminiService(api_key='test')
+        prompt = service._create_enhanced_prompt('Busco un bosque nativo con vistas')
+        self.assertIn(f'{self.forest.id}|Bosque Alto|forest|', prompt)
+        self.assertLessEqual(prompt.count('|farm|'), 5)
+
+    def test_only_indexed_field_changes_bump_the_catalog_version(self):
+        retrieve_candidates('bosque')
+        version = get_catalog_version()
+        forest = Property.objects.get(pk=self.forest.pk)
+        forest.add_alert('info', 'Revisión de fotos')
+        forest.workflow_node = 'review'
+        forest.save()
+        with self.assertNumQueries(0):
+            retrieve_candidates('bosque')
+        self.assertEqual(get_catalog_version(), version)
+
+        forest.name = 'Bosque Alto Renovado'
+        forest.save()
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(retrieve_candidates('renovado')[0]['id'], self.forest.id)
+
+
+class RecommendationEnrichmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_transport().breaker.reset()
+        self.stub = GeminiStubServer().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(
+            GEMINI_API_BASE_URL=self.stub.base_url, GOOGLE_GEMINI_API_KEY='test', AI_USAGE_LOG_BUFFERED=False,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        owner = User.objects.create_user(username='enrichowner', password='password123')
+        self.ids = [
+            Property.objects.create(owner=owner, name=f'Terreno con agua {i}', price=100000 + i, size=10,
+                                    description='Terreno con agua y vistas.', has_water=True).id
+            for i in range(6)
+        ]
+
+    def _property_selects(self, reply):
+        self.stub.reply_with(reply)
+        service = GeminiService(api_key='test')
+        with CaptureQueriesContext(connection) as queries:
+            result = service.search_properties_with_ai('Muéstrame terrenos con agua')
+        selects = [q for q in queries if q['sql'].startswith('SELECT') and 'FROM "properties_property"' in q['sql']]
+        return result, len(selects)
+
+    def test_recommendations_are_enriched_with_a_single_query(self):
+        GeminiService(api_key='test')._get_property_context('agua')  # índice de preselección ya construido
+
+        def reply(ids):
+            return json.dumps({'search_mode': 'property_recommendation', 'assistant_message': 'Opciones con agua.',
+                               'recommendations': [{'id': pk, 'reason': 'tiene agua'} for pk in ids]})
+
+        one, one_queries = self._property_selects(reply(self.ids[:1]))
+        many, many_queries = self._property_selects(reply(self.ids[:5] + [999999]))
+        self.assertEqual([rec['id'] for rec in many['recommendations']], self.ids[:5])
+        self.assertEqual(many['recommendations'][0]['reason'], 'tiene agua')
+        self.assertEqual(len(one['recommendations']), 1)
+        self.assertEqual(one_queries, 1)
+        self.assertEqual(many_queries, 1)
+
+        fallback, fallback_queries = self._property_selects('esto no es JSON')
+        self.assertTrue(fallback['fallback'])
+        self.assertEqual(len(fallback['recommendations']), 0)
+        self.assertEqual(fallback_queries, 1)
+
+
+class BatchCategorizationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_transport().breaker.reset()
+        self.stub = GeminiStubServer().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(
+            GEMINI_API_BASE_URL=self.stub.base_url, GOOGLE_GEMINI_API_KEY='test', AI_USAGE_LOG_BUFFERED=True,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        owner = User.objects.create_user(username='categorizeowner', password='password123')
+        self.props = [
+            Property.objects.create(owner=owner, name=f'Campo {i}', price=50000, size=3, description='Bosque nativo.')
+            for i in range(5)
+        ]
+        self.stub.reply_with(json.dumps([
+            {'id': prop.id, 'ai_category': 'forest', 'ai_summary': f'Bosque nativo {prop.id}'} for prop in self.props
+        ]))
+
+    def _categorize(self):
+        buffer = UsageLogBuffer()  # el uso queda en memoria: los hilos del pool no escriben en la BD del test
+        with mock.patch('ai_management.usage_buffer.get_usage_buffer', return_value=buffer), \
+                mock.patch.object(buffer, 'start'):
+            return categorize_properties(Property.objects.filter(id__in=[p.id for p in self.props]),
+                                         batch_size=2, max_workers=3, rate_per_minute=0)
+
+    def test_batches_run_concurrently_and_unchanged_properties_are_skipped(self):
+        stats = self._categorize()
+        self.assertEqual((stats['updated'], stats['failed'], stats['ai_calls']), (5, 0, 3))
+        self.assertEqual(len(self.stub.calls), 3)
+        first = Property.objects.get(id=self.props[0].id)
+        self.assertEqual((first.ai_category, first.ai_summary), ('forest', f'Bosque nativo {first.id}'))
+        self.assertTrue(first.ai_content_hash)
+
+        self.assertEqual(self._categorize()['skipped'], 5)
+        self.assertEqual(len(self.stub.calls), 3)
+
+        Property.objects.filter(id=self.props[1].id).update(description='Ahora con laguna.')
+        stats = self._categorize()
+        self.assertEqual((stats['skipped'], stats['updated'], stats['ai_calls']), (4, 1, 1))
+
+
+class GazetteerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_transport().breaker.reset()
+        self.stub = GeminiStubServer().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(
+            GEMINI_API_BASE_URL=self.stub.base_url, GOOGLE_GEMINI_API_KEY='test', AI_USAGE_LOG_BUFFERED=False,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_only_pure_place_queries_match(self):
+        gazetteer = get_gazetteer()
+        self.assertEqual(gazetteer.match_query('Muéstrame Villarrica')['name'], 'Villarrica')
+        self.assertEqual(gazetteer.match_query('llévame al lago Ranco')['kind'], 'lake')
+        self.assertEqual(gazetteer.match_query('¿Dónde queda Los Ángeles?')['name'], 'Los Ángeles')
+        self.assertIsNone(gazetteer.match_query('terrenos con agua cerca de Osorno'))
+        self.assertIsNone(gazetteer.match_query('Villarrica y Pucón'))
+        self.assertIsNone(gazetteer.match_query('hola'))
+
+    def test_place_query_is_answered_without_llm(self):
+        response = self.client.post(reverse('project-ai-search'), {'query': 'Llévame a Puerto Varas'},
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-AI-Search-Cache'], 'gazetteer')
+        self.assertEqual(response.data['search_mode'], 'location')
+        lon, lat = response.data['flyToLocation']['center']
+        self.assertAlmostEqual(lat, -41.3, delta=0.2)
+        self.assertAlmostEqual(lon, -72.98, delta=0.2)
+        self.assertEqual(self.stub.calls, [])
+
+        with override_settings(AI_GAZETTEER_ENABLED=False):
+            self.stub.reply_with(json.dumps({'search_mode': 'chat', 'assistant_message': 'Hola'}))
+            response = self.client.post(reverse('project-ai-search'), {'query': 'Llévame a Puerto Varas'},
+                                        content_type='application/json')
+        self.assertEqual(response['X-AI-Search-Cache'], 'miss')
+        self.assertEqual(len(self.stub.calls), 1)
+
+    def test_place_query_with_history_goes_to_sam(self):
+        self.stub.reply_with(json.dumps({'search_mode': 'property_recommendation', 'assistant_message': 'En Pucón',
+                                         'recommendations': []}))
+        history = [{'role': 'user', 'content': 'Busco campos con agua'},
+                   {'role': 'assistant', 'content': 'Tengo estas opciones'}]
+        response = self.client.post(reverse('project-ai-search'),
+                                    {'query': 'Pucón', 'conversation_history': history},
+                                    content_type='application/json')
+
+        self.assertEqual(response['X-AI-Search-Cache'], 'miss')
+        self.assertEqual(len(self.stub.calls), 1)
+        stream = self.client.post(reverse('project-ai-search-stream'), {'query': 'Pucón', 'conversation_history': history},
+                                  content_type='application/json')
+        self.assertNotIn(b'gazetteer', b''.join(stream.streaming_content))
+
+
+class AISearchStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_transport().breaker.reset()
+        self.stub = GeminiStubServer().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(
+            GEMINI_API_BASE_URL=self.stub.base_url, GOOGLE_GEMINI_API_KEY='test', AI_USAGE_LOG_BUFFERED=False,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _events(self, response):
+        events, first_delta_at = [], None
+        started = time.monotonic()
+        for chunk in response.streaming_content:
+            for block in chunk.decode('utf-8').strip().split('\n\n'):
+                event_line, data_line = block.split('\n')
+                event = event_line[len('event: '):]
+                if event == 'delta' and first_delta_at is None:
+                    first_delta_at = time.monotonic() - started
+                events.append((event, json.loads(data_line[len('data: '):])))
+        return events, first_delta_at, time.monotonic() - started
+
+    def test_stream_forwards_assistant_text_then_final_result(self):
+        answer = {'search_mode': 'chat', 'assistant_message': 'Hola, ¿qué zona te interesa? ' * 8,
+                  'recommendations': []}
+        self.stub.reply_with(json.dumps(answer))
+        self.stub.stream_chunks(16, delay=0.04)
+        url = reverse('project-ai-search-stream')
+
+        response = self.client.post(url, {'query': 'hola sam, ayúdame'}, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events, first_delta_at, total = self._events(response)
+
+        names = [name for name, _ in events]
+        self.assertEqual(names[-2:], ['result', 'done'])
+        self.assertEqual(''.join(data['text'] for name, data in events if name == 'delta'), answer['assistant_message'])
+        self.assertEqual(events[-2][1]['search_mode'], 'chat')
+        self.assertLess(first_delta_at, total / 2)
+        self.assertEqual(AIUsageLog.objects.filter(request_type='ai_property_search', success=True).count(), 1)
+
+        cached, _, _ = self._events(self.client.post(url, {'query': 'Hola Sam, ayúdame'}, content_type='application/json'))
+        self.assertEqual([name for name, _ in cached], ['result', 'done'])
+        self.assertEqual(cached[1][1], {'cache': 'hit'})
+
+    async def test_stream_is_not_buffered_under_asgi(self):
+        from django.core.asgi import get_asgi_application
+        from django.core.signals import request_finished, request_started
+        from django.db import close_old_connections
+
+        answer = {'search_mode': 'chat', 'assistant_message': 'Hola, ¿qué zona te interesa? ' * 8,
+                  'recommendations': []}
+        self.stub.reply_with(json.dumps(answer))
+        self.stub.stream_chunks(16, delay=0.04)
+        # Como AsyncClient: que el handler no cierre la conexión del test
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+        body = json.dumps({'query': 'hola sam, ayúdame por asgi'}).encode()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': reverse('project-ai-search-stream'), 'raw_path': b'', 'query_string': b'', 'root_path': '',
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                        (b'host', b'testserver')],
+            'client': ('127.0.0.1', 1234), 'server': ('testserver', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        chunks = []
+        started = time.monotonic()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(60)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                chunks.append((time.monotonic() - started, message['body'].decode('utf-8')))
+
+        await get_asgi_application()(scope, receive, send)
+        total = time.monotonic() - started
+
+        first_delta_at = next(at for at, text in chunks if text.startswith('event: delta'))
+        self.assertGreater(len(chunks), 3)
+        self.assertLess(first_delta_at, total / 2)
+        self.assertIn('event: done', chunks[-1][1])
+
+
+class AsyncAISearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_transport().breaker.reset()
+        self.stub = GeminiStubServer(reply_text=json.dumps({'search_mode': 'chat', 'assistant_message': 'Hola'})).start()
+        self.addCleanup(self.stub.stop)
+        self.stub.delay_by(0.3)
+        settings_override = override_settings(
+            GEMINI_API_BASE_URL=self.stub.base_url, GOOGLE_GEMINI_API_KEY='test', AI_USAGE_LOG_BUFFERED=False,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    async def test_concurrent_requests_wait_as_coroutines_and_coalesce(self):
+        url = reverse('project-ai-search-async')
+        queries = ['campo en Osorno', 'parcela en Pucón', 'terreno en Chiloé'] * 2
+        started = time.monotonic()
+        responses = await asyncio.gather(*[
+            self.async_client.post(url, {'query': q}, content_type='application/json') for q in queries
+        ])
+        elapsed = time.monotonic() - started
+
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertEqual({r.json()['assistant_message'] for r in responses}, {'Hola'})
+        self.assertEqual(sorted(r['X-AI-Search-Cache'] for r in responses), ['coalesced'] * 3 + ['miss'] * 3)
+        self.assertEqual(len(self.stub.calls), 3)
+        self.assertLess(elapsed, 3 * 0.3)
+        self.assertEqual(await AIUsageLog.objects.filter(success=True).acount(), 3)
+
+
+class PilotShortlistTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username='matching-owner', password='password123')
+        prop = Property.objects.create(owner=owner, name='Campo Puerto Varas', price=1000, size=10,
+                                       description='Campo', latitude=-41.3195, longitude=-72.9854)
+        self.job = Job.objects.create(property=prop)
+
+    def _pilot(self, name, lat, lon, rating='5.00', expires_at=None):
+        user = User.objects.create_user(username=name, password='password123')
+        pilot = PilotProfile.objects.create(user=user, display_name=name, status='approved', is_available=True,
+                                            rating=Decimal(rating), location_latitude=lat, location_longitude=lon)
+        for doc_type in PilotProfile.REQUIRED_DOCUMENT_TYPES:
+            PilotDocument.objects.create(pilot=pilot, doc_type=doc_type, file='pilot_documents/x.pdf', status='approved',
+                                         expires_at=expires_at if doc_type == 'insurance' else None)
+        pilot.update_compliance_status()
+        return pilot
+
+    def test_only_pilots_near_the_property_are_loaded_and_ranked(self):
+        near = self._pilot('near', -41.35, -72.95, rating='4.00')         # ~4,6 km
+        nearer = self._pilot('nearer', -41.32, -72.99, rating='4.90')     # <1 km
+        self._pilot('wave2', -41.45, -72.98)                              # ~14,5 km
+        self._pilot('corner', -41.39, -73.08)                             # dentro de la caja de 10 km, fuera del círculo
+        for i in range(5):
+            self._pilot(f'santiago{i}', -33.45, -70.66)
+
+        with CaptureQueriesContext(connection) as queries:
+            shortlist = shortlist_pilots(self.job, wave=1)
+
+        self.assertEqual([pilot for pilot, _, _ in shortlist], [nearer, near])
+        self.assertLess(shortlist[1][1], 10)
+        sql = [q['sql'] for q in queries.captured_queries]
+        self.assertFalse(any('COUNT(' in q for q in sql))
+        pilot_select = next(q for q in sql if 'FROM "properties_pilotprofile"' in q)
+        self.assertIn('BETWEEN', pilot_select)
+        self.assertFalse(any('properties_pilotdocument' in q for q in sql))
+        self.assertEqual({p.display_name for p, _, _ in shortlist_pilots(self.job, wave=2)}, {'nearer', 'near', 'corner', 'wave2'})
+
+    def test_bounding_box_contains_the_radius(self):
+        lat_min, lat_max, lon_min, lon_max = bounding_box(-41.3, -72.98, 50)
+        for lat, lon in ((lat_min, -72.98), (lat_max, -72.98), (-41.3, lon_min), (-41.3, lon_max)):
+            self.assertGreaterEqual(haversine_distance_km(-41.3, -72.98, lat, lon), 49.9)
+        self.assertEqual(bounding_box(89.9, 0, 50)[2:], (-180.0, 180.0))
+
+    def test_document_delete_and_admin_review_refresh_eligibility(self):
+        pilot = self._pilot('reviewed', -41.32, -72.99)
+        self.assertTrue(PilotProfile.objects.get(pk=pilot.pk).is_operational)
+
+        # Rechazo desde el admin (guardado directo del modelo)
+        insurance = pilot.documents.get(doc_type='insurance')
+        insurance.status = 'rejected'
+        insurance.save()
+        self.assertFalse(PilotProfile.objects.get(pk=pilot.pk).is_operational)
+        insurance.status = 'approved'
+        insurance.save()
+        self.assertTrue(PilotProfile.objects.get(pk=pilot.pk).is_operational)
+
+        # Borrado por la API
+        client = APIClient()
+        client.force_authenticate(pilot.user)
+        response = client.delete(reverse('pilotdocument-detail', kwargs={'pk': insurance.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        refreshed = PilotProfile.objects.get(pk=pilot.pk)
+        self.assertFalse(refreshed.is_operational)
+        self.assertEqual(refreshed.status, 'pending')
+        self.assertNotIn(refreshed, [p for p, _, _ in shortlist_pilots(self.job, wave=1)])
+
+    def test_daily_sweep_expires_documents_and_eligibility(self):
+        today = timezone.localdate()
+        expiring = self._pilot('expiring', -41.32, -72.99, expires_at=today)
+        self.assertTrue(expiring.is_operational)
+        self.assertEqual(expiring.operational_until, today)
+
+        # Al día siguiente, antes del barrido, el matching ya lo excluye por la fecha
+        with mock.patch('properties.matching.timezone.localdate', return_value=today + timedelta(days=1)):
+            self.assertEqual(shortlist_pilots(self.job, wave=1), [])
+
+        stats = sweep_pilot_compliance(today=today + timedelta(days=1))
+        expiring.refresh_from_db()
+        self.assertEqual(stats['expired_documents'], 1)
+        self.assertEqual(stats['pilots_changed'], 1)
+        self.assertFalse(expiring.is_operational)
+        self.assertEqual(expiring.status, 'pending')
+        self.assertEqual(expiring.documents.get(doc_type='insurance').status, 'expired')
+        self.assertEqual(sweep_pilot_compliance(today=today + timedelta(days=1))['pilots_checked'], 0)
+
+
+class OfferSweeperTests(APITestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username='sweeper-owner', password='password123')
+        prop = Property.objects.create(owner=owner, name='Campo Puerto Varas', price=1000, size=10,
+                                       description='Campo', latitude=-41.3195, longitude=-72.9854)
+        self.job = Job.objects.create(property=prop)
+        self.first = self._pilot('first', -41.32, -72.99)
+        self.second = self._pilot('second', -41.45, -72.98)  # ~14,5 km: solo entra en la ola 2
+        patcher = mock.patch('properties.matching._get_notification_service', return_value=lambda offers: len(offers))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.job.send_invite_wave()
+        self.offer = self.job.offers.get()
+        JobOffer.objects.filter(pk=self.offer.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def _pilot(self, name, lat, lon):
+        user = User.objects.create_user(username=name, password='password123')
+        pilot = PilotProfile.objects.create(user=user, display_name=name, status='approved', is_available=True,
+                                            location_latitude=lat, location_longitude=lon)
+        for doc_type in PilotProfile.REQUIRED_DOCUMENT_TYPES:
+            PilotDocument.objects.create(pilot=pilot, doc_type=doc_type, file='pilot_documents/x.pdf', status='approved')
+        pilot.update_compliance_status()
+        return pilot
+
+    def test_reads_do_not_expire_offers_or_send_waves(self):
+        self.client.force_authenticate(self.first.user)
+        with CaptureQueriesContext(connection) as queries:
+            inbox = self.client.get(reverse('job-available'))
+            detail = self.client.get(reverse('job-detail', kwargs={'pk': self.job.pk}))
+
+        self.assertEqual(inbox.status_code, 200)
+        self.assertEqual(inbox.data, [])
+        self.assertEqual(detail.data['offers'][0]['status'], 'expired')
+        writes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(JobOffer.objects.get(pk=self.offer.pk).status, 'pending')
+        with self.assertRaises(ValidationError):
+            JobOffer.objects.get(pk=self.offer.pk).accept()
+
+    def test_sweeper_expires_in_bulk_and_sends_next_wave_once(self):
+        stats = sweep_expired_offers()
+
+        self.assertEqual(stats, {'expired': 1, 'jobs': 1, 'waves_sent': 1})
+        self.assertEqual(JobOffer.objects.get(pk=self.offer.pk).status, 'expired')
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.invite_wave, 2)
+        self.assertEqual(self.job.offers.get(status='pending').pilot, self.second)
+        self.assertEqual(sweep_expired_offers(), {'expired': 0, 'jobs': 0, 'waves_sent': 0})
+
+    def test_interrupted_pass_is_healed_by_the_next_sweep(self):
+        # Un pase anterior venció las ofertas pero murió antes de enviar la ola siguiente
+        JobOffer.objects.filter(pk=self.offer.pk).update(status='expired')
+
+        self.assertEqual(sweep_expired_offers(), {'expired': 0, 'jobs': 0, 'waves_sent': 1})
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.invite_wave, 2)
+
+        # Ola 3 sin candidatos: queda intentada y el barrido no la repite
+        self.job.offers.filter(status='pending').update(expires_at=timezone.now() - timedelta(seconds=1))
+        with mock.patch('properties.matching.shortlist_pilots', return_value=[]):
+            self.assertEqual(sweep_expired_offers()['waves_sent'], 1)
+            self.assertEqual(sweep_expired_offers(), {'expired': 0, 'jobs': 0, 'waves_sent': 0})
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.invite_wave, 3)
+        self.assertEqual(len(self.job.property.workflow_alerts), 2)
+
+
+class InviteWaveDispatchTests(TestCase):
+    def test_statements_per_wave_do_not_grow_with_candidates(self):
+        one = measure_wave_statements(1, prefix='bench-one')
+        five = measure_wave_statements(5, prefix='bench-five')
+
+        self.assertEqual((one['offers'], five['offers']), (1, 5))
+        self.assertEqual(one['statements'], five['statements'])
+        self.assertLessEqual(five['statements'], 10)
+        self.assertFalse(Job.objects.exists())  # el benchmark no deja datos
+
+    @override_settings(JOB_OFFER_NOTIFICATIONS_ASYNC=False)
+    def test_wave_writes_offers_in_bulk_and_notifies_after_commit(self):
+        owner = User.objects.create_user(username='wave-owner', password='password123')
+        prop = Property.objects.create(owner=owner, name='Campo Frutillar', price=1000, size=10,
+                                       description='Campo', latitude=-41.12, longitude=-73.05)
+        job = Job.objects.create(property=prop)
+        pilots = []
+        for i in range(3):
+            user = User.objects.create_user(username=f'wave-pilot-{i}', password='password123')
+            pilot = PilotProfile.objects.create(user=user, status='approved', is_available=True,
+                                                location_latitude=-41.12, location_longitude=-73.05 + 0.01 * i)
+            for doc_type in PilotProfile.REQUIRED_DOCUMENT_TYPES:
+                PilotDocument.objects.create(pilot=pilot, doc_type=doc_type, file='pilot_documents/x.pdf', status='approved')
+            pilot.update_compliance_status()
+            PilotDevice.objects.create(pilot=pilot, device_token=f'token-{i}' * 4, device_type='android')
+            pilots.append(pilot)
+        # Un piloto ya invitado (p. ej. a mano) no se duplica ni rompe la ola
+        JobOffer.objects.create(job=job, pilot=pilots[0], wave=0)
+
+        with mock.patch('properties.notification_service.send_job_offer_notification', return_value=True) as notify:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                offers = send_wave(job, 1)
+            notify.assert_not_called()
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual({offer.pilot for offer in offers}, set(pilots[1:]))
+        self.assertEqual(notify.call_count, 2)
+        job.refresh_from_db()
+        prop.refresh_from_db()
+        self.assertEqual((job.status, job.invite_wave), ('inviting', 1))
+        self.assertEqual(prop.workflow_substate, 'inviting')
+        event = JobTimelineEvent.objects.get(job=job, kind='invite_wave_1')
+        self.assertEqual(sorted(event.metadata['offer_ids']), sorted(offer.id for offer in offers))
@@ -1,3 +1,8 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import viewsets, filters, permissions, status, serializers
 from rest_framework.authentication import TokenAuthentication
@@ -53,6 +58,7 @@ from .models import (
     Job,
     JobOffer,
     JobTimelineEvent,
+    PlusvaliaRecomputeTask,
     WORKFLOW_NODE_ORDER,
     WORKFLOW_NODE_LABELS,
     WORKFLOW_SUBSTATE_DEFINITIONS,
@@ -79,8 +85,15 @@ from .serializers import (
     JobSerializer,
     JobOfferSerializer,
 )
-from skyterra_backend.permissions import IsOwnerOrAdmin
+from skyterra_backend.permissions import HasActiveSubscription, IsOwnerOrAdmin
+from .ai_categorization import categorize_properties
+from .gazetteer import answer_location_query
 from .services import GeminiService, GeminiServiceError, categorize_property_with_ai, create_fallback_response_simple
+from .plusvalia_queue import enqueue_plusvalia_recompute
+from .plusvalia_memo import get_memo_stats
+from .plusvalia_distribution import mark_distribution_stale, property_percentiles
+from .ai_search_cache import acached_search, bump_catalog_version, cached_search, get_cached_response, store_response
+from ai_management.llm_transport import llm_deadline
 from .email_service import send_property_status_email, send_recording_order_created_email, send_recording_order_status_email
 
 # Create your views here.
@@ -179,6 +192,8 @@ def invalidate_property_cache():
     """
     # Obtener todas las claves que empiecen con 'properties:'
     cache_keys = cache.keys('properties:*') if hasattr(cache, 'keys') else []
+    # Las cargas masivas (bulk_update) no emiten post_save: invalidar también la búsqueda IA
+    bump_catalog_version()
 
     if cache_keys:
         cache.delete_many(cache_keys)
@@ -275,7 +290,8 @@ class PropertyViewSet(viewsets.ModelViewSet):
     pagination_class = StandardResultsSetPagination
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
-    ordering_fields = ['price', 'size', 'created_at', 'plusvalia_score']
+    ordering_fields = ['price', 'size', 'created_at', 'plusvalia_score',
+                       'distance_to_city_km', 'distance_to_airport_km', 'distance_to_port_km']
 
     def get_permissions(self):
         """
@@ -286,6 +302,8 @@ class PropertyViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.AllowAny]
         elif self.action == 'create':
             permission_classes = [permissions.IsAuthenticated]
+        elif self.action == 'plusvalia_percentile':
+            permission_classes = [HasActiveSubscription]
         else: # For update, partial_update, destroy, etc.
             permission_classes = [IsOwnerOrAdmin]
         return [permission() for permission in permission_classes]
@@ -302,6 +320,15 @@ class PropertyViewSet(viewsets.ModelViewSet):
         """
         queryset = super().get_queryset()
 
+        if self.action == 'plusvalia_percentile':
+            # Solo entran en la distribución las aprobadas; el dueño y staff ven también las propias
+            visible = Q(publication_status='approved')
+            if self.request.user.is_staff:
+                visible = Q()
+            elif self.request.user.is_authenticated:
+                visible |= Q(owner=self.request.user)
+            return queryset.filter(visible).only('id', 'owner_id', 'type', 'address_region', 'plusvalia_score')
+
         # Optimizaciones de base de datos para evitar N+1 queries
         # Prefetch todas las relaciones necesarias en una sola consulta
         queryset = queryset.select_related(
@@ -360,14 +387,29 @@ class PropertyViewSet(viewsets.ModelViewSet):
         # if not self.request.user.is_staff:
         #     queryset = queryset.filter(publication_status='approved')
 
-        # Sin filtros de rango ni booleanos: Sam decide internamente
+        # Sin filtros de rango ni booleanos: Sam decide internamente.
+        # Excepción: distancia máxima a centros de referencia (campos precalculados).
+        for param, field in (
+            ('max_city_km', 'distance_to_city_km'),
+            ('max_airport_km', 'distance_to_airport_km'),
+            ('max_port_km', 'distance_to_port_km'),
+        ):
+            raw_value = self.request.query_params.get(param)
+            if raw_value:
+                try:
+                    queryset = queryset.filter(**{f'{field}__lte': float(raw_value)})
+                except ValueError:
+                    pass
 
         # Optimización adicional: ordenar por campos indexados cuando sea posible
         ordering = self.request.query_params.get('ordering', '-created_at')
         if ordering in ['-created_at', 'created_at', '-updated_at', 'updated_at']:
             # Estos campos tienen índices naturales, usarlos directamente
             queryset = queryset.order_by(ordering)
-        elif ordering in ['price', '-price', 'size', '-size']:
+        elif ordering in ['price', '-price', 'size', '-size',
+                          'distance_to_city_km', '-distance_to_city_km',
+                          'distance_to_airport_km', '-distance_to_airport_km',
+                          'distance_to_port_km', '-distance_to_port_km']:
             # Campos que pueden beneficiarse de índices compuestos
             queryset = queryset.order_by(ordering, '-created_at')  # Fallback para estabilidad
 
@@ -584,14 +626,28 @@ class PropertyViewSet(viewsets.ModelViewSet):
             )
 
         try:
+            previous_status = property_instance.publication_status
             property_instance.publication_status = new_status
             property_instance.save(update_fields=['publication_status', 'updated_at'])
+            if 'approved' in (previous_status, new_status) and previous_status != new_status:
+                mark_distribution_stale()
 
             # Si se aprueba la propiedad, cambiar el workflow_substate para activar creación de job
             if new_status == 'approved' and property_instance.workflow_substate not in ['approved_for_shoot', 'inviting', 'assigned']:
                 property_instance.transition_to('approved_for_shoot', actor=request.user,
                     message='Propiedad aprobada - iniciando búsqueda de piloto', commit=True)
 
+            # La aprobación afecta el puntaje: recalcular con prioridad de publicación nueva
+            if new_status == 'approved':
+                try:
+                    enqueue_plusvalia_recompute(
+                        property_instance,
+                        priority=PlusvaliaRecomputeTask.PRIORITY_PUBLISHED,
+                        reason='published',
+                    )
+                except Exception:
+                    logger.warning(f"No se pudo encolar plusvalía para propiedad {property_instance.id}")
+
             # Notificar al dueño del cambio de estado
             try:
                 send_property_status_email(property_instance)
@@ -627,6 +683,37 @@ class PropertyViewSet(viewsets.ModelViewSet):
 
         return Response({'detail': 'Propiedad enriquecida', **data}, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['post'], url_path='ai-categorize-batch', permission_classes=[permissions.IsAdminUser])
+    def ai_categorize_batch(self, request):
+        """Categorización/resumen IA de varias propiedades: lotes por prompt y llamadas concurrentes."""
+        ids = request.data.get('ids')
+        try:
+            ids = [int(pid) for pid in ids] if isinstance(ids, list) else []
+        except (TypeError, ValueError):
+            ids = []
+        if not ids or len(ids) > 500:
+            return Response({'detail': 'Envía "ids" como lista de 1 a 500 IDs de propiedades.'}, status=status.HTTP_400_BAD_REQUEST)
+        stats = categorize_properties(Property.objects.filter(id__in=ids), force=bool(request.data.get('force')))
+        if stats['updated']:
+            invalidate_property_cache()
+        return Response(stats, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='plusvalia-percentile', permission_classes=[HasActiveSubscription])
+    def plusvalia_percentile(self, request, pk=None):
+        """Percentil e histograma del puntaje de plusvalía (global, región y tipo). Función Pro.
+
+        Usa la distribución precalculada: cada percentil es una búsqueda binaria.
+        """
+        prop = self.get_object()
+        if prop.plusvalia_score is None:
+            return Response({'detail': 'La propiedad aún no tiene puntaje de plusvalía.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(property_percentiles(prop))
+
+    @action(detail=False, methods=['get'], url_path='plusvalia-memo-stats', permission_classes=[permissions.IsAdminUser])
+    def plusvalia_memo_stats(self, request):
+        """Métricas de acierto de la memo de evaluaciones IA de plusvalía."""
+        return Response(get_memo_stats())
+
     def perform_destroy(self, instance):
         """Restringir eliminación a staff; bloquear para clientes."""
         if not self.request.user.is_staff:
@@ -1199,21 +1286,29 @@ class AISearchView(APIView):
                 return Response({'error': 'Query is required'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Optional conversation context provided by the frontend
-            conversation_history = request.data.get('conversation_history', [])
-            if isinstance(conversation_history, str):
-                try:
-                    conversation_history = json.loads(conversation_history)
-                except json.JSONDecodeError:
-                    conversation_history = []
-            if not isinstance(conversation_history, list):
-                conversation_history = []
+            conversation_history = _parse_conversation_history(request.data)
+
+            # Consultas que son solo un lugar conocido (sin historial) se responden sin llamar a Sam
+            location = answer_location_query(query, conversation_history)
+            if location is not None:
+                response = Response(location, status=status.HTTP_200_OK)
+                response['X-AI-Search-Cache'] = 'gazetteer'
+                return response
+
+            # Consultas equivalentes (misma forma normalizada, catálogo y conversación)
+            # comparten respuesta; las concurrentes esperan a una sola llamada a Sam
+            def run_search():
+                gemini_service = GeminiService()
+                return gemini_service.search_properties_with_ai(query, conversation_history)
 
-            # Use the GeminiService to process the natural-language query and build the response
-            gemini_service = GeminiService()
-            ai_response = gemini_service.search_properties_with_ai(query, conversation_history)
+            # Todas las llamadas a Gemini de esta solicitud comparten un mismo plazo
+            with llm_deadline(getattr(settings, 'SAM_REQUEST_DEADLINE_SECONDS', 25)):
+                ai_response, cache_source = cached_search(query, conversation_history, run_search)
 
             # The AI helper already returns the expected JSON structure for the frontend
-            return Response(ai_response, status=status.HTTP_200_OK)
+            response = Response(ai_response, status=status.HTTP_200_OK)
+            response['X-AI-Search-Cache'] = cache_source
+            return response
         except GeminiServiceError as e:
             # Fallback: si no hay API key o falla el proveedor, devolver recomendaciones básicas
             try:
@@ -1234,6 +1329,149 @@ class AISearchView(APIView):
         logger.debug("AISearchView GET reached; advise to use POST for AI search")
         return Response({"message": "Use POST for AI search. Include 'current_query' and 'conversation_history'."}, status=status.HTTP_200_OK)
 
+def _parse_conversation_history(data):
+    conversation_history = data.get('conversation_history', [])
+    if isinstance(conversation_history, str):
+        try:
+            conversation_history = json.loads(conversation_history)
+        except json.JSONDecodeError:
+            conversation_history = []
+    return conversation_history if isinstance(conversation_history, list) else []
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+
+async def _aiter_in_thread(make_iterator):
+    """Recorre un generador síncrono en un hilo y entrega cada elemento apenas sale.
+
+    Bajo ASGI, Django 4.2 consume un `StreamingHttpResponse` síncrono con
+    `sync_to_async(list)`, es decir, acumula todo el stream antes de enviarlo.
+    Con este puente el generador completo corre en un solo hilo (mismo
+    contexto para `llm_deadline`) y cada fragmento cruza al event loop por una
+    cola.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for item in make_iterator():
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = asyncio.ensure_future(sync_to_async(produce, thread_sensitive=False)())
+    while True:
+        item = await queue.get()
+        if item is done:
+            break
+        yield item
+    await producer  # propagar errores del generador
+
+
+class AISearchStreamView(APIView):
+    """Búsqueda IA por Server-Sent Events.
+
+    Emite `delta` con fragmentos del `assistant_message` mientras Gemini
+    responde, luego un `result` con la respuesta completa (la misma de
+    `AISearchView`, incluidas las recomendaciones) y finalmente `done`.
+    Una consulta ya cacheada, o que es solo un lugar del nomenclátor, responde
+    solo con `result`. Funciona igual bajo WSGI y ASGI (ver `_aiter_in_thread`).
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        query = request.data.get('query') or request.data.get('current_query') or ''
+        if not query:
+            return Response({'error': 'Query is required'}, status=status.HTTP_400_BAD_REQUEST)
+        conversation_history = _parse_conversation_history(request.data)
+
+        def events():
+            location = answer_location_query(query, conversation_history)
+            if location is not None:
+                yield _sse('result', location)
+                yield _sse('done', {'cache': 'gazetteer'})
+                return
+            cached = get_cached_response(query, conversation_history)
+            if cached is not None:
+                yield _sse('result', cached)
+                yield _sse('done', {'cache': 'hit'})
+                return
+            with llm_deadline(getattr(settings, 'SAM_REQUEST_DEADLINE_SECONDS', 25)):
+                try:
+                    for item in GeminiService().stream_search_with_ai(query, conversation_history):
+                        if item['event'] == 'delta':
+                            yield _sse('delta', {'text': item['text']})
+                        else:
+                            store_response(query, conversation_history, item['data'])
+                            yield _sse('result', item['data'])
+                except Exception as e:
+                    if not isinstance(e, GeminiServiceError):
+                        logger.error(f'Error in AISearchStreamView: {str(e)}', exc_info=True)
+                    yield _sse('result', create_fallback_response_simple(query))
+            yield _sse('done', {'cache': 'miss'})
+
+        # Bajo ASGI un iterador síncrono se enviaría de una sola vez al final
+        stream = _aiter_in_thread(events) if isinstance(request._request, ASGIRequest) else events()
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx: no acumular el stream
+        return response
+
+
+async def ai_search_async(request):
+    """Versión async (ASGI) de `AISearchView`, con el mismo contrato JSON.
+
+    Bajo `skyterra_backend.asgi` cada búsqueda en espera de Gemini es una
+    corrutina, no un worker ocupado. Como la vista DRF, no exige autenticación.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"message": "Use POST for AI search. Include 'current_query' and 'conversation_history'."})
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    query = data.get('query') or data.get('current_query') or ''
+    if not query:
+        return JsonResponse({'error': 'Query is required'}, status=status.HTTP_400_BAD_REQUEST)
+    conversation_history = _parse_conversation_history(data)
+
+    location = answer_location_query(query, conversation_history)  # en memoria: no bloquea el event loop
+    if location is not None:
+        response = JsonResponse(location)
+        response['X-AI-Search-Cache'] = 'gazetteer'
+        return response
+
+    async def run_search():
+        gemini_service = GeminiService()
+        return await gemini_service.asearch_properties_with_ai(query, conversation_history)
+
+    try:
+        with llm_deadline(getattr(settings, 'SAM_REQUEST_DEADLINE_SECONDS', 25)):
+            ai_response, cache_source = await acached_search(query, conversation_history, run_search)
+    except Exception as e:
+        if not isinstance(e, GeminiServiceError):
+            logger.error(f'Error in ai_search_async: {str(e)}', exc_info=True)
+        try:
+            fallback = await sync_to_async(create_fallback_response_simple)(query)
+        except Exception:
+            return JsonResponse({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return JsonResponse(fallback)
+    response = JsonResponse(ai_response, safe=False)
+    response['X-AI-Search-Cache'] = cache_source
+    return response
+
+
+# En Django 4.2 el decorador csrf_exempt no envuelve vistas async; basta el atributo
+ai_search_async.csrf_exempt = True
+
+
 class PropertyDocumentViewSet(viewsets.ModelViewSet):
     """Viewset to manage property documents (upload, list, delete)."""
     queryset = PropertyDocument.objects.all().order_by('-uploaded_at')
@@ -1432,23 +1670,21 @@ class PilotDocumentViewSet(viewsets.ModelViewSet):
         pilot_profile = getattr(self.request.user, 'pilot_profile', None)
         if not pilot_profile:
             raise PermissionDenied('Solo operadores pueden subir documentos.')
-        document = serializer.save(pilot=pilot_profile, status='pending', reviewed_by=None, reviewed_at=None)
-        pilot = PilotProfile.objects.prefetch_related('documents').get(pk=document.pilot_id)
-        pilot.update_compliance_status()
+        # La elegibilidad del piloto se recalcula en la señal post_save de PilotDocument
+        serializer.save(pilot=pilot_profile, status='pending', reviewed_by=None, reviewed_at=None)
 
     def perform_update(self, serializer):
         user = self.request.user
         pilot_profile = getattr(user, 'pilot_profile', None)
-        document = None
         if user.is_staff:
             status_value = serializer.validated_data.get('status', serializer.instance.status)
-            document = serializer.save(
+            serializer.save(
                 status=status_value,
                 reviewed_by=user,
                 reviewed_at=timezone.now(),
             )
         elif pilot_profile:
-            document = serializer.save(
+            serializer.save(
                 pilot=pilot_profile,
                 status='pending',
                 reviewed_by=None,
@@ -1457,9 +1693,6 @@ class PilotDocumentViewSet(viewsets.ModelViewSet):
         else:
             raise PermissionDenied('No autorizado.')
 
-        pilot = PilotProfile.objects.prefetch_related('documents').get(pk=document.pilot_id)
-        pilot.update_compliance_status()
-
 
 class JobViewSet(viewsets.ModelViewSet):
     """Gestión de trabajos operativos."""
@@ -1544,19 +1777,18 @@ class JobViewSet(viewsets.ModelViewSet):
 
         logger.info(f"Found {all_pilot_jobs.count()} total jobs for pilot")
 
-        # Filter to only pending offers
+        # Filter to only pending offers that have not expired yet (the sweeper
+        # `sweep_job_offers` marks them expired and sends the next wave; reads never write)
+        now = timezone.now()
         qs = all_pilot_jobs.filter(
+            Q(offers__expires_at__isnull=True) | Q(offers__expires_at__gte=now),
             offers__pilot=pilot_profile,
-            offers__status='pending'
+            offers__status='pending',
         ).distinct()
 
         logger.info(f"Found {qs.count()} jobs with pending offers")
 
-        job_list = list(qs)
-        for job in job_list:
-            job.expire_pending_offers(auto=True)
-
-        serializer = self.get_serializer(job_list, many=True)
+        serializer = self.get_serializer(list(qs), many=True)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'], url_path='debug', permission_classes=[permissions.IsAuthenticated])
@@ -1624,12 +1856,6 @@ class JobViewSet(viewsets.ModelViewSet):
             }
         })
 
-    def retrieve(self, request, *args, **kwargs):
-        job = self.get_object()
-        job.expire_pending_offers(auto=True)
-        serializer = self.get_serializer(job)
-        return Response(serializer.data)
-
     @action(detail=True, methods=['post'], url_path='schedule', permission_classes=[permissions.IsAuthenticated])
     def schedule(self, request, pk=None):
         job = self.get_object()
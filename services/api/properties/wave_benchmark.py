@@ -0,0 +1,60 @@
+"""Statements SQL por ola de invitación (`manage.py benchmark_invite_wave`).
+
+Crea una propiedad, un trabajo y N pilotos elegibles dentro de una
+transacción que se revierte al final, envía la primera ola con
+`matching.send_wave` y cuenta los statements ejecutados. El envío de una ola
+no debe crecer con la cantidad de pilotos invitados.
+"""
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .matching import MATCHING_DEFAULTS, send_wave
+from .models import Job, PilotDocument, PilotProfile, Property
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _seed(pilots: int, prefix: str):
+    User = get_user_model()
+    owner = User.objects.create_user(username=f'{prefix}-owner', password=None)
+    prop = Property.objects.create(owner=owner, name=f'{prefix} campo', price=1000, size=10,
+                                   description='Benchmark', latitude=-41.3195, longitude=-72.9854)
+    job = Job.objects.create(property=prop)
+    for i in range(pilots):
+        user = User.objects.create_user(username=f'{prefix}-pilot-{i}', password=None)
+        pilot = PilotProfile.objects.create(user=user, status='approved', is_available=True,
+                                            location_latitude=-41.3195 + 0.001 * i, location_longitude=-72.9854)
+        PilotDocument.objects.bulk_create([
+            PilotDocument(pilot=pilot, doc_type=doc_type, file='pilot_documents/benchmark.pdf', status='approved')
+            for doc_type in PilotProfile.REQUIRED_DOCUMENT_TYPES
+        ])
+        pilot.update_compliance_status()
+    return job
+
+
+def measure_wave_statements(pilots: int, prefix: str = 'wave-benchmark') -> dict:
+    """Envía una ola a `pilots` candidatos y devuelve los statements usados (sin dejar datos)."""
+    result = {}
+    try:
+        with transaction.atomic():
+            job = Job.objects.select_related('property').get(pk=_seed(pilots, prefix).pk)
+            with CaptureQueriesContext(connection) as queries:
+                offers = send_wave(job, 1)
+            sql = [q['sql'] for q in queries.captured_queries]
+            result = {
+                'pilots': pilots,
+                'offers': len(offers),
+                'statements': len(sql),
+                'writes': sum(1 for q in sql if q.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))),
+            }
+            raise _Rollback
+    except _Rollback:
+        pass
+    return result
+
+
+def run_benchmark(sizes=(1, MATCHING_DEFAULTS['invite_count'])) -> list:
+    return [measure_wave_statements(size, prefix=f'wave-benchmark-{size}') for size in sizes]
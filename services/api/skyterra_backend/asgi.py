@@ -2,6 +2,10 @@
 ASGI config for skyterra_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with ``gunicorn skyterra_backend.asgi:application -k uvicorn.workers.UvicornWorker``
+to serve the async AI endpoints (``/api/ai-search/async/``) without pinning workers.
+The SSE endpoint (``/api/ai-search/stream/``) streams fragment by fragment under
+both WSGI and ASGI.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -0,0 +1,33 @@
+"""Contadores de métricas en la caché compartida de Django.
+
+Los usan las estadísticas de enrutamiento de Sam, presupuesto de tokens,
+caché de búsqueda IA y memo de plusvalía. `cache.add(key, 0)` + `cache.incr`
+es atómico en Redis/Memcached y funciona con cualquier backend; un fallo de la
+caché nunca debe romper la operación que se está midiendo, así que se ignora.
+"""
+from django.core.cache import cache
+
+
+def incr_counter(key: str, delta: int = 1):
+    """Suma `delta` al contador `key` (lo crea en 0 sin expiración si no existe)."""
+    if not delta:
+        return
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
+    except Exception:
+        pass
+
+
+def read_counters(prefix: str, names) -> dict:
+    """`{nombre: valor}` de los contadores `<prefix>:<nombre>` con un solo `get_many`."""
+    keys = {f"{prefix}:{name}": name for name in names}
+    try:
+        values = cache.get_many(list(keys))
+    except Exception:
+        values = {}
+    return {name: int(values.get(key) or 0) for key, name in keys.items()}
+
+
+def reset_counters(prefix: str, names):
+    cache.delete_many([f"{prefix}:{name}" for name in names])
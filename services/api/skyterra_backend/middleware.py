@@ -0,0 +1,37 @@
+"""Middleware propio del proyecto."""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise que también acepta la cadena async de ASGI.
+
+    WhiteNoise 6.7 solo es síncrono: Django adapta toda la cadena que queda
+    debajo y cada vista async termina ejecutándose en el único hilo
+    "thread-sensitive", en serie. Aquí solo la entrega de archivos estáticos
+    pasa por un hilo; el resto de las solicitudes sigue async. Bajo WSGI se
+    comporta exactamente como `WhiteNoiseMiddleware`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
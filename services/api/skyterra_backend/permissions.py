@@ -13,3 +13,21 @@ class IsOwnerOrAdmin(permissions.BasePermission):
 
         # Write permissions are only allowed to the owner of the property or an admin user.
         return obj.owner == request.user or request.user.is_staff
+
+
+class HasActiveSubscription(permissions.BasePermission):
+    """
+    Allows access to staff and to users whose subscription is active or trialing
+    (the same states SubscriptionSerializer reports as is_active).
+    """
+    message = 'Esta función requiere una suscripción activa.'
+    ACTIVE_STATUSES = ('active', 'trialing')
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not user or not user.is_authenticated:
+            return False
+        if user.is_staff:
+            return True
+        subscription = getattr(user, 'subscription', None)
+        return bool(subscription and subscription.status in self.ACTIVE_STATUSES)
@@ -0,0 +1,81 @@
+"""Piezas de resiliencia compartidas por las integraciones externas.
+
+Las usan tanto `properties.external_market_service` (ClearCapital) como
+`ai_management.llm_transport` (Gemini); viven aquí para que ninguna app
+dependa de la otra.
+"""
+import threading
+import time
+from typing import Optional
+
+
+class CircuitBreaker:
+    """Circuit breaker mínimo y thread-safe.
+
+    Tras `failure_threshold` fallos consecutivos se abre y rechaza llamadas
+    durante `reset_timeout` segundos; luego deja pasar una sola llamada de
+    prueba (half-open) y se cierra si tiene éxito o vuelve a abrirse si falla.
+    Mientras la prueba está en curso el resto de las llamadas se rechaza; si
+    la prueba no informa resultado en `reset_timeout` segundos se permite otra.
+
+    `allow()` reserva el permiso de llamar (y la prueba, si corresponde);
+    `would_allow()` solo consulta, para decidir sin consumir la prueba.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if now - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def _probe_in_flight(self, now: float) -> bool:
+        return self._probe_started_at is not None and now - self._probe_started_at < self.reset_timeout
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def would_allow(self) -> bool:
+        """¿Se permitiría una llamada ahora? No reserva la llamada de prueba."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            return state == 'closed' or (state == 'half_open' and not self._probe_in_flight(now))
+
+    def allow(self) -> bool:
+        """Permiso para hacer una llamada; en half-open solo lo obtiene un llamador."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == 'closed':
+                return True
+            if state == 'open' or self._probe_in_flight(now):
+                return False
+            self._probe_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_started_at = None
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
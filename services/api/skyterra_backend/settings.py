@@ -298,7 +298,7 @@ AUTHENTICATION_BACKENDS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'skyterra_backend.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise apto para ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.sites.middleware.CurrentSiteMiddleware',  # required for sites framework
     'django.middleware.common.CommonMiddleware',
@@ -555,6 +555,68 @@ google_gemini_api = os.getenv('GOOGLE_GEMINI_API_KEY')
 if not google_gemini_api and DEBUG:
     import logging; logging.warning('La variable de entorno GOOGLE_GEMINI_API_KEY no está configurada.')
 GOOGLE_GEMINI_API_KEY = google_gemini_api
+# Enrutamiento de modelos de Sam: TTL de veredictos del enrutador y umbrales de la heurística de chat
+SAM_ROUTER_CACHE_TTL = int(os.getenv('SAM_ROUTER_CACHE_TTL', str(60 * 60 * 24)))
+SAM_ROUTING_LITE_MAX_WORDS = int(os.getenv('SAM_ROUTING_LITE_MAX_WORDS', '8'))
+SAM_ROUTING_PRO_MIN_WORDS = int(os.getenv('SAM_ROUTING_PRO_MIN_WORDS', '250'))
+# Presupuesto de tokens del prompt de Sam: tope de entrada (acotado por AIModel.max_tokens - reserva de salida), largo por mensaje del historial y del resumen de turnos antiguos
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', '8000'))
+AI_PROMPT_OUTPUT_RESERVE = int(os.getenv('AI_PROMPT_OUTPUT_RESERVE', '2048'))
+AI_HISTORY_MESSAGE_MAX_TOKENS = int(os.getenv('AI_HISTORY_MESSAGE_MAX_TOKENS', '600'))
+AI_HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv('AI_HISTORY_SUMMARY_MAX_TOKENS', '150'))
+# Transporte HTTP hacia Gemini: URL base (permite apuntar al stub local), concurrencia, plazo por solicitud y circuit breaker
+GEMINI_API_BASE_URL = os.getenv('GEMINI_API_BASE_URL', 'https://generativelanguage.googleapis.com/v1beta')
+SAM_LLM_MAX_CONCURRENCY = int(os.getenv('SAM_LLM_MAX_CONCURRENCY', '8'))
+SAM_LLM_ASYNC_MAX_CONCURRENCY = int(os.getenv('SAM_LLM_ASYNC_MAX_CONCURRENCY', '200'))
+SAM_REQUEST_DEADLINE_SECONDS = float(os.getenv('SAM_REQUEST_DEADLINE_SECONDS', '25'))
+SAM_LLM_BREAKER_THRESHOLD = int(os.getenv('SAM_LLM_BREAKER_THRESHOLD', '5'))
+SAM_LLM_BREAKER_RESET_SECONDS = int(os.getenv('SAM_LLM_BREAKER_RESET_SECONDS', '30'))
+# AIUsageLog: escritura por lotes en segundo plano (False = un INSERT por llamada, dentro de la solicitud)
+AI_USAGE_LOG_BUFFERED = os.getenv('AI_USAGE_LOG_BUFFERED', 'True') == 'True'
+AI_USAGE_LOG_BATCH_SIZE = int(os.getenv('AI_USAGE_LOG_BATCH_SIZE', '200'))
+AI_USAGE_LOG_FLUSH_SECONDS = float(os.getenv('AI_USAGE_LOG_FLUSH_SECONDS', '2'))
+AI_USAGE_LOG_MAX_BUFFER = int(os.getenv('AI_USAGE_LOG_MAX_BUFFER', '10000'))
+# Caché de la búsqueda IA: TTL por modo de respuesta y espera máxima de solicitudes coalescidas
+AI_SEARCH_CACHE_TTL_LOCATION = int(os.getenv('AI_SEARCH_CACHE_TTL_LOCATION', str(60 * 60 * 24)))
+AI_SEARCH_CACHE_TTL_RECOMMENDATION = int(os.getenv('AI_SEARCH_CACHE_TTL_RECOMMENDATION', '300'))
+AI_SEARCH_COALESCE_WAIT_SECONDS = float(os.getenv('AI_SEARCH_COALESCE_WAIT_SECONDS', '20'))
+# Contexto de propiedades en los prompts de Sam: filas máximas, presupuesto de caracteres y largo de descripción
+PROMPT_CONTEXT_MAX_PROPERTIES = int(os.getenv('PROMPT_CONTEXT_MAX_PROPERTIES', '20'))
+PROMPT_CONTEXT_MAX_CHARS = int(os.getenv('PROMPT_CONTEXT_MAX_CHARS', '3000'))
+PROMPT_CONTEXT_DESCRIPTION_CHARS = int(os.getenv('PROMPT_CONTEXT_DESCRIPTION_CHARS', '80'))
+# Preselección local (BM25 + atributos) de las propiedades que entran al prompt de búsqueda IA
+AI_RETRIEVAL_TOP_K = int(os.getenv('AI_RETRIEVAL_TOP_K', '12'))
+AI_RETRIEVAL_MIN_RESULTS = int(os.getenv('AI_RETRIEVAL_MIN_RESULTS', '5'))
+# Consultas que son solo un lugar conocido se responden con el nomenclátor local, sin llamar a Sam
+AI_GAZETTEER_ENABLED = os.getenv('AI_GAZETTEER_ENABLED', 'True').lower() in ('true', '1', 't')
+# Categorización IA por lotes: propiedades por prompt, llamadas concurrentes y límite global por minuto
+AI_CATEGORIZATION_BATCH_SIZE = int(os.getenv('AI_CATEGORIZATION_BATCH_SIZE', '8'))
+AI_CATEGORIZATION_MAX_WORKERS = int(os.getenv('AI_CATEGORIZATION_MAX_WORKERS', '4'))
+AI_CATEGORIZATION_RATE_PER_MINUTE = float(os.getenv('AI_CATEGORIZATION_RATE_PER_MINUTE', '60'))
+
+# Plusvalía: el cálculo se encola y lo procesa `manage.py process_plusvalia_queue`
+PLUSVALIA_ASYNC_RECOMPUTE = os.getenv('PLUSVALIA_ASYNC_RECOMPUTE', 'True') == 'True'
+PLUSVALIA_QUEUE_MAX_ATTEMPTS = int(os.getenv('PLUSVALIA_QUEUE_MAX_ATTEMPTS', '5'))
+PLUSVALIA_QUEUE_BACKOFF_SECONDS = int(os.getenv('PLUSVALIA_QUEUE_BACKOFF_SECONDS', '30'))
+PLUSVALIA_QUEUE_LEASE_SECONDS = int(os.getenv('PLUSVALIA_QUEUE_LEASE_SECONDS', '600'))
+# Distribución de puntajes para percentiles: intervalo mínimo entre reconstrucciones y tamaño mínimo de segmento
+PLUSVALIA_DISTRIBUTION_REFRESH_SECONDS = int(os.getenv('PLUSVALIA_DISTRIBUTION_REFRESH_SECONDS', '300'))
+PLUSVALIA_DISTRIBUTION_MIN_SEGMENT = int(os.getenv('PLUSVALIA_DISTRIBUTION_MIN_SEGMENT', '5'))
+# Registro de factores: pool de hilos para factores de I/O, timeout por factor y umbral de log "lento"
+PLUSVALIA_FACTOR_MAX_WORKERS = int(os.getenv('PLUSVALIA_FACTOR_MAX_WORKERS', '8'))
+PLUSVALIA_FACTOR_TIMEOUT_SECONDS = float(os.getenv('PLUSVALIA_FACTOR_TIMEOUT_SECONDS', '5'))
+PLUSVALIA_FACTOR_SLOW_MS = int(os.getenv('PLUSVALIA_FACTOR_SLOW_MS', '1000'))
+
+# Olas de invitación a pilotos: notificaciones push en un pool de hilos tras el commit (False = en línea al confirmar)
+JOB_OFFER_NOTIFICATIONS_ASYNC = os.getenv('JOB_OFFER_NOTIFICATIONS_ASYNC', 'True') == 'True'
+JOB_OFFER_NOTIFICATION_WORKERS = int(os.getenv('JOB_OFFER_NOTIFICATION_WORKERS', '2'))
+
+# Datos de mercado externos (ClearCapital): celda de grilla para caché/consultas y circuit breaker
+CLEARCAPITAL_BASE_URL = os.getenv('CLEARCAPITAL_BASE_URL', 'https://api.clearcapital.com/v4/valuation')
+MARKET_DATA_CELL_SIZE_DEG = float(os.getenv('MARKET_DATA_CELL_SIZE_DEG', '0.05'))
+MARKET_DATA_TIMEOUT_SECONDS = float(os.getenv('MARKET_DATA_TIMEOUT_SECONDS', '5'))
+MARKET_DATA_BREAKER_THRESHOLD = int(os.getenv('MARKET_DATA_BREAKER_THRESHOLD', '5'))
+MARKET_DATA_BREAKER_RESET_SECONDS = int(os.getenv('MARKET_DATA_BREAKER_RESET_SECONDS', '60'))
 
 # Stripe
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from skyterra_backend.resilience import CircuitBreaker
+
+
+class CircuitBreakerTest(SimpleTestCase):
+
+    def _open_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        return breaker
+
+    def test_half_open_lets_exactly_one_probe_through(self):
+        breaker = self._open_breaker()
+        self.assertTrue(breaker.would_allow())  # consultar no reserva la prueba
+        start = threading.Barrier(10)
+        allowed = []
+
+        def caller():
+            start.wait()
+            allowed.append(breaker.allow())
+
+        threads = [threading.Thread(target=caller) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(allowed.count(True), 1)
+        self.assertFalse(breaker.would_allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(all(breaker.allow() for _ in range(3)))
+
+    def test_failed_probe_reopens_and_unreported_probe_expires(self):
+        breaker = self._open_breaker()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())  # prueba que nunca informa resultado
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
@@ -19,7 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.authtoken import views as token_views
-from properties.views import AISearchView
+from properties.views import AISearchStreamView, AISearchView, ai_search_async
 from django.http import JsonResponse
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 from allauth.socialaccount.providers.twitter.views import TwitterOAuthAdapter
@@ -49,6 +49,8 @@ def home_view(request):
             'api_tours': '/api/tours/',
             'api_images': '/api/images/',
             'ai_search': '/api/ai-search/',
+            'ai_search_stream': '/api/ai-search/stream/',
+            'ai_search_async': '/api/ai-search/async/',
             'auth_login': '/api/auth/login/',
             'auth_register': '/api/auth/register/'
         }
@@ -80,6 +82,8 @@ urlpatterns = [
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     path('api/ai-search/', AISearchView.as_view(), name='project-ai-search'),
+    path('api/ai-search/stream/', AISearchStreamView.as_view(), name='project-ai-search-stream'),
+    path('api/ai-search/async/', ai_search_async, name='project-ai-search-async'),
     path('api/auth/', include('dj_rest_auth.urls')),
     path('api/auth/csrf/', CSRFTokenView.as_view(), name='set-csrf-cookie'),
     path('api/auth/registration/', include('dj_rest_auth.registration.urls')),